@@ -0,0 +1,147 @@
+import asyncio
+import bisect
+from typing import Dict, Iterable, List, Tuple
+
+from scheduler import PRIORITY_BACKGROUND
+
+# Направления срабатывания подписки
+ALERT_ABOVE = "above"
+ALERT_BELOW = "below"
+
+# Сколько уведомлений в секунду отправлять, если у бота нет ограничителя исходящих
+# сообщений (общий лимит Telegram - около 30)
+NOTIFICATIONS_PER_SECOND = 20
+
+
+class _ThresholdList:
+    """Пороги одного направления для одной валютной пары, отсортированные по возрастанию"""
+
+    def __init__(self):
+        self.thresholds: List[float] = []
+        self.ids: List[int] = []
+
+    def add(self, threshold: float, alert_id: int):
+        index = bisect.bisect_right(self.thresholds, threshold)
+        self.thresholds.insert(index, threshold)
+        self.ids.insert(index, alert_id)
+
+    def remove(self, threshold: float, alert_id: int):
+        index = bisect.bisect_left(self.thresholds, threshold)
+        while index < len(self.ids) and self.thresholds[index] == threshold:
+            if self.ids[index] == alert_id:
+                del self.thresholds[index]
+                del self.ids[index]
+                return
+            index += 1
+
+    def pop_upto(self, rate: float) -> List[int]:
+        """Удалить и вернуть подписки с порогом <= rate"""
+        index = bisect.bisect_right(self.thresholds, rate)
+        triggered = self.ids[:index]
+        del self.thresholds[:index]
+        del self.ids[:index]
+        return triggered
+
+    def pop_from(self, rate: float) -> List[int]:
+        """Удалить и вернуть подписки с порогом >= rate"""
+        index = bisect.bisect_left(self.thresholds, rate)
+        triggered = self.ids[index:]
+        del self.thresholds[index:]
+        del self.ids[index:]
+        return triggered
+
+
+class AlertIndex:
+    """
+    Подписки на курс в памяти: для каждой пары - отсортированные массивы порогов.
+
+    Проверка всех подписок на новом снимке курсов стоит O(log n) на пару
+    плюс число сработавших подписок, а не O(n) по всем подпискам.
+    """
+
+    def __init__(self):
+        # (from_currency, to_currency) -> {направление: _ThresholdList}
+        self._pairs: Dict[Tuple[str, str], Dict[str, _ThresholdList]] = {}
+        # id подписки -> запись подписки
+        self._alerts: Dict[int, Dict] = {}
+
+    def __len__(self) -> int:
+        return len(self._alerts)
+
+    def load(self, alerts: Iterable[Dict]):
+        """Загрузить подписки (например, все активные из базы при запуске)"""
+        for alert in alerts:
+            self.add(alert)
+
+    def add(self, alert: Dict):
+        """Добавить подписку: словарь с полями id, from_currency, to_currency, direction, threshold"""
+        pair = (alert['from_currency'], alert['to_currency'])
+        directions = self._pairs.setdefault(pair, {
+            ALERT_ABOVE: _ThresholdList(),
+            ALERT_BELOW: _ThresholdList()
+        })
+        directions[alert['direction']].add(alert['threshold'], alert['id'])
+        self._alerts[alert['id']] = alert
+
+    def remove(self, alert_id: int):
+        """Удалить подписку по id"""
+        alert = self._alerts.pop(alert_id, None)
+        if alert is None:
+            return
+        pair = (alert['from_currency'], alert['to_currency'])
+        self._pairs[pair][alert['direction']].remove(alert['threshold'], alert_id)
+
+    def evaluate(self, rates: Dict[str, float]) -> List[Tuple[Dict, float]]:
+        """
+        Проверить подписки по матрице курсов {валюта: единиц за 1 базовую валюту}.
+
+        Сработавшие подписки удаляются из индекса (они одноразовые).
+
+        Returns:
+            list: Пары (подписка, текущий курс пары)
+        """
+        triggered = []
+        for (from_currency, to_currency), directions in self._pairs.items():
+            if not rates.get(from_currency) or not rates.get(to_currency):
+                continue
+            rate = rates[to_currency] / rates[from_currency]
+
+            alert_ids = directions[ALERT_ABOVE].pop_upto(rate) + directions[ALERT_BELOW].pop_from(rate)
+            for alert_id in alert_ids:
+                triggered.append((self._alerts.pop(alert_id), rate))
+        return triggered
+
+
+class NotificationQueue:
+    """
+    Очередь исходящих уведомлений.
+
+    Если у бота есть ограничитель (outbound.OutboundRateLimiter), уведомления
+    отправляются через него с фоновым приоритетом и пропускают вперед ответы
+    пользователям; иначе очередь сама отправляет не быстрее rate сообщений в секунду.
+    """
+
+    def __init__(self, rate: float = NOTIFICATIONS_PER_SECOND):
+        self.interval = 1 / rate
+        self._queue: "asyncio.Queue[Tuple[int, str]]" = asyncio.Queue()
+
+    def put(self, chat_id: int, text: str):
+        """Поставить уведомление в очередь (не блокирует)"""
+        self._queue.put_nowait((chat_id, text))
+
+    async def run(self, bot):
+        """Бесконечный цикл отправки; запускается фоновой задачей"""
+        limited = getattr(bot, "rate_limiter", None) is not None
+
+        while True:
+            chat_id, text = await self._queue.get()
+            try:
+                if limited:
+                    await bot.send_message(chat_id=chat_id, text=text,
+                                           rate_limit_args={'priority': PRIORITY_BACKGROUND})
+                else:
+                    await bot.send_message(chat_id=chat_id, text=text)
+            except Exception as e:
+                print(f"Ошибка отправки уведомления в чат {chat_id}: {e}")
+            if not limited:
+                await asyncio.sleep(self.interval)
@@ -0,0 +1,102 @@
+import time
+from typing import Dict, List, Optional
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# Окно скользящего среднего дневных трат (дни)
+ROLLING_WINDOW = 7
+
+# Перцентили сумм отдельных расходов
+PERCENTILES = (50, 90, 99)
+
+# Прогноз дальше этого срока (дни) считается "деньги не закончатся"
+MAX_RUNWAY_DAYS = 10 * 365
+
+
+def _exponential_runway(balance: float, last_burn: float, growth: float) -> Optional[float]:
+    """
+    Через сколько дней закончится balance, если дневные траты last_burn
+    каждый день умножаются на e^growth.
+
+    Сумма геометрической прогрессии last_burn * e^(g*k), k = 1..D, приравнивается
+    к balance и решается относительно D.
+    """
+    import numpy as np
+
+    if last_burn <= 0:
+        return None
+    if abs(growth) < 1e-9:
+        return balance / last_burn
+
+    ratio = np.exp(growth)
+    argument = 1 + balance * (ratio - 1) / (last_burn * ratio)
+    # Траты убывают так быстро, что их сумма никогда не достигнет баланса
+    if argument <= 0:
+        return None
+    days = float(np.log(argument) / growth)
+    return days if 0 <= days <= MAX_RUNWAY_DAYS else None
+
+
+def trip_analytics(timestamps: List[int], amounts: List[float], balance: float,
+                   now: Optional[float] = None, window: int = ROLLING_WINDOW) -> Optional[Dict]:
+    """
+    Статистика трат путешествия и прогноз, на сколько дней хватит баланса.
+
+    Все расчеты векторные (NumPy): дневные траты - bincount по номеру дня,
+    скользящее среднее - свертка, тренд - линейная регрессия логарифма дневных трат.
+
+    Args:
+        timestamps (list): Время расходов (unix-секунды)
+        amounts (list): Суммы расходов
+        balance (float): Текущий баланс в той же валюте
+        now (float, optional): Текущее время (unix-секунды)
+        window (int): Окно скользящего среднего (дни)
+
+    Returns:
+        dict: 'expenses', 'days', 'total', 'daily_mean', 'rolling_mean', 'daily_max',
+            'percentiles' {перцентиль: сумма}, 'growth' (дневной темп роста трат),
+            'runway_linear' и 'runway_exponential' (дни или None, если баланс не закончится);
+            None, если расходов нет
+    """
+    # NumPy нужен только при расчете, поэтому не замедляет запуск бота
+    import numpy as np
+
+    if not timestamps:
+        return None
+
+    amounts = np.asarray(amounts, dtype=np.float64)
+    days = np.asarray(timestamps, dtype=np.int64) // SECONDS_PER_DAY
+    first_day = days.min()
+    last_day = max(days.max(), int((now or time.time()) // SECONDS_PER_DAY))
+
+    # Траты по дням, включая дни без расходов
+    daily = np.bincount(days - first_day, weights=amounts, minlength=last_day - first_day + 1)
+
+    window = min(window, len(daily))
+    rolling = np.convolve(daily, np.ones(window) / window, mode="valid")
+
+    # Тренд: log(траты) = a + g * день по дням с тратами
+    spent = daily > 0
+    day_numbers = np.arange(len(daily))
+    growth = 0.0
+    last_burn = float(rolling[-1])
+    if spent.sum() >= 3:
+        growth, intercept = np.polyfit(day_numbers[spent], np.log(daily[spent]), 1)
+        last_burn = float(np.exp(intercept + growth * day_numbers[-1]))
+
+    daily_mean = float(daily.mean())
+    rolling_mean = float(rolling[-1])
+    burn = rolling_mean or daily_mean
+
+    return {
+        'expenses': int(len(amounts)),
+        'days': int(len(daily)),
+        'total': float(amounts.sum()),
+        'daily_mean': daily_mean,
+        'rolling_mean': rolling_mean,
+        'daily_max': float(daily.max()),
+        'percentiles': dict(zip(PERCENTILES, np.percentile(amounts, PERCENTILES).tolist())),
+        'growth': float(growth),
+        'runway_linear': balance / burn if burn > 0 and balance > 0 else None,
+        'runway_exponential': _exponential_runway(balance, last_burn, float(growth)) if balance > 0 else None
+    }
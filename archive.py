@@ -0,0 +1,115 @@
+import sqlite3
+import sys
+import time
+from typing import Dict, Optional
+
+from database import Database
+
+# Сколько путешествий выбирать за один запрос
+ARCHIVE_BATCH = 100
+
+# Пауза между путешествиями, чтобы запросы пользователей не ждали освобождения базы (секунды)
+ARCHIVE_PAUSE = 0.05
+
+# incremental_vacuum: сколько страниц освобождать за шаг и пауза между шагами (секунды)
+VACUUM_STEP_PAGES = 256
+VACUUM_PAUSE = 0.1
+
+# Режим PRAGMA auto_vacuum, при котором работает incremental_vacuum
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def archive_idle_trips(db: Database, idle_days: int, compress: bool = True,
+                       batch: int = ARCHIVE_BATCH, pause: float = ARCHIVE_PAUSE) -> Dict:
+    """
+    Перенести в архив неактивные путешествия без изменений за idle_days дней.
+
+    Каждое путешествие переносится отдельной короткой транзакцией (Database.archive_trip),
+    между путешествиями делается пауза.
+
+    Returns:
+        dict: 'trips' - перенесено путешествий, 'expenses' - расходов, 'failed' - с ошибкой,
+            'duration' - общее время, 'max_lock' - самая долгая транзакция (секунды)
+    """
+    started = time.monotonic()
+    stats = {'trips': 0, 'expenses': 0, 'failed': 0, 'duration': 0.0, 'max_lock': 0.0}
+    failed = set()
+
+    while True:
+        trip_ids = [trip_id for trip_id in db.get_idle_trip_ids(idle_days, batch + len(failed))
+                    if trip_id not in failed]
+        if not trip_ids:
+            break
+
+        for trip_id in trip_ids:
+            lock_started = time.monotonic()
+            try:
+                moved = db.archive_trip(trip_id, compress)
+            except sqlite3.Error as e:
+                failed.add(trip_id)
+                stats['failed'] += 1
+                print(f"Ошибка архивации путешествия {trip_id}: {e}")
+                continue
+            stats['max_lock'] = max(stats['max_lock'], time.monotonic() - lock_started)
+            if moved is not None:
+                stats['trips'] += 1
+                stats['expenses'] += moved
+            time.sleep(pause)
+
+    stats['duration'] = time.monotonic() - started
+    return stats
+
+
+def vacuum_incrementally(db: Database, step_pages: int = VACUUM_STEP_PAGES,
+                         pause: float = VACUUM_PAUSE, max_steps: Optional[int] = None) -> Dict:
+    """
+    Вернуть свободные страницы базы файловой системе небольшими шагами.
+
+    Требует режима auto_vacuum=INCREMENTAL (новые базы создаются в нем,
+    существующие переводит `python archive.py --full-vacuum`).
+
+    Returns:
+        dict: 'enabled' - доступен ли incremental_vacuum, 'pages' - освобождено страниц,
+            'steps', 'duration' и 'max_lock' - самый долгий шаг (секунды)
+    """
+    started = time.monotonic()
+    status = db.vacuum_status()
+    stats = {'enabled': status['auto_vacuum'] == AUTO_VACUUM_INCREMENTAL,
+             'pages': 0, 'steps': 0, 'duration': 0.0, 'max_lock': 0.0}
+    if not stats['enabled']:
+        return stats
+
+    remaining = status['freelist_count']
+    while remaining and (max_steps is None or stats['steps'] < max_steps):
+        step_started = time.monotonic()
+        left = db.incremental_vacuum_step(step_pages)
+        stats['max_lock'] = max(stats['max_lock'], time.monotonic() - step_started)
+        stats['steps'] += 1
+        # Другие процессы могли освободить страницы за время шага
+        stats['pages'] += max(0, remaining - left)
+        if left >= remaining:
+            break
+        remaining = left
+        time.sleep(pause)
+
+    stats['duration'] = time.monotonic() - started
+    return stats
+
+
+def run_maintenance(db: Database, idle_days: int, compress: bool = True) -> Dict:
+    """Архивация старых путешествий и затем освобождение места в основной базе"""
+    return {
+        'archive': archive_idle_trips(db, idle_days, compress),
+        'vacuum': vacuum_incrementally(db)
+    }
+
+
+if __name__ == "__main__":
+    # Использование: python archive.py [дней без изменений]
+    #                python archive.py --full-vacuum   (однократный перевод базы в auto_vacuum=INCREMENTAL)
+    database = Database()
+    if sys.argv[1:] == ["--full-vacuum"]:
+        database.full_vacuum()
+        print(database.vacuum_status())
+    else:
+        print(run_maintenance(database, int(sys.argv[1]) if len(sys.argv) > 1 else 180))
@@ -0,0 +1,139 @@
+import sys
+import time
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import currency_api
+from database import Database
+
+# Длина интервала дат в одном запросе /timeframe (API допускает до 365 дней)
+CHUNK_DAYS = 30
+
+# Сколько интервалов загружать одновременно
+MAX_CONCURRENCY = 2
+
+# Интервал, отклоненный планировщиком из-за лимита запросов, повторяется с растущей паузой
+THROTTLE_RETRIES = 3
+THROTTLE_DELAY = 2.0
+
+# Курсы хранятся относительно одной валюты, кросс-курсы считаются при чтении
+BASE_CURRENCY = "USD"
+
+
+def chunk_ranges(start: date, end: date, chunk_days: int = CHUNK_DAYS) -> List[Tuple[date, date]]:
+    """
+    Разбить период на интервалы по chunk_days дней, выровненные по общей сетке.
+
+    Границы интервалов не зависят от start и end, поэтому контрольные точки
+    одного запуска подходят для любого следующего, даже с другим периодом.
+    """
+    first = start.toordinal() // chunk_days * chunk_days
+    return [(date.fromordinal(max(ordinal, 1)), date.fromordinal(ordinal + chunk_days - 1))
+            for ordinal in range(first, end.toordinal() + 1, chunk_days)]
+
+
+def plan_backfill(db: Database, currencies: List[str], start: date, end: date,
+                  chunk_days: int = CHUNK_DAYS) -> List[Tuple[date, date, List[str]]]:
+    """Интервалы, которые еще нужно загрузить: список (начало, конец, валюты без контрольной точки)"""
+    completed = db.get_completed_rate_chunks(currencies)
+    plan = []
+    for chunk_start, chunk_end in chunk_ranges(start, end, chunk_days):
+        missing = [code for code in currencies if (code, chunk_start.isoformat()) not in completed]
+        if missing:
+            plan.append((chunk_start, chunk_end, missing))
+    return plan
+
+
+def _quotes_to_rows(quotes: Dict, source: str) -> List[Tuple[str, str, float]]:
+    """{"2024-01-31": {"USDEUR": 0.92}} -> [("2024-01-31", "USD", 1.0), ("2024-01-31", "EUR", 0.92)]"""
+    rows = []
+    for day, day_quotes in quotes.items():
+        rows.append((day, source, 1.0))
+        for pair, value in (day_quotes or {}).items():
+            if pair.startswith(source) and value:
+                rows.append((day, pair[len(source):], float(value)))
+    return rows
+
+
+def load_chunk(db: Database, chunk_start: date, chunk_end: date, currencies: List[str],
+               today: Optional[date] = None) -> Dict:
+    """
+    Загрузить и сохранить один интервал.
+
+    Returns:
+        dict: 'success' (bool), 'rows' (int) - сохранено курсов, 'error' (str)
+    """
+    today = today or date.today()
+    request_end = min(chunk_end, today)
+
+    for attempt in range(THROTTLE_RETRIES + 1):
+        result = currency_api.get_timeframe(chunk_start.isoformat(), request_end.isoformat(),
+                                            source=BASE_CURRENCY, currencies=currencies)
+        if result['success'] or not result['throttled'] or attempt == THROTTLE_RETRIES:
+            break
+        time.sleep(THROTTLE_DELAY * (attempt + 1))
+
+    if not result['success']:
+        return {'success': False, 'rows': 0, 'error': result['error']}
+
+    rows = _quotes_to_rows(result['quotes'], BASE_CURRENCY)
+    # Интервал, который еще не закончился, будет догружен при следующем запуске
+    completed = currencies if chunk_end < today else []
+    saved = db.save_rate_chunk(chunk_start.isoformat(), chunk_end.isoformat(), rows, completed)
+    return {'success': True, 'rows': saved, 'error': None}
+
+
+def run_backfill(db: Database, start: date, end: Optional[date] = None,
+                 currencies: Optional[List[str]] = None, max_concurrency: int = MAX_CONCURRENCY,
+                 chunk_days: int = CHUNK_DAYS) -> Dict:
+    """
+    Догрузить исторические курсы за период в локальную таблицу historical_rates.
+
+    Загружаются только интервалы без контрольной точки, не больше max_concurrency
+    запросов одновременно. Каждый интервал сохраняется вместе со своей контрольной
+    точкой, поэтому прерванную загрузку можно просто запустить снова.
+
+    Args:
+        db (Database): База данных
+        start (date): Первый день периода
+        end (date, optional): Последний день периода (по умолчанию сегодня)
+        currencies (list, optional): Валюты; по умолчанию все валюты путешествий и кошельков
+        max_concurrency (int): Сколько интервалов загружать одновременно
+        chunk_days (int): Длина интервала в днях
+
+    Returns:
+        dict: 'chunks' - загружено интервалов, 'failed' - с ошибкой, 'rows' - сохранено курсов,
+            'duration' - время загрузки (секунды)
+    """
+    # Пул потоков нужен только во время загрузки
+    from concurrent.futures import ThreadPoolExecutor
+
+    started = time.monotonic()
+    today = date.today()
+    end = min(end or today, today)
+    currencies = sorted(set(currencies if currencies is not None else db.get_trip_currencies()))
+    plan = plan_backfill(db, currencies, start, end, chunk_days) if currencies else []
+
+    stats = {'chunks': 0, 'failed': 0, 'rows': 0, 'duration': 0.0}
+    if plan:
+        with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="backfill") as executor:
+            futures = [executor.submit(load_chunk, db, chunk_start, chunk_end, missing, today)
+                       for chunk_start, chunk_end, missing in plan]
+            for (chunk_start, chunk_end, _), future in zip(plan, futures):
+                result = future.result()
+                if result['success']:
+                    stats['chunks'] += 1
+                    stats['rows'] += result['rows']
+                else:
+                    stats['failed'] += 1
+                    print(f"Ошибка загрузки курсов за {chunk_start} - {chunk_end}: {result['error']}")
+
+    stats['duration'] = time.monotonic() - started
+    return stats
+
+
+if __name__ == "__main__":
+    # Использование: python backfill.py [дней назад] [валюта ...]
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 90
+    codes = [code.upper() for code in sys.argv[2:]] or None
+    print(run_backfill(Database(), date.today() - timedelta(days=days), currencies=codes))
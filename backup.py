@@ -0,0 +1,260 @@
+import contextlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from database import Database
+
+# Сколько страниц копировать за шаг и пауза между шагами (секунды)
+BACKUP_STEP_PAGES = 64
+BACKUP_PAUSE = 0.01
+
+# Запись в базу другим соединением перезапускает пошаговое копирование с начала.
+# После стольких перезапусков база копируется за один шаг (в режиме WAL это
+# одна читающая транзакция, писателей она не блокирует)
+MAX_RESTARTS = 3
+
+# Как часто активный замер (python backup.py --probe) берет блокировку на запись (секунды)
+STALL_PROBE_INTERVAL = 0.05
+
+TIMESTAMP_FORMAT = "%Y%m%d-%H%M%S"
+
+
+class _Restarted(Exception):
+    """Пошаговое копирование перезапускалось слишком часто"""
+
+
+class _StallProbe:
+    """
+    Фоновый замер задержки писателей: периодически берет блокировку на запись
+    (BEGIN IMMEDIATE без изменений) и запоминает самое долгое ожидание.
+
+    Замер сам конкурирует с настоящими писателями, поэтому включается только
+    вручную из командной строки, а не при копировании из работающего бота.
+    """
+
+    def __init__(self, path: str, interval: float = STALL_PROBE_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.max_stall = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="backup-stall-probe", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            while not self._stop.wait(self.interval):
+                started = time.monotonic()
+                conn.execute("BEGIN IMMEDIATE")
+                self.max_stall = max(self.max_stall, time.monotonic() - started)
+                conn.execute("ROLLBACK")
+        except sqlite3.Error as e:
+            print(f"Ошибка замера блокировок при копировании: {e}")
+        finally:
+            conn.close()
+
+
+def copy_database(source_path: str, target_path: str, pages: int = BACKUP_STEP_PAGES,
+                  pause: float = BACKUP_PAUSE) -> Dict:
+    """
+    Скопировать базу через SQLite backup API небольшими шагами с паузами между ними.
+
+    Копия пишется во временный файл, проверяется PRAGMA quick_check
+    и только после этого переименовывается в target_path.
+
+    Returns:
+        dict: 'pages' - размер базы в страницах, 'steps', 'restarts' - перезапусков
+            из-за записи в базу, 'duration' (секунды)
+    """
+    started = time.monotonic()
+    temp_path = f"{target_path}.tmp"
+    stats = {'pages': 0, 'steps': 0, 'restarts': 0, 'duration': 0.0}
+    remaining_before = None
+
+    def progress(status, remaining, total):
+        nonlocal remaining_before
+        stats['steps'] += 1
+        stats['pages'] = total
+        if remaining_before is not None and remaining > remaining_before:
+            stats['restarts'] += 1
+            if stats['restarts'] > MAX_RESTARTS:
+                raise _Restarted()
+        remaining_before = remaining
+        if remaining:
+            time.sleep(pause)
+
+    source = sqlite3.connect(source_path)
+    try:
+        target = sqlite3.connect(temp_path)
+        try:
+            try:
+                source.backup(target, pages=pages, progress=progress)
+            except _Restarted:
+                source.backup(target)
+            check = target.execute("PRAGMA quick_check").fetchone()[0]
+        finally:
+            target.close()
+    finally:
+        source.close()
+
+    if check != "ok":
+        os.remove(temp_path)
+        raise sqlite3.DatabaseError(f"Копия базы повреждена: {check}")
+    os.replace(temp_path, target_path)
+
+    stats['duration'] = time.monotonic() - started
+    return stats
+
+
+def _backup_prefix(db_path: str) -> str:
+    return os.path.splitext(os.path.basename(db_path))[0] + "-"
+
+
+def list_backups(db_path: str, backup_dir: str) -> List[str]:
+    """Копии базы db_path в backup_dir, от старых к новым"""
+    if not os.path.isdir(backup_dir):
+        return []
+    prefix = _backup_prefix(db_path)
+    names = sorted(name for name in os.listdir(backup_dir)
+                   if name.startswith(prefix) and name.endswith(".db")
+                   and name[len(prefix):-3].replace("-", "").isdigit())
+    return [os.path.join(backup_dir, name) for name in names]
+
+
+def rotate_backups(db_path: str, backup_dir: str, keep: int) -> int:
+    """Удалить старые копии базы, оставив keep последних; вернуть, сколько удалено"""
+    backups = list_backups(db_path, backup_dir)
+    outdated = backups[:-keep] if keep > 0 else []
+    for path in outdated:
+        os.remove(path)
+    return len(outdated)
+
+
+def run_backup(db: Database, backup_dir: str, keep: int, pages: int = BACKUP_STEP_PAGES,
+               pause: float = BACKUP_PAUSE, probe: bool = False) -> Dict:
+    """
+    Сделать копию основной базы (и архива, если он есть) и удалить старые копии.
+
+    Ожидание писателей считается по записям в путешествия через db за время
+    копирования (разность Database.contention_stats()). probe=True дополнительно
+    включает активный замер _StallProbe.
+
+    Returns:
+        dict: 'success' (bool), 'files' - созданные копии, 'duration' - общее время,
+            'writes' - записей через db за время копирования, 'contended' - из них
+            ждали блокировку, 'wait_time' - суммарное ожидание (секунды),
+            'max_stall' - самое долгое ожидание активного замера (None без probe),
+            'restarts', 'removed' - удалено старых копий, 'error' (str)
+    """
+    started = time.monotonic()
+    os.makedirs(backup_dir, exist_ok=True)
+    stamp = datetime.now().strftime(TIMESTAMP_FORMAT)
+    result = {'success': False, 'files': [], 'duration': 0.0, 'writes': 0, 'contended': 0,
+              'wait_time': 0.0, 'max_stall': None, 'restarts': 0, 'removed': 0, 'error': None}
+
+    sources = [db.db_name] + ([db.archive_name] if os.path.exists(db.archive_name) else [])
+    contention_before = db.contention_stats()
+    try:
+        with _StallProbe(db.db_name) if probe else contextlib.nullcontext() as stall_probe:
+            for source_path in sources:
+                target_path = os.path.join(backup_dir, f"{_backup_prefix(source_path)}{stamp}.db")
+                stats = copy_database(source_path, target_path, pages, pause)
+                result['files'].append(target_path)
+                result['restarts'] += stats['restarts']
+        if stall_probe:
+            result['max_stall'] = stall_probe.max_stall
+
+        contention_after = db.contention_stats()
+        for key in ('writes', 'contended', 'wait_time'):
+            result[key] = contention_after[key] - contention_before[key]
+
+        for source_path in sources:
+            result['removed'] += rotate_backups(source_path, backup_dir, keep)
+        result['success'] = True
+    except (OSError, sqlite3.Error) as e:
+        result['error'] = str(e)
+
+    result['duration'] = time.monotonic() - started
+    return result
+
+
+def restore_backup(backup_path: str, target_path: str, pages: int = BACKUP_STEP_PAGES) -> Dict:
+    """
+    Восстановить базу target_path из копии через backup API.
+
+    Бот на время восстановления нужно остановить: база заменяется целиком.
+
+    Returns:
+        dict: 'success' (bool), 'pages', 'duration', 'error' (str)
+    """
+    started = time.monotonic()
+    result = {'success': False, 'pages': 0, 'duration': 0.0, 'error': None}
+    if not os.path.exists(backup_path):
+        result['error'] = f"Файл {backup_path} не найден"
+        return result
+
+    try:
+        source = sqlite3.connect(backup_path)
+        try:
+            check = source.execute("PRAGMA quick_check").fetchone()[0]
+            if check != "ok":
+                raise sqlite3.DatabaseError(f"Копия базы повреждена: {check}")
+            target = sqlite3.connect(target_path)
+            try:
+                source.backup(target, pages=pages)
+            finally:
+                target.close()
+            result['pages'] = source.execute("PRAGMA page_count").fetchone()[0]
+        finally:
+            source.close()
+        result['success'] = True
+    except sqlite3.Error as e:
+        result['error'] = str(e)
+
+    result['duration'] = time.monotonic() - started
+    return result
+
+
+def _restore_target(db: Database, backup_path: str) -> Optional[str]:
+    """База, копией которой является файл: основная или архив"""
+    name = os.path.basename(backup_path)
+    for db_path in (db.archive_name, db.db_name):
+        if name.startswith(_backup_prefix(db_path)):
+            return db_path
+    return None
+
+
+if __name__ == "__main__":
+    # Использование: python backup.py                 - сделать копию
+    #                python backup.py --probe         - сделать копию и замерить ожидание писателей
+    #                python backup.py --list          - список копий
+    #                python backup.py --restore ФАЙЛ  - восстановить базу из копии (бот должен быть остановлен)
+    from settings import get_settings
+
+    settings = get_settings()
+    database = Database()
+    if sys.argv[1:2] == ["--list"]:
+        for path in list_backups(database.db_name, settings.backup_dir) + \
+                list_backups(database.archive_name, settings.backup_dir):
+            print(path)
+    elif sys.argv[1:2] == ["--restore"] and len(sys.argv) == 3:
+        target = _restore_target(database, sys.argv[2])
+        if target is None:
+            print(f"Не удалось определить, копией какой базы является {sys.argv[2]}")
+        else:
+            print(restore_backup(sys.argv[2], target))
+    else:
+        print(run_backup(database, settings.backup_dir, settings.backup_keep,
+                         probe=sys.argv[1:2] == ["--probe"]))
@@ -1,24 +1,47 @@
 import sys
-import os
-import re
-from decimal import Decimal, InvalidOperation
-from typing import Dict, Optional
-from dotenv import load_dotenv
+import asyncio
+import csv
+import io
+import json
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, CallbackQueryHandler,
-    ContextTypes, ConversationHandler, filters
+    ContextTypes, ConversationHandler, InlineQueryHandler, filters
 )
 import currency_api
+from analytics import trip_analytics
+from alerts import ALERT_ABOVE, ALERT_BELOW, AlertIndex, NotificationQueue
+from archive import run_maintenance
+from backup import run_backup
+from backfill import run_backfill
+from callbacks import CALLBACK_SEPARATOR, CallbackRouter, PendingActionStore, encode_callback, encode_int, decode_int
 from database import Database
+from settings import get_settings
+from expense_parser import parse_expense_message
+from market_rates import follow_market_rates
+from inline_mode import (
+    DEFAULT_TARGETS, INLINE_CACHE_TIME, RenderedResultCache, normalize_query,
+    parse_conversion_query, render_conversions
+)
+from outbound import GLOBAL_RATE, OutboundRateLimiter
+from profiler import SamplingProfiler
+from scheduler import PRIORITY_BACKGROUND
+from sharding import shard_for_user
+import tracing
+from wallets import revalue_pockets
+from warm_cache import load_snapshot, save_snapshot
 
 # Устанавливаем кодировку UTF-8 для вывода в консоль Windows
 if sys.platform == 'win32':
     sys.stdout.reconfigure(encoding='utf-8')
     sys.stderr.reconfigure(encoding='utf-8')
 
-# Загружаем переменные окружения
-load_dotenv()
+# Настройки загружаются один раз за процесс
+settings = get_settings()
 
 # Состояния для ConversationHandler
 WAITING_FROM_COUNTRY, WAITING_TO_COUNTRY, WAITING_RATE_CONFIRM, WAITING_MANUAL_RATE, WAITING_INITIAL_BALANCE = range(5)
@@ -29,6 +52,47 @@ db = Database()
 # Словарь для хранения временных данных пользователей
 user_data: Dict[int, Dict] = {}
 
+# Неподтвержденные действия (расходы), на которые ссылаются токены в inline-кнопках
+PENDING_ACTION_TTL = 24 * 60 * 60
+pending_actions = PendingActionStore(ttl=PENDING_ACTION_TTL)
+
+# Подписки на курс в памяти (загружаются в build_application) и очередь уведомлений по ним
+alert_index = AlertIndex()
+notification_queue = NotificationQueue()
+
+# Доли бюджета, при пересечении которых пользователь получает предупреждение
+BUDGET_WARNING_LEVELS = (0.8, 1.0)
+
+# Ответ участнику общего путешествия, который пытается вручную изменить курс с автообновлением
+MARKET_RATE_LOCKED_TEXT = (
+    "❌ Курс этого путешествия обновляется по рынку. Изменить его вручную "
+    "или выключить автообновление (/follow off) может только владелец путешествия."
+)
+
+# Как часто догружать исторические курсы (секунды)
+RATE_BACKFILL_INTERVAL = 24 * 60 * 60
+
+# Как часто архивировать старые путешествия и освобождать место в базе (секунды)
+ARCHIVE_INTERVAL = 24 * 60 * 60
+
+# Как часто каждый воркер проверяет свои подписки на курс без активности пользователей (секунды)
+ALERT_CHECK_INTERVAL = 60
+
+# Максимальная длительность профилирования по команде /profile (секунды)
+PROFILE_MAX_SECONDS = 300
+
+# Готовые ответы на inline-запросы конвертации
+inline_results = RenderedResultCache()
+
+# Таблица маршрутов inline-кнопок, заполняется после объявления обработчиков
+callback_router = CallbackRouter()
+
+# Экспорт: порог, после которого временный файл сбрасывается из памяти на диск
+EXPORT_SPOOL_MAX_SIZE = 1024 * 1024
+EXPORT_FIELDS = ["id", "created_at", "amount_to", "to_currency",
+                 "amount_from", "from_currency", "amount_original",
+                 "currency_original", "description"]
+
 
 def get_main_menu() -> InlineKeyboardMarkup:
     """Главное меню бота"""
@@ -68,38 +132,16 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    user_id = update.effective_user.id
-    data = query.data
-    
-    if data == "new_trip":
-        await new_trip_command(update, context)
-    elif data == "my_trips":
-        await my_trips_command(update, context)
-    elif data == "balance":
-        await balance_command(update, context)
-    elif data == "history":
-        await history_command(update, context)
-    elif data == "change_rate":
-        await change_rate_command(update, context)
-    elif data.startswith("switch_trip_"):
-        trip_id = int(data.split("_")[2])
-        await switch_trip(update, context, trip_id)
-    elif data.startswith("confirm_expense_"):
-        parts = data.split("_")
-        amount_from = float(parts[2])
-        amount_to = float(parts[3])
-        await confirm_expense(update, context, amount_from, amount_to)
-    elif data.startswith("cancel_expense"):
-        await query.edit_message_text("❌ Расход не учтен.", reply_markup=get_main_menu())
-    elif data == "main_menu":
-        await query.edit_message_text("Главное меню:", reply_markup=get_main_menu())
-    elif data == "cancel_rate_change":
-        user_id = update.effective_user.id
-        if 'changing_rate' in context.user_data:
-            del context.user_data['changing_rate']
-        await query.edit_message_text("❌ Изменение курса отменено.", reply_markup=get_main_menu())
-    elif data == "skip_initial_balance":
-        await skip_initial_balance(update, context)
+    # Поиск обработчика по префиксу callback_data - O(1) по таблице маршрутов
+    route = callback_router.resolve(query.data)
+    if route is None:
+        return
+    
+    handler, arg = route
+    if arg is None:
+        await handler(update, context)
+    else:
+        await handler(update, context, arg)
 
 
 async def new_trip_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -146,7 +188,7 @@ async def process_to_country(update: Update, context: ContextTypes.DEFAULT_TYPE)
     from_country = user_data[user_id]["from_country"]
     
     # Получаем список валют через API
-    currencies_result = currency_api.get_supported_currencies()
+    currencies_result = await asyncio.to_thread(currency_api.get_supported_currencies)
     
     if not currencies_result['success']:
         await update.message.reply_text(
@@ -196,7 +238,7 @@ async def process_to_country(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
     
     # Конвертируем 1 единицу для получения курса
-    conversion_result = currency_api.convert_currency(from_currency, to_currency, 1)
+    conversion_result = await asyncio.to_thread(currency_api.convert_currency, from_currency, to_currency, 1)
     
     if not conversion_result.get('success'):
         await update.message.reply_text(
@@ -339,6 +381,7 @@ async def process_initial_balance(update: Update, context: ContextTypes.DEFAULT_
             exchange_rate=rate,
             initial_balance=initial_balance
         )
+        schedule_trip_backfill(context.application, from_currency, to_currency)
         
         initial_balance_to = initial_balance * rate
         
@@ -395,6 +438,7 @@ async def skip_initial_balance(update: Update, context: ContextTypes.DEFAULT_TYP
         exchange_rate=rate,
         initial_balance=0
     )
+    schedule_trip_backfill(context.application, from_currency, to_currency)
     
     await query.edit_message_text(
         f"✅ Путешествие создано!\n\n"
@@ -443,15 +487,16 @@ async def my_trips_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = "✈️ Ваши путешествия:\n\n"
     
     for trip in trips:
-        status = "✅ Активно" if trip['is_active'] else ""
-        text += f"{status} {trip['name']}\n"
+        status = "✅ Активно" if trip['is_active'] else ("🗄 В архиве" if trip.get('archived') else "")
+        shared = "👥 " if trip.get('shared') else ""
+        text += f"{status} {shared}{trip['name']}\n"
         text += f"   💱 {trip['from_currency']} → {trip['to_currency']}\n"
         text += f"   💰 {format_balance(trip['balance_from'], trip['balance_to'], trip['from_currency'], trip['to_currency'])}\n\n"
         
         if not trip['is_active']:
             keyboard.append([InlineKeyboardButton(
                 f"🔄 Активировать: {trip['name']}",
-                callback_data=f"switch_trip_{trip['id']}"
+                callback_data=encode_callback("sw", encode_int(trip['id']))
             )])
     
     keyboard.append([InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")])
@@ -539,6 +584,9 @@ async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # amount_from - в домашней валюте (from_currency)
             # amount_to - в валюте пребывания (to_currency)
             text += f"💸 {expense['amount_to']:.2f} {trip['to_currency']} = {expense['amount_from']:.2f} {trip['from_currency']}\n"
+            # Расход, оплаченный в третьей валюте
+            if expense['currency_original'] and expense['currency_original'] != trip['to_currency']:
+                text += f"   💳 {expense['amount_original']:.2f} {expense['currency_original']}\n"
             if expense['description']:
                 text += f"   📝 {expense['description']}\n"
             text += f"   📅 {expense['created_at']}\n\n"
@@ -549,13 +597,70 @@ async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(text, reply_markup=get_main_menu())
 
 
+def format_runway(days: Optional[float]) -> str:
+    """Прогноз в днях -> '12 дн. (до 31.10.2026)' или 'не закончатся'"""
+    if days is None:
+        return "не закончатся"
+    return f"{days:.0f} дн. (до {(date.today() + timedelta(days=days)):%d.%m.%Y})"
+
+
+async def analytics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /analytics - статистика трат и прогноз, на сколько хватит денег"""
+    user_id = update.effective_user.id
+    trip = db.get_active_trip(user_id)
+    
+    if not trip:
+        await update.message.reply_text("❌ У вас нет активного путешествия.", reply_markup=get_main_menu())
+        return
+    
+    timestamps, amounts_to, _ = db.get_expense_columns(trip['id'], user_id)
+    balance = db.get_balance(trip['id'], user_id)
+    balance_to = balance[1] if balance else trip['balance_to']
+    stats = trip_analytics(timestamps, amounts_to, balance_to)
+    
+    if not stats:
+        await update.message.reply_text(f"📈 {trip['name']}: пока нет расходов.", reply_markup=get_main_menu())
+        return
+    
+    currency = trip['to_currency']
+    percentiles = ", ".join(f"p{p}: {value:.2f}" for p, value in stats['percentiles'].items())
+    text = (
+        f"📈 Аналитика: {trip['name']}\n\n"
+        f"Расходов: {stats['expenses']} за {stats['days']} дн., всего {stats['total']:.2f} {currency}\n"
+        f"В среднем в день: {stats['daily_mean']:.2f} {currency}\n"
+        f"За последние дни (скользящее среднее): {stats['rolling_mean']:.2f} {currency}\n"
+        f"Самый дорогой день: {stats['daily_max']:.2f} {currency}\n"
+        f"Размер расхода: {percentiles} {currency}\n"
+        f"Траты меняются на {stats['growth'] * 100:+.1f}% в день\n\n"
+    )
+    if balance_to <= 0:
+        text += "💸 Баланс исчерпан."
+    else:
+        text += (
+            f"💰 Остаток: {balance_to:.2f} {currency}\n"
+            f"При текущем темпе деньги закончатся через {format_runway(stats['runway_linear'])}\n"
+            f"С учетом тренда: через {format_runway(stats['runway_exponential'])}"
+        )
+    
+    await update.message.reply_text(text, reply_markup=get_main_menu())
+
+
+def rate_locked_by_market(trip: Dict) -> bool:
+    """
+    Курс путешествия с автообновлением меняет только владелец: ручной курс выключает
+    автообновление, а выключить его участник не может, и курс участника
+    перезаписывался бы следующим обновлением по рынку.
+    """
+    return bool(trip.get('shared') and trip.get('follow_market'))
+
+
 async def change_rate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Изменить курс обмена"""
     user_id = update.effective_user.id
     trip = db.get_active_trip(user_id)
     
-    if not trip:
-        text = "❌ У вас нет активного путешествия."
+    if not trip or rate_locked_by_market(trip):
+        text = "❌ У вас нет активного путешествия." if not trip else MARKET_RATE_LOCKED_TEXT
         if isinstance(update, Update) and update.callback_query:
             await update.callback_query.edit_message_text(text, reply_markup=get_main_menu())
         else:
@@ -593,12 +698,26 @@ async def process_new_rate(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("❌ Ошибка: путешествие не найдено.", reply_markup=get_main_menu())
             return ConversationHandler.END
         
+        # Владелец мог включить автообновление, пока участник вводил курс
+        trip = db.get_trip(trip_id, user_id)
+        if trip and rate_locked_by_market(trip):
+            del context.user_data['changing_rate']
+            await update.message.reply_text(MARKET_RATE_LOCKED_TEXT, reply_markup=get_main_menu())
+            return ConversationHandler.END
+        
         if db.update_exchange_rate(trip_id, user_id, new_rate):
             trip = db.get_trip(trip_id, user_id)
+            
+            # Курс, заданный вручную, отключает автообновление по рынку
+            follow_note = ""
+            if trip.get('follow_market') and db.set_follow_market(trip_id, user_id, False):
+                follow_note = "\n\n📡 Автообновление курса выключено (/follow on - включить снова)."
+            
             await update.message.reply_text(
                 f"✅ Курс обновлен!\n\n"
                 f"Новый курс: 1 {trip['from_currency']} = {new_rate:.6f} {trip['to_currency']}\n\n"
-                f"{format_balance(trip['balance_from'], trip['balance_to'], trip['from_currency'], trip['to_currency'])}",
+                f"{format_balance(trip['balance_from'], trip['balance_to'], trip['from_currency'], trip['to_currency'])}"
+                f"{follow_note}",
                 reply_markup=get_main_menu()
             )
         else:
@@ -618,7 +737,7 @@ async def process_new_rate(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def handle_number_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка сообщения с числом (расход)"""
+    """Обработка сообщения с одной или несколькими суммами (расходы)"""
     # Пропускаем, если пользователь в процессе создания путешествия или изменения курса
     if context.user_data.get('changing_rate') or update.effective_user.id in user_data:
         return
@@ -629,102 +748,779 @@ async def handle_number_message(update: Update, context: ContextTypes.DEFAULT_TY
     if not trip:
         return  # Не показываем сообщение, если нет активного путешествия
     
-    try:
-        # Пытаемся извлечь число из сообщения
-        text = update.message.text.strip()
-        
-        # Проверяем, что это похоже на число (только цифры, точка, запятая, возможно пробелы)
-        if not re.match(r'^[\d\s.,]+$', text):
-            return  # Не число, игнорируем
-        
-        # Удаляем все символы кроме цифр, точки и запятой
-        cleaned = re.sub(r'[^\d.,]', '', text)
-        if not cleaned:
-            return
-        
-        cleaned = cleaned.replace(',', '.')
-        
-        # Проверяем, что это действительно число
-        # Введенное число - это сумма в валюте страны назначения (пребывания)
-        amount_in_destination = float(cleaned)
-        
-        if amount_in_destination <= 0:
-            return
-        
-        # Конвертируем из валюты страны назначения (to_currency) в домашнюю валюту (from_currency)
-        conversion_result = currency_api.convert_currency(
-            trip['to_currency'],  # Из валюты пребывания
-            trip['from_currency'],  # В домашнюю валюту
-            amount_in_destination
-        )
-        
-        if not conversion_result.get('success'):
-            # Используем сохраненный курс (обратный)
-            # Курс хранится как 1 from_currency = rate to_currency
-            # Значит 1 to_currency = 1/rate from_currency
-            amount_in_home = amount_in_destination / trip['exchange_rate']
-        else:
-            amount_in_home = conversion_result.get('result', amount_in_destination / trip['exchange_rate'])
-            if amount_in_home:
-                amount_in_home = float(amount_in_home)
-            else:
-                amount_in_home = amount_in_destination / trip['exchange_rate']
-        
-        # Сохраняем временные данные для подтверждения
-        # amount_from - в домашней валюте (from_currency)
-        # amount_to - в валюте пребывания (to_currency)
-        context.user_data['pending_expense'] = {
-            'amount_from': amount_in_home,
-            'amount_to': amount_in_destination
-        }
-        
-        keyboard = [
-            [
-                InlineKeyboardButton("✅ Да", callback_data=f"confirm_expense_{amount_in_home}_{amount_in_destination}"),
-                InlineKeyboardButton("❌ Нет", callback_data="cancel_expense")
-            ]
-        ]
-        
+    # Суммы без указания валюты - в валюте страны назначения (пребывания).
+    # Несколько сумм разделяются пробелами: "120 45 3*100", валюту можно указать: "20 EUR", "€20"
+    parsed = parse_expense_message(update.message.text, currency_api.SUPPORTED_CURRENCIES)
+    if not parsed:
+        return  # Не суммы, игнорируем
+    
+    amounts, currency = parsed
+    currency = currency or trip['to_currency']
+    
+    # Один набор курсов на все суммы сообщения. Запросы к API (и ожидание квоты планировщика)
+    # выполняются в потоке, чтобы не останавливать обработку других обновлений
+    rates = await asyncio.to_thread(get_expense_rates, trip, currency)
+    if not rates:
         await update.message.reply_text(
-            f"💸 {amount_in_destination:.2f} {trip['to_currency']} = {amount_in_home:.2f} {trip['from_currency']}\n\n"
-            f"Учесть как расход?",
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            f"❌ Не удалось получить курс {currency}. Попробуйте позже или введите сумму в {trip['to_currency']}."
         )
-        
-    except (ValueError, InvalidOperation):
-        # Не число, игнорируем
-        pass
+        return
+    
+    rate_from, rate_to = rates
+    
+    # amount_from - в домашней валюте (from_currency)
+    # amount_to - в валюте пребывания (to_currency)
+    # amount_original - в валюте оплаты (currency)
+    expenses = [(amount * rate_from, amount * rate_to, amount) for amount in amounts]
+    
+    # Данные для подтверждения остаются на сервере, в кнопки кладется только короткий токен
+    token = pending_actions.put({
+        'user_id': user_id,
+        'trip_id': trip['id'],
+        'expenses': expenses,
+        'currency': currency,
+        'rate_version': trip['rate_version']
+    })
+    
+    keyboard = [
+        [
+            InlineKeyboardButton("✅ Да", callback_data=encode_callback("ce", token)),
+            InlineKeyboardButton("❌ Нет", callback_data=encode_callback("xe", token))
+        ]
+    ]
+    
+    if len(expenses) == 1:
+        question = "Учесть как расход?"
+    else:
+        question = f"Учесть как {len(expenses)} расхода(ов)?"
+    
+    await update.message.reply_text(
+        f"{format_expenses(expenses, trip, currency)}\n\n{question}",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+
+def get_expense_rates(trip: Dict, currency: str) -> Optional[Tuple[float, float]]:
+    """
+    Курсы пересчета 1 единицы currency в валюты путешествия.
+    
+    Returns:
+        tuple: (курс в from_currency, курс в to_currency) или None, если курс неизвестен
+    """
+    # Курс путешествия хранится как 1 from_currency = exchange_rate to_currency
+    if currency == trip['to_currency']:
+        rate_from = currency_api.get_cached_rate(currency, trip['from_currency'])
+        # Если курс получить не удалось, используем сохраненный (обратный)
+        return (rate_from or 1 / trip['exchange_rate'], 1.0)
+    
+    if currency == trip['from_currency']:
+        rate_to = currency_api.get_cached_rate(currency, trip['to_currency'])
+        return (1.0, rate_to or trip['exchange_rate'])
+    
+    # Третья валюта: обе стороны считаем по локальной матрице кросс-курсов
+    rate_from = currency_api.get_cross_rate(currency, trip['from_currency'])
+    rate_to = currency_api.get_cross_rate(currency, trip['to_currency'])
+    if not rate_from or not rate_to:
+        return None
+    return (rate_from, rate_to)
+
+
+def format_expenses(expenses: List[Tuple[float, float, float]], trip: Dict, currency: str) -> str:
+    """Форматирование списка расходов (amount_from, amount_to, amount_original) с итогом"""
+    def format_line(amount_from, amount_to, amount_original):
+        line = f"{amount_to:.2f} {trip['to_currency']} = {amount_from:.2f} {trip['from_currency']}"
+        if currency != trip['to_currency']:
+            line = f"{amount_original:.2f} {currency} = {line}"
+        return line
+    
+    lines = [f"💸 {format_line(*expense)}" for expense in expenses]
+    if len(expenses) > 1:
+        totals = [sum(column) for column in zip(*expenses)]
+        lines.append(f"Итого: {format_line(*totals)}")
+    return "\n".join(lines)
 
 
 async def confirm_expense(update: Update, context: ContextTypes.DEFAULT_TYPE, 
-                         amount_from: float, amount_to: float):
-    """Подтверждение расхода"""
+                         pending: Optional[Dict]):
+    """Подтверждение одного или нескольких расходов"""
     query = update.callback_query
     await query.answer()
     
     user_id = update.effective_user.id
-    trip = db.get_active_trip(user_id)
     
-    if not trip:
+    if not pending:
+        await query.edit_message_text("❌ Расход уже учтен или устарел.", reply_markup=get_main_menu())
+        return
+    
+    # Суммы посчитаны в валютах путешествия, для которого расход создан, - в него он и вносится,
+    # даже если пользователь с тех пор переключился на другое путешествие (/join, /switch).
+    # В снимках кэша, сохраненных до появления trip_id, его нет
+    trip_id = pending.get('trip_id')
+    trip = db.get_trip(trip_id, user_id) if trip_id else db.get_active_trip(user_id)
+    
+    if not trip or trip.get('archived'):
         await query.edit_message_text("❌ Ошибка: путешествие не найдено.", reply_markup=get_main_menu())
         return
     
-    # Добавляем расход
+    expenses = pending['expenses']
+    currency = pending['currency']
+    
+    # Добавляем все расходы одной транзакцией
     # amount_from - в домашней валюте (from_currency)
     # amount_to - в валюте пребывания (to_currency)
-    db.add_expense(trip['id'], user_id, amount_from, amount_to)
+    # amount_original - в валюте оплаты (currency)
+    added = db.add_expenses(trip['id'], user_id, expenses, currency_original=currency,
+                            expected_rate_version=pending.get('rate_version'))
+    if added is None:
+        # Курс сменили (например, другой участник общего путешествия), пока расход ждал подтверждения
+        await query.edit_message_text(
+            "⚠️ Курс путешествия изменился, расход не учтен.\n\nОтправьте сумму еще раз, чтобы пересчитать ее по новому курсу.",
+            reply_markup=get_main_menu()
+        )
+        return
     
-    # Получаем обновленный баланс
+    # Получаем обновленный баланс и счетчики бюджета (без суммирования истории)
     balance = db.get_balance(trip['id'], user_id)
+    warnings = budget_warnings(db.get_budget(trip['id']), sum(expense[1] for expense in expenses),
+                               trip['to_currency'])
     
     await query.edit_message_text(
         f"✅ Расход учтен!\n\n"
-        f"💸 {amount_to:.2f} {trip['to_currency']} = {amount_from:.2f} {trip['from_currency']}\n\n"
-        f"{format_balance(balance[0], balance[1], trip['from_currency'], trip['to_currency'])}",
+        f"{format_expenses(expenses, trip, currency)}\n\n"
+        f"{format_balance(balance[0], balance[1], trip['from_currency'], trip['to_currency'])}"
+        + "".join(f"\n\n{warning}" for warning in warnings),
         reply_markup=get_main_menu()
     )
 
 
+def budget_warnings(budget: Optional[Dict], added: float, currency: str) -> List[str]:
+    """
+    Предупреждения о пересеченных порогах бюджета после расхода на сумму added.
+    
+    Порог пересечен, если до расхода потраченное было ниже него, а после - не ниже.
+    """
+    if not budget:
+        return []
+    
+    warnings = []
+    for title, spent, limit in (("дневного", budget['spent_day'], budget['daily_limit']),
+                                ("общего", budget['spent_total'], budget['total_limit'])):
+        if not limit:
+            continue
+        crossed = [level for level in BUDGET_WARNING_LEVELS if spent - added < level * limit <= spent]
+        if not crossed:
+            continue
+        if max(crossed) >= 1:
+            warnings.append(f"🚨 Превышение {title} бюджета: {spent:.2f} из {limit:.2f} {currency}")
+        else:
+            warnings.append(f"⚠️ Потрачено {spent / limit:.0%} {title} бюджета: {spent:.2f} из {limit:.2f} {currency}")
+    return warnings
+
+
+async def budget_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /budget [day|total <сумма>|off] - бюджет активного путешествия"""
+    user_id = update.effective_user.id
+    trip = db.get_active_trip(user_id)
+    
+    if not trip:
+        await update.message.reply_text("❌ У вас нет активного путешествия.", reply_markup=get_main_menu())
+        return
+    
+    currency = trip['to_currency']
+    budget = db.get_budget(trip['id'])
+    args = [arg.lower() for arg in context.args]
+    
+    # Участники общего путешествия видят бюджет, но задает его только владелец
+    if args and trip.get('shared'):
+        await update.message.reply_text("❌ Бюджет может изменить только владелец путешествия.")
+        return
+    
+    if args and args[0] == "off":
+        if db.delete_budget(trip['id'], user_id):
+            await update.message.reply_text("✅ Бюджет путешествия удален.")
+        else:
+            await update.message.reply_text("ℹ️ Бюджет путешествия не задан.")
+        return
+    
+    if args:
+        try:
+            kind = args[0]
+            limit = float(args[1].replace(",", "."))
+            if kind not in ("day", "total") or limit <= 0:
+                raise ValueError
+        except (ValueError, IndexError):
+            await update.message.reply_text(
+                f"❌ Используйте: /budget day 1500 или /budget total 30000 (в {currency}), /budget off"
+            )
+            return
+        
+        daily_limit = budget['daily_limit'] if budget else None
+        total_limit = budget['total_limit'] if budget else None
+        if kind == "day":
+            daily_limit = limit
+        else:
+            total_limit = limit
+        if not db.set_budget(trip['id'], user_id, daily_limit, total_limit):
+            await update.message.reply_text("❌ Не удалось изменить бюджет путешествия.")
+            return
+        budget = db.get_budget(trip['id'])
+    
+    if not budget:
+        await update.message.reply_text(
+            f"💼 Бюджет не задан.\n\n"
+            f"/budget day <сумма> - на день\n/budget total <сумма> - на все путешествие\n"
+            f"Суммы - в {currency}."
+        )
+        return
+    
+    lines = [f"💼 Бюджет: {trip['name']}"]
+    if budget['daily_limit']:
+        lines.append(f"Сегодня: {budget['spent_day']:.2f} из {budget['daily_limit']:.2f} {currency}")
+    if budget['total_limit']:
+        lines.append(f"Всего: {budget['spent_total']:.2f} из {budget['total_limit']:.2f} {currency}")
+    await update.message.reply_text("\n".join(lines))
+
+
+async def follow_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /follow [on|off] - автообновление курса активного путешествия по рынку"""
+    user_id = update.effective_user.id
+    trip = db.get_active_trip(user_id)
+    
+    if not trip:
+        await update.message.reply_text("❌ У вас нет активного путешествия.", reply_markup=get_main_menu())
+        return
+    
+    pair = f"{trip['from_currency']} → {trip['to_currency']}"
+    args = [arg.lower() for arg in context.args]
+    
+    if not args:
+        state = "включено" if trip['follow_market'] else "выключено"
+        await update.message.reply_text(
+            f"📡 Автообновление курса {pair} {state}.\n\n"
+            f"/follow on - обновлять курс по рынку\n/follow off - выключить"
+        )
+        return
+    
+    if args[0] not in ("on", "off"):
+        await update.message.reply_text("❌ Используйте: /follow on или /follow off")
+        return
+    
+    if args[0] == "off":
+        if not db.set_follow_market(trip['id'], user_id, False):
+            await update.message.reply_text("❌ Автообновление курса может выключить только владелец путешествия.")
+            return
+        await update.message.reply_text(f"✅ Автообновление курса выключено. Курс {pair} останется прежним.")
+        return
+    
+    if not db.set_follow_market(trip['id'], user_id, True):
+        await update.message.reply_text("❌ Автообновление курса может включить только владелец путешествия.")
+        return
+    
+    rate = await asyncio.to_thread(currency_api.get_cross_rate, trip['from_currency'], trip['to_currency'])
+    if not rate:
+        await update.message.reply_text(
+            f"✅ Курс {pair} будет обновляться по рынку.\n\n"
+            f"Рыночный курс сейчас недоступен, он будет установлен при следующем обновлении."
+        )
+        return
+    
+    db.update_exchange_rate(trip['id'], user_id, rate)
+    await update.message.reply_text(
+        f"✅ Курс {pair} будет обновляться по рынку.\n\n"
+        f"Текущий курс: 1 {trip['from_currency']} = {rate:.6f} {trip['to_currency']}"
+    )
+
+
+async def share_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /share - пригласить участников в активное путешествие"""
+    user_id = update.effective_user.id
+    trip = db.get_active_trip(user_id)
+    
+    if not trip:
+        await update.message.reply_text("❌ У вас нет активного путешествия.", reply_markup=get_main_menu())
+        return
+    
+    members = db.get_trip_members(trip['id'])
+    if trip.get('shared'):
+        await update.message.reply_text(
+            f"👥 {trip['name']} - общее путешествие, участников: {len(members) + 1}.\n\n"
+            f"Пригласить новых участников может только владелец. Выйти: /leave"
+        )
+        return
+    
+    code = db.create_invite(trip['id'], user_id)
+    await update.message.reply_text(
+        f"👥 Общее путешествие: {trip['name']}\n\n"
+        f"Чтобы присоединиться, участник отправляет боту:\n/join {code}\n\n"
+        f"Все участники вносят расходы в общий баланс. Сейчас участников: {len(members) + 1}."
+    )
+
+
+async def join_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /join <код> - присоединиться к общему путешествию"""
+    if len(context.args) != 1:
+        await update.message.reply_text("❌ Используйте: /join <код приглашения>")
+        return
+    
+    user_id = update.effective_user.id
+    trip = db.join_trip(context.args[0], user_id)
+    if not trip:
+        await update.message.reply_text("❌ Приглашение не найдено. Проверьте код.")
+        return
+    
+    await update.message.reply_text(
+        f"✅ Вы присоединились к путешествию {trip['name']}.\n\n"
+        f"Теперь ваши расходы учитываются в общем балансе.\n\n"
+        f"{format_balance(trip['balance_from'], trip['balance_to'], trip['from_currency'], trip['to_currency'])}",
+        reply_markup=get_main_menu()
+    )
+
+
+async def leave_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /leave - выйти из активного общего путешествия"""
+    user_id = update.effective_user.id
+    trip = db.get_active_trip(user_id)
+    
+    if not trip or not trip.get('shared'):
+        await update.message.reply_text("❌ Активное путешествие не общее или принадлежит вам.")
+        return
+    
+    db.leave_trip(trip['id'], user_id)
+    await update.message.reply_text(f"✅ Вы вышли из путешествия {trip['name']}.", reply_markup=get_main_menu())
+
+
+async def pockets_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /pockets - валютные кошельки активного путешествия"""
+    user_id = update.effective_user.id
+    trip = db.get_active_trip(user_id)
+    
+    if not trip:
+        await update.message.reply_text("❌ У вас нет активного путешествия.", reply_markup=get_main_menu())
+        return
+    
+    pockets = db.get_pockets(trip['id'], user_id)
+    if not pockets:
+        await update.message.reply_text(
+            f"👛 В путешествии {trip['name']} пока нет валютных кошельков.\n\n"
+            f"Пополните кошелек командой /pocket <валюта> <сумма>, например: /pocket EUR 200"
+        )
+        return
+    
+    text = f"👛 Кошельки путешествия {trip['name']}:\n\n"
+    for pocket in pockets:
+        text += f"💵 {pocket['amount']:,.2f} {pocket['currency']} ≈ {pocket['value_from']:,.2f} {trip['from_currency']}\n"
+    total = sum(pocket['value_from'] for pocket in pockets)
+    text += f"\nИтого: ≈ {total:,.2f} {trip['from_currency']}"
+    
+    await update.message.reply_text(text)
+
+
+async def pocket_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /pocket <валюта> <сумма> - пополнение (или списание) кошелька"""
+    user_id = update.effective_user.id
+    trip = db.get_active_trip(user_id)
+    
+    if not trip:
+        await update.message.reply_text("❌ У вас нет активного путешествия.", reply_markup=get_main_menu())
+        return
+    
+    try:
+        if len(context.args) != 2:
+            raise ValueError("Используйте: /pocket <валюта> <сумма>, например: /pocket EUR 200")
+        
+        currency = context.args[0].upper()
+        if currency not in currency_api.SUPPORTED_CURRENCIES:
+            raise ValueError(f"Неизвестная валюта: {currency}")
+        
+        amount = float(context.args[1].replace(",", "."))
+    except ValueError as e:
+        await update.message.reply_text(f"❌ Ошибка: {str(e)}")
+        return
+    
+    rate = await asyncio.to_thread(currency_api.get_cached_rate, currency, trip['from_currency'])
+    if not rate:
+        await update.message.reply_text(f"❌ Не удалось получить курс {currency}. Попробуйте позже.")
+        return
+    
+    pocket = db.add_to_pocket(trip['id'], user_id, currency, amount, rate)
+    
+    await update.message.reply_text(
+        f"✅ Кошелек {currency} обновлен!\n\n"
+        f"💵 {pocket['amount']:,.2f} {currency} ≈ {pocket['value_from']:,.2f} {trip['from_currency']}"
+    )
+
+
+def check_rate_alerts(rates: Dict[str, float]):
+    """Проверить все подписки на новом снимке курсов и поставить уведомления в очередь"""
+    triggered = alert_index.evaluate(rates)
+    if not triggered:
+        return
+    
+    db.deactivate_alerts([alert['id'] for alert, _ in triggered])
+    for alert, rate in triggered:
+        sign = "≥" if alert['direction'] == ALERT_ABOVE else "≤"
+        notification_queue.put(
+            alert['chat_id'],
+            f"🔔 Курс {alert['from_currency']}/{alert['to_currency']} достиг порога!\n\n"
+            f"1 {alert['from_currency']} = {rate:.6f} {alert['to_currency']} ({sign} {alert['threshold']:g})"
+        )
+
+
+async def alert_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /alert <из> <в> [>|<] <порог> - подписка на курс"""
+    user_id = update.effective_user.id
+    args = list(context.args)
+    
+    try:
+        direction = None
+        if len(args) == 4 and args[2] in (">", "<"):
+            direction = ALERT_ABOVE if args.pop(2) == ">" else ALERT_BELOW
+        
+        if len(args) != 3:
+            raise ValueError("Используйте: /alert <из> <в> [>|<] <порог>, например: /alert THB RUB > 2.5")
+        
+        from_currency, to_currency = args[0].upper(), args[1].upper()
+        for currency in (from_currency, to_currency):
+            if currency not in currency_api.SUPPORTED_CURRENCIES:
+                raise ValueError(f"Неизвестная валюта: {currency}")
+        
+        threshold = float(args[2].replace(",", "."))
+        if threshold <= 0:
+            raise ValueError("Порог должен быть положительным числом")
+    except ValueError as e:
+        await update.message.reply_text(f"❌ Ошибка: {str(e)}")
+        return
+    
+    rate = await asyncio.to_thread(currency_api.get_cross_rate, from_currency, to_currency)
+    if direction is None:
+        if not rate:
+            await update.message.reply_text("❌ Не удалось получить текущий курс. Укажите направление: > или <")
+            return
+        # Без явного направления ждем пересечения порога с текущей стороны
+        direction = ALERT_ABOVE if threshold > rate else ALERT_BELOW
+    
+    alert = db.add_alert(user_id, update.effective_chat.id, from_currency, to_currency, direction, threshold)
+    alert_index.add(alert)
+    
+    sign = ">" if direction == ALERT_ABOVE else "<"
+    text = f"🔔 Подписка #{alert['id']}: 1 {from_currency} {sign} {threshold:g} {to_currency}"
+    if rate:
+        text += f"\n\nТекущий курс: 1 {from_currency} = {rate:.6f} {to_currency}"
+    await update.message.reply_text(text)
+
+
+async def alerts_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /alerts - список активных подписок"""
+    alerts = db.get_alerts(update.effective_user.id)
+    
+    if not alerts:
+        await update.message.reply_text("🔕 У вас нет активных подписок на курс.\n\nДобавьте: /alert THB RUB > 2.5")
+        return
+    
+    text = "🔔 Ваши подписки на курс:\n\n"
+    for alert in alerts:
+        sign = ">" if alert['direction'] == ALERT_ABOVE else "<"
+        text += f"#{alert['id']}: 1 {alert['from_currency']} {sign} {alert['threshold']:g} {alert['to_currency']}\n"
+    text += "\nУдалить подписку: /unalert <номер>"
+    await update.message.reply_text(text)
+
+
+async def unalert_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /unalert <номер> - удаление подписки"""
+    try:
+        alert_id = int(context.args[0].lstrip("#"))
+    except (IndexError, ValueError):
+        await update.message.reply_text("❌ Используйте: /unalert <номер подписки>")
+        return
+    
+    if db.delete_alert(alert_id, update.effective_user.id):
+        alert_index.remove(alert_id)
+        await update.message.reply_text(f"✅ Подписка #{alert_id} удалена.")
+    else:
+        await update.message.reply_text(f"❌ Подписка #{alert_id} не найдена.")
+
+
+async def save_warm_cache_periodically(path: str, interval: float):
+    """Периодически сохранять снимок кэшей на диск"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            save_snapshot(path, pending_actions)
+        except OSError as e:
+            print(f"Ошибка сохранения снимка кэша: {e}")
+
+
+async def check_alerts_periodically(interval: float):
+    """
+    Каждые interval секунд проверять подписки на курс этого воркера.
+    
+    Обновление матрицы курсов запросом пользователя тоже проверяет подписки,
+    но без активности пользователей (и подписки пользователей других воркеров)
+    проверяются только здесь.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        if not len(alert_index):
+            continue
+        try:
+            # Матрица берется из общего снимка shared_rates.py, если он свежий, иначе запрашивается
+            # с фоновым приоритетом и не расходует резерв квоты для пользователей
+            rates = await asyncio.to_thread(currency_api.get_rate_matrix, interval, PRIORITY_BACKGROUND)
+            if rates:
+                check_rate_alerts(rates)
+        except Exception as e:
+            print(f"Ошибка проверки подписок на курс: {e}")
+
+
+async def backfill_rates_periodically(days: int):
+    """Раз в сутки догружать исторические курсы валют всех путешествий за последние days дней"""
+    while True:
+        start = date.today() - timedelta(days=days)
+        try:
+            stats = await asyncio.to_thread(run_backfill, db, start)
+            if stats['chunks'] or stats['failed']:
+                print(f"📈 Исторические курсы загружены: {stats}")
+        except Exception as e:
+            print(f"Ошибка загрузки исторических курсов: {e}")
+        await asyncio.sleep(RATE_BACKFILL_INTERVAL)
+
+
+async def archive_trips_periodically(idle_days: int):
+    """Раз в сутки переносить в архив путешествия без изменений за idle_days дней"""
+    while True:
+        try:
+            stats = await asyncio.to_thread(run_maintenance, db, idle_days, settings.archive_compress)
+            if stats['archive']['trips'] or stats['vacuum']['pages']:
+                print(f"🗄 Архивация путешествий: {stats}")
+        except Exception as e:
+            print(f"Ошибка архивации путешествий: {e}")
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+
+
+async def follow_market_rates_periodically(interval: float):
+    """Каждые interval секунд обновлять курс путешествий с автообновлением по одной матрице курсов"""
+    while True:
+        try:
+            rates = await asyncio.to_thread(currency_api.get_rate_matrix, interval, PRIORITY_BACKGROUND)
+            if rates:
+                updated = await asyncio.to_thread(follow_market_rates, db, rates)
+                if updated:
+                    print(f"📡 Курс обновлен по рынку в {updated} путешествиях")
+        except Exception as e:
+            print(f"Ошибка обновления курсов путешествий: {e}")
+        await asyncio.sleep(interval)
+
+
+async def backup_periodically(interval: float):
+    """Каждые interval секунд делать резервную копию базы, не останавливая бота"""
+    while True:
+        await asyncio.sleep(interval)
+        result = await asyncio.to_thread(run_backup, db, settings.backup_dir, settings.backup_keep)
+        if result['success']:
+            print(f"💾 Резервная копия базы: {result['duration']:.2f} с, "
+                  f"записей за время копирования: {result['writes']}, ждали блокировку: {result['contended']} "
+                  f"({result['wait_time'] * 1000:.1f} мс), удалено старых копий: {result['removed']}")
+        else:
+            print(f"Ошибка резервного копирования базы: {result['error']}")
+
+
+def schedule_trip_backfill(application: Application, from_currency: str, to_currency: str):
+    """Догрузить в фоне исторические курсы валют нового путешествия"""
+    if settings.rate_backfill_days:
+        start = date.today() - timedelta(days=settings.rate_backfill_days)
+        application.create_task(
+            asyncio.to_thread(run_backfill, db, start, currencies=[from_currency, to_currency])
+        )
+
+
+async def on_startup(application: Application):
+    """Запуск фоновых задач после инициализации приложения"""
+    application.create_task(notification_queue.run(application.bot))
+    application.create_task(save_warm_cache_periodically(
+        application.bot_data['warm_cache_file'], settings.warm_cache_interval
+    ))
+    
+    # Матрица курсов обновляется и в потоках (asyncio.to_thread), а индекс подписок
+    # и очередь уведомлений принадлежат циклу событий: проверка переносится в него
+    loop = asyncio.get_running_loop()
+    currency_api.add_rate_listener(lambda rates: loop.call_soon_threadsafe(check_rate_alerts, rates))
+    # Подписки проверяет каждый воркер: в его индексе только подписки его пользователей
+    application.create_task(check_alerts_periodically(ALERT_CHECK_INTERVAL))
+    
+    # В режиме воркеров общие для всех пользователей задачи выполняет только первый воркер
+    shard = application.bot_data.get('shard')
+    if settings.rate_backfill_days and (shard is None or shard[0] == 0):
+        application.create_task(backfill_rates_periodically(settings.rate_backfill_days))
+    if settings.archive_after_days and (shard is None or shard[0] == 0):
+        application.create_task(archive_trips_periodically(settings.archive_after_days))
+    if settings.market_rate_interval and (shard is None or shard[0] == 0):
+        application.create_task(follow_market_rates_periodically(settings.market_rate_interval))
+    if settings.backup_interval and (shard is None or shard[0] == 0):
+        application.create_task(backup_periodically(settings.backup_interval))
+
+
+async def on_shutdown(application: Application):
+    """Сохранение снимка кэшей при остановке бота"""
+    size = save_snapshot(application.bot_data['warm_cache_file'], pending_actions)
+    print(f"💾 Снимок кэша сохранен ({size} байт)")
+
+
+def write_expenses_export(trip: Dict, user_id: int, fmt: str, out) -> int:
+    """
+    Записать расходы путешествия в бинарный поток out в формате CSV или JSON Lines.
+    
+    Расходы читаются из базы потоково и пишутся построчно, поэтому
+    потребление памяти не зависит от количества расходов.
+    Возвращает количество записанных строк.
+    """
+    text_out = io.TextIOWrapper(out, encoding="utf-8", newline="", write_through=True)
+    count = 0
+    try:
+        writer = None
+        if fmt == "csv":
+            writer = csv.DictWriter(text_out, fieldnames=EXPORT_FIELDS)
+            writer.writeheader()
+        
+        for expense in db.iter_expenses(trip['id'], user_id):
+            # amount_from - в домашней валюте (from_currency)
+            # amount_to - в валюте пребывания (to_currency)
+            row = {
+                "id": expense['id'],
+                "created_at": expense['created_at'],
+                "amount_to": expense['amount_to'],
+                "to_currency": trip['to_currency'],
+                "amount_from": expense['amount_from'],
+                "from_currency": trip['from_currency'],
+                # Старые расходы без валюты оплаты считаем оплаченными в to_currency
+                "amount_original": expense['amount_original'] if expense['currency_original'] else expense['amount_to'],
+                "currency_original": expense['currency_original'] or trip['to_currency'],
+                "description": expense['description'] or "",
+            }
+            if writer:
+                writer.writerow(row)
+            else:
+                text_out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            count += 1
+    finally:
+        # Отсоединяем обертку, чтобы она не закрыла исходный поток
+        text_out.detach()
+    return count
+
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /export [csv|json] - выгрузка расходов активного путешествия"""
+    user_id = update.effective_user.id
+    trip = db.get_active_trip(user_id)
+    
+    if not trip:
+        await update.message.reply_text("❌ У вас нет активного путешествия.", reply_markup=get_main_menu())
+        return
+    
+    fmt = context.args[0].lower() if context.args else "csv"
+    if fmt in ("json", "jsonl"):
+        fmt = "jsonl"
+    elif fmt != "csv":
+        await update.message.reply_text("❌ Неизвестный формат. Используйте: /export csv или /export json")
+        return
+    
+    with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE, mode="w+b") as spool:
+        count = write_expenses_export(trip, user_id, fmt, spool)
+        spool.seek(0)
+        
+        await update.message.reply_document(
+            document=spool,
+            filename=f"trip_{trip['id']}_expenses.{fmt}",
+            caption=f"📤 {trip['name']}: {count} расходов"
+        )
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /profile [секунды] - профилирование работающего бота (для администраторов)"""
+    if update.effective_user.id not in settings.admin_user_ids:
+        await update.message.reply_text("❌ Команда доступна только администраторам.")
+        return
+    
+    try:
+        seconds = float(context.args[0]) if context.args else 30
+    except ValueError:
+        seconds = 0
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        await update.message.reply_text(f"❌ Укажите длительность от 1 до {PROFILE_MAX_SECONDS} секунд: /profile 30")
+        return
+    
+    profiler = context.bot_data.get('profiler')
+    if profiler and profiler.running:
+        await update.message.reply_text("⏳ Профилирование уже идет, дождитесь отчета.")
+        return
+    
+    profiler = SamplingProfiler(settings.profiler_interval)
+    context.bot_data['profiler'] = profiler
+    profiler.start()
+    await update.message.reply_text(f"🔬 Профилирую {seconds:g} с, затем пришлю отчет.")
+    
+    # Обновления обрабатываются по одному, поэтому ждем в фоновой задаче, а не в обработчике
+    context.application.create_task(
+        send_profile_report(context.bot, update.effective_chat.id, profiler, seconds, db.contention_stats())
+    )
+
+
+def format_contention(before: Dict, after: Dict) -> str:
+    """Конкуренция записей в путешествия за время профилирования (разность двух contention_stats())"""
+    writes = after['writes'] - before['writes']
+    if not writes:
+        return "✍️ Записей в путешествия не было."
+    wait = after['wait_time'] - before['wait_time']
+    return (
+        f"✍️ Записей в путешествия: {writes}, ждали блокировку: {after['contended'] - before['contended']}, "
+        f"среднее ожидание {wait / writes * 1000:.1f} мс "
+        f"(максимум с запуска {after['max_wait'] * 1000:.1f} мс), "
+        f"отклонено из-за смены курса: {after['conflicts'] - before['conflicts']}"
+    )
+
+
+async def send_profile_report(bot, chat_id: int, profiler: SamplingProfiler, seconds: float,
+                              contention_before: Dict):
+    """Остановить профилировщик через seconds секунд и отправить отчет и стеки для flamegraph"""
+    await asyncio.sleep(seconds)
+    profiler.stop()
+    
+    report = profiler.report(limit=10)
+    await bot.send_message(chat_id=chat_id,
+                           text=f"{report}\n\n{format_contention(contention_before, db.contention_stats())}")
+    await bot.send_document(
+        chat_id=chat_id,
+        document=profiler.collapsed().encode("utf-8"),
+        filename="profile.collapsed.txt",
+        caption="🔥 Стеки в формате collapsed: flamegraph.pl или speedscope.app"
+    )
+
+
+async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Inline-режим: "@бот 100 usd thb" в любом чате - конвертация по локальной матрице курсов"""
+    inline_query = update.inline_query
+    parsed = parse_conversion_query(inline_query.query, currency_api.SUPPORTED_CURRENCIES)
+    if not parsed:
+        await inline_query.answer([], cache_time=INLINE_CACHE_TIME)
+        return
+    
+    # Матрица обновляется не чаще раза в RATE_CACHE_TTL, поэтому запросы не доходят до API
+    rates = await asyncio.to_thread(currency_api.get_rate_matrix)
+    if not rates:
+        await inline_query.answer([], cache_time=0)
+        return
+    
+    # Время матрицы в ключе: после обновления курсов ответы рендерятся заново
+    key = normalize_query(parsed) + (currency_api.get_rate_matrix_timestamp(),)
+    results = inline_results.get(key)
+    if results is None:
+        amount, from_currency, to_currency = key[:3]
+        targets = [to_currency] if to_currency else DEFAULT_TARGETS
+        results = render_conversions(Decimal(amount), from_currency, targets, rates)
+        inline_results.put(key, results)
+    
+    await inline_query.answer(results, cache_time=INLINE_CACHE_TIME)
+
+
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Отмена операции"""
     user_id = update.effective_user.id
@@ -748,17 +1544,191 @@ async def cancel_rate_change_handler(update: Update, context: ContextTypes.DEFAU
     return ConversationHandler.END
 
 
-def main():
-    """Главная функция запуска бота"""
-    # Получаем токен из переменных окружения
-    token = os.getenv("TELEGRAM_BOT_TOKEN")
-    
-    if not token:
-        print("❌ Ошибка: TELEGRAM_BOT_TOKEN не найден в .env файле")
+async def switch_trip_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    """Кнопка "Активировать": аргумент - закодированный id путешествия"""
+    await switch_trip(update, context, decode_int(arg))
+
+
+async def confirm_expense_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, token: str):
+    """Кнопка "Да": аргумент - токен отложенного расхода"""
+    # Сначала проверяем владельца: чужое нажатие не должно удалять отложенный расход
+    pending = pending_actions.get(token)
+    if pending and pending['user_id'] != update.effective_user.id:
+        return
+    if pending:
+        pending_actions.pop(token)
+    await confirm_expense(update, context, pending)
+
+
+async def cancel_expense_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, token: str = None):
+    """Кнопка "Нет": отказ от учета расхода"""
+    if token:
+        pending = pending_actions.get(token)
+        if pending and pending['user_id'] != update.effective_user.id:
+            return
+        pending_actions.pop(token)
+    await update.callback_query.edit_message_text("❌ Расход не учтен.", reply_markup=get_main_menu())
+
+
+async def legacy_switch_trip_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    """Кнопка "Активировать" старого формата switch_trip_<id>"""
+    if arg.isdigit():
+        await switch_trip(update, context, int(arg))
+
+
+async def legacy_confirm_expense_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    """
+    Кнопка "Да" старого формата confirm_expense_<сумма в from_currency>_<сумма в to_currency>:
+    суммы хранятся в самой кнопке, расход вносится в активное путешествие.
+    """
+    try:
+        amount_from, amount_to = (float(part) for part in arg.split("_"))
+    except ValueError:
         return
     
-    # Создаем приложение
-    application = Application.builder().token(token).build()
+    trip = db.get_active_trip(update.effective_user.id)
+    await confirm_expense(update, context, {
+        'user_id': update.effective_user.id,
+        'expenses': [(amount_from, amount_to, amount_to)],
+        'currency': trip['to_currency'] if trip else None
+    })
+
+
+async def legacy_confirm_expenses_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    """
+    Кнопка "Да" старого формата confirm_expenses_<номер>: расходы хранились в памяти
+    процесса и не пережили перезапуск, поэтому они считаются устаревшими.
+    """
+    await confirm_expense(update, context, None)
+
+
+async def legacy_cancel_expense_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    """Кнопка "Нет" старого формата cancel_expense_<номер>"""
+    await cancel_expense_callback(update, context)
+
+
+async def main_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка возврата в главное меню"""
+    await update.callback_query.edit_message_text("Главное меню:", reply_markup=get_main_menu())
+
+
+async def cancel_rate_change_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка отмены изменения курса вне диалога"""
+    if 'changing_rate' in context.user_data:
+        del context.user_data['changing_rate']
+    await update.callback_query.edit_message_text("❌ Изменение курса отменено.", reply_markup=get_main_menu())
+
+
+# Маршруты inline-кнопок: префикс callback_data -> обработчик
+callback_router.register("new_trip", new_trip_command)
+callback_router.register("my_trips", my_trips_command)
+callback_router.register("balance", balance_command)
+callback_router.register("history", history_command)
+callback_router.register("change_rate", change_rate_command)
+callback_router.register("main_menu", main_menu_callback)
+callback_router.register("cancel_rate_change", cancel_rate_change_callback)
+callback_router.register("skip_initial_balance", skip_initial_balance)
+callback_router.register("sw", switch_trip_callback)
+callback_router.register("ce", confirm_expense_callback)
+callback_router.register("xe", cancel_expense_callback)
+callback_router.register("cancel_expense", cancel_expense_callback)
+
+# Старые форматы callback_data (до коротких кодов) - для кнопок в уже отправленных сообщениях.
+# Их можно удалить, когда такие сообщения перестанут использоваться
+callback_router.register_legacy("switch_trip_", legacy_switch_trip_callback)
+callback_router.register_legacy("confirm_expenses_", legacy_confirm_expenses_callback)
+callback_router.register_legacy("confirm_expense_", legacy_confirm_expense_callback)
+callback_router.register_legacy("cancel_expense_", legacy_cancel_expense_callback)
+
+
+def _update_attrs(update: object) -> Dict:
+    """Атрибуты корневого спана трассы обновления"""
+    if not isinstance(update, Update):
+        return {'type': type(update).__name__}
+    attrs = {'update_id': update.update_id}
+    if update.effective_user:
+        attrs['user_id'] = update.effective_user.id
+    if update.callback_query:
+        attrs['type'] = "callback_query"
+        attrs['callback'] = (update.callback_query.data or "").split(CALLBACK_SEPARATOR, 1)[0]
+    elif update.inline_query:
+        attrs['type'] = "inline_query"
+    elif update.effective_message:
+        attrs['type'] = "message"
+        text = update.effective_message.text or ""
+        if text.startswith("/"):
+            attrs['command'] = text.split()[0].split("@", 1)[0]
+    return attrs
+
+
+class TracedApplication(Application):
+    """Application, в котором обработка каждого Update - отдельная трасса (tracing.py)"""
+
+    async def process_update(self, update: object) -> None:
+        if not tracing.is_enabled():
+            return await super().process_update(update)
+        with tracing.trace("update", **_update_attrs(update)):
+            return await super().process_update(update)
+
+
+def build_application(token: str, shard: Optional[Tuple[int, int]] = None) -> Application:
+    """
+    Создать приложение бота со всеми обработчиками.
+    
+    Args:
+        token (str): Токен бота
+        shard (tuple, optional): (номер, количество) воркера в режиме sharding.py.
+            Воркер обрабатывает только своих пользователей, получает обновления
+            от супервизора (без собственного polling) и хранит свой снимок кэша.
+    
+    Returns:
+        Application: Приложение, готовое к запуску
+    """
+    warm_cache_file = settings.warm_cache_file
+    trace_file = settings.trace_file
+    # Лимит Telegram общий для бота: воркеры делят его поровну. Лимиты чатов не делятся -
+    # пользователь (и его личный чат) всегда обрабатывается одним воркером
+    global_rate = GLOBAL_RATE / shard[1] if shard else GLOBAL_RATE
+    # Все исходящие запросы к Telegram проходят через ограничитель частоты (outbound.py)
+    builder = (
+        Application.builder()
+        .application_class(TracedApplication)
+        .token(token)
+        .rate_limiter(OutboundRateLimiter(global_rate))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    
+    if shard:
+        index, count = shard
+        warm_cache_file = f"{warm_cache_file}.{index}"
+        # Каждый воркер пишет трассы в свой файл: ротация из нескольких процессов небезопасна
+        trace_file = trace_file and f"{trace_file}.{index}"
+        builder = builder.updater(None)
+        # Подписки других пользователей проверяют их воркеры, иначе уведомления дублировались бы
+        alert_index.load(
+            alert for alert in db.get_active_alerts()
+            if shard_for_user(alert['user_id'], count) == index
+        )
+    else:
+        alert_index.load(db.get_active_alerts())
+    
+    if trace_file:
+        tracing.configure(trace_file, settings.trace_max_bytes, settings.trace_backups, settings.trace_slow_ms)
+    
+    # Восстанавливаем кэши курсов и неподтвержденные действия после перезапуска
+    restored = load_snapshot(warm_cache_file, pending_actions)
+    if restored:
+        print(f"♻️ Кэш восстановлен: {restored}")
+    
+    application = builder.build()
+    application.bot_data['warm_cache_file'] = warm_cache_file
+    application.bot_data['shard'] = shard
+    
+    # При каждом обновлении матрицы курсов пересчитываем стоимость всех кошельков разом
+    # (подписки на курс проверяются так же, обработчик добавляется в on_startup).
+    # Воркер пересчитывает только кошельки путешествий своих пользователей
+    currency_api.add_rate_listener(lambda rates: revalue_pockets(db, rates, shard))
     
     # ConversationHandler для создания путешествия
     trip_conv_handler = ConversationHandler(
@@ -810,14 +1780,44 @@ def main():
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("balance", balance_command))
     application.add_handler(CommandHandler("history", history_command))
+    application.add_handler(CommandHandler("analytics", analytics_command))
+    application.add_handler(CommandHandler("budget", budget_command))
+    application.add_handler(CommandHandler("follow", follow_command))
+    application.add_handler(CommandHandler("share", share_command))
+    application.add_handler(CommandHandler("join", join_command))
+    application.add_handler(CommandHandler("leave", leave_command))
     application.add_handler(CommandHandler("switch", my_trips_command))
+    application.add_handler(CommandHandler("export", export_command))
+    application.add_handler(CommandHandler("pockets", pockets_command))
+    application.add_handler(CommandHandler("pocket", pocket_command))
+    application.add_handler(CommandHandler("alert", alert_command))
+    application.add_handler(CommandHandler("alerts", alerts_command))
+    application.add_handler(CommandHandler("unalert", unalert_command))
+    if settings.profiler_enabled:
+        application.add_handler(CommandHandler("profile", profile_command))
     application.add_handler(trip_conv_handler)
     application.add_handler(rate_conv_handler)
     application.add_handler(CallbackQueryHandler(button_handler))
+    application.add_handler(InlineQueryHandler(inline_query_handler))
     
     # Обработчик чисел (расходы) - должен быть последним
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_number_message))
     
+    return application
+
+
+def main():
+    """Главная функция запуска бота"""
+    # Получаем токен из настроек
+    token = settings.telegram_bot_token
+    
+    if not token:
+        print("❌ Ошибка: TELEGRAM_BOT_TOKEN не найден в .env файле")
+        return
+    
+    # Создаем приложение
+    application = build_application(token)
+    
     # Запускаем бота
     print("🤖 Бот запущен...")
     application.run_polling(allowed_updates=Update.ALL_TYPES)
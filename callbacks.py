@@ -0,0 +1,170 @@
+import base64
+import secrets
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Ограничение Telegram на размер callback_data (байты)
+MAX_CALLBACK_DATA_SIZE = 64
+
+# Разделитель между префиксом действия и его аргументом: "sw:Aw"
+CALLBACK_SEPARATOR = ":"
+
+# Длина случайного токена отложенного действия (байты до кодирования в base64)
+TOKEN_SIZE = 6
+
+
+def _b64encode(raw: bytes) -> str:
+    """base64url без выравнивающих '='"""
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text: str) -> bytes:
+    """Обратное преобразование для _b64encode"""
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def encode_int(value: int) -> str:
+    """Компактно закодировать неотрицательное целое (например, id путешествия)"""
+    if value < 0:
+        raise ValueError("Ожидается неотрицательное число")
+    return _b64encode(value.to_bytes(max(1, (value.bit_length() + 7) // 8), "big"))
+
+
+def decode_int(text: str) -> int:
+    """Декодировать целое, закодированное encode_int"""
+    return int.from_bytes(_b64decode(text), "big")
+
+
+def encode_callback(prefix: str, arg: Optional[str] = None) -> str:
+    """
+    Собрать callback_data из префикса действия и необязательного аргумента.
+
+    Raises:
+        ValueError: если результат не помещается в лимит Telegram
+    """
+    data = prefix if arg is None else f"{prefix}{CALLBACK_SEPARATOR}{arg}"
+    if len(data.encode("utf-8")) > MAX_CALLBACK_DATA_SIZE:
+        raise ValueError(f"callback_data длиннее {MAX_CALLBACK_DATA_SIZE} байт: {data}")
+    return data
+
+
+def decode_callback(data: str) -> Tuple[str, Optional[str]]:
+    """Разобрать callback_data на (префикс, аргумент или None)"""
+    prefix, separator, arg = data.partition(CALLBACK_SEPARATOR)
+    return prefix, (arg if separator else None)
+
+
+class PendingActionStore:
+    """
+    Хранилище отложенных действий (например, неподтвержденных расходов).
+
+    В кнопку кладется только короткий токен, а сами данные остаются на сервере
+    и удаляются через ttl секунд. Записи хранятся в порядке добавления, поэтому
+    просроченные вытесняются с головы очереди за O(1) на запись.
+    """
+
+    def __init__(self, ttl: float = 3600, max_size: int = 100_000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _evict(self, now: float):
+        """Удалить просроченные записи и записи сверх max_size"""
+        while self._items:
+            token, (expires_at, _) = next(iter(self._items.items()))
+            if expires_at > now and len(self._items) < self.max_size:
+                break
+            del self._items[token]
+
+    def put(self, payload: Any) -> str:
+        """Сохранить данные и вернуть токен для callback_data"""
+        now = time.monotonic()
+        self._evict(now)
+
+        token = _b64encode(secrets.token_bytes(TOKEN_SIZE))
+        while token in self._items:
+            token = _b64encode(secrets.token_bytes(TOKEN_SIZE))
+
+        self._items[token] = (now + self.ttl, payload)
+        return token
+
+    def get(self, token: str) -> Optional[Any]:
+        """Получить данные по токену (None, если токен неизвестен или просрочен)"""
+        item = self._items.get(token)
+        if item is None:
+            return None
+        if item[0] <= time.monotonic():
+            del self._items[token]
+            return None
+        return item[1]
+
+    def export(self) -> List[Tuple[str, float, Any]]:
+        """Непросроченные записи в виде (токен, оставшееся время жизни, данные)"""
+        now = time.monotonic()
+        return [(token, expires_at - now, payload)
+                for token, (expires_at, payload) in self._items.items()
+                if expires_at > now]
+
+    def restore(self, items: List[Tuple[str, float, Any]]) -> int:
+        """Загрузить записи, сохраненные export(); возвращает их количество"""
+        now = time.monotonic()
+        restored = 0
+        for token, ttl_left, payload in sorted(items, key=lambda item: item[1]):
+            if ttl_left > 0:
+                self._items[token] = (now + ttl_left, payload)
+                restored += 1
+        return restored
+
+    def pop(self, token: str) -> Optional[Any]:
+        """Получить данные по токену и удалить их (одноразовое действие)"""
+        payload = self.get(token)
+        self._items.pop(token, None)
+        return payload
+
+
+class CallbackRouter:
+    """
+    Таблица маршрутов для inline-кнопок: префикс callback_data -> обработчик.
+
+    Поиск обработчика - один запрос к словарю, независимо от количества кнопок.
+    Обработчики без аргумента вызываются как handler(update, context),
+    с аргументом - как handler(update, context, arg).
+
+    Кнопки старых форматов ("switch_trip_<id>") остаются в уже отправленных сообщениях;
+    их префиксы проверяются по порядку, только если новый префикс не найден.
+    """
+
+    def __init__(self):
+        self._routes: Dict[str, Callable] = {}
+        self._legacy_routes: List[Tuple[str, Callable]] = []
+
+    def register(self, prefix: str, handler: Callable):
+        """Зарегистрировать обработчик для префикса"""
+        if CALLBACK_SEPARATOR in prefix:
+            raise ValueError(f"Префикс не может содержать '{CALLBACK_SEPARATOR}': {prefix}")
+        self._routes[prefix] = handler
+
+    def register_legacy(self, prefix: str, handler: Callable):
+        """
+        Зарегистрировать обработчик старого формата "<prefix><аргумент>" (без разделителя).
+
+        Префиксы проверяются в порядке регистрации: более длинный регистрируется раньше
+        ("confirm_expenses_" до "confirm_expense_").
+        """
+        self._legacy_routes.append((prefix, handler))
+
+    def resolve(self, data: str) -> Optional[Tuple[Callable, Optional[str]]]:
+        """Найти обработчик для callback_data: (обработчик, аргумент) или None"""
+        prefix, arg = decode_callback(data)
+        handler = self._routes.get(prefix)
+        if handler is not None:
+            return handler, arg
+
+        for legacy_prefix, legacy_handler in self._legacy_routes:
+            if data.startswith(legacy_prefix):
+                return legacy_handler, data[len(legacy_prefix):]
+        return None
@@ -0,0 +1,115 @@
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+from database import Database
+
+# Участников общего путешествия, процессов и расходов на участника по умолчанию
+DEFAULT_MEMBERS = 12
+DEFAULT_PROCESSES = 4
+DEFAULT_EXPENSES = 100
+
+# Каждый участник меняет курс раз в столько своих расходов: расходы, посчитанные
+# по старому курсу, должны отклоняться, а не записываться
+RATE_CHANGE_EVERY = 40
+
+INITIAL_BALANCE = 1_000_000.0
+EXPENSE_AMOUNT = 1.0
+
+# Сумма с плавающей точкой после тысяч вычитаний может отличаться на ошибку округления
+BALANCE_TOLERANCE = 1e-6
+
+
+def _write_expenses(db_path: str, trip_id: int, user_ids: List[int], expenses: int) -> Tuple[int, int, Dict]:
+    """
+    Процесс-писатель: участники user_ids по очереди вносят расходы в одно путешествие.
+
+    Returns:
+        tuple: (принято расходов, отклонено из-за смены курса, Database.contention_stats())
+    """
+    db = Database(db_path)
+    accepted = rejected = 0
+
+    for index in range(expenses):
+        for user_id in user_ids:
+            trip = db.get_trip(trip_id, user_id)
+            if index and index % RATE_CHANGE_EVERY == 0:
+                db.update_exchange_rate(trip_id, user_id, trip['exchange_rate'] * 1.001)
+            expense_id = db.add_expense(trip_id, user_id, EXPENSE_AMOUNT,
+                                        EXPENSE_AMOUNT * trip['exchange_rate'],
+                                        expected_rate_version=trip['rate_version'])
+            if expense_id is None:
+                rejected += 1
+            else:
+                accepted += 1
+
+    return accepted, rejected, db.contention_stats()
+
+
+def run_benchmark(db_path: str, members: int = DEFAULT_MEMBERS, processes: int = DEFAULT_PROCESSES,
+                  expenses: int = DEFAULT_EXPENSES) -> Dict:
+    """
+    Участники одного общего путешествия одновременно вносят расходы из нескольких процессов.
+
+    Проверяет, что ни один принятый расход не потерян: баланс в trips и баланс,
+    пересчитанный по журналу, равны начальному минус сумма принятых расходов.
+
+    Returns:
+        dict: 'ok' (bool), 'accepted', 'rejected', 'balance', 'expected', 'replayed',
+            'duration', 'writes', 'contended', 'avg_wait', 'max_wait' (секунды)
+    """
+    db = Database(db_path)
+    owner_id = 1
+    trip_id = db.create_trip(owner_id, "Benchmark", "RU", "TH", "RUB", "THB", 0.4, INITIAL_BALANCE)
+    code = db.create_invite(trip_id, owner_id)
+    user_ids = list(range(owner_id, owner_id + members))
+    for user_id in user_ids[1:]:
+        db.join_trip(code, user_id)
+
+    groups = [user_ids[index::processes] for index in range(processes)]
+    started = time.monotonic()
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.starmap(_write_expenses, [(db_path, trip_id, group, expenses) for group in groups])
+    duration = time.monotonic() - started
+
+    accepted = sum(result[0] for result in results)
+    stats = [result[2] for result in results]
+    writes = sum(item['writes'] for item in stats)
+    balance = db.get_trip(trip_id, owner_id)['balance_from']
+    replayed = db.replay_balance(trip_id, owner_id)[0]
+    expected = INITIAL_BALANCE - accepted * EXPENSE_AMOUNT
+
+    return {
+        'ok': abs(balance - expected) < BALANCE_TOLERANCE and abs(replayed - expected) < BALANCE_TOLERANCE,
+        'accepted': accepted,
+        'rejected': sum(result[1] for result in results),
+        'balance': balance,
+        'expected': expected,
+        'replayed': replayed,
+        'duration': duration,
+        'writes': writes,
+        'contended': sum(item['contended'] for item in stats),
+        'avg_wait': sum(item['wait_time'] for item in stats) / writes if writes else 0.0,
+        'max_wait': max(item['max_wait'] for item in stats)
+    }
+
+
+if __name__ == "__main__":
+    # Использование: python contention_benchmark.py [участников] [процессов] [расходов на участника]
+    args = [int(arg) for arg in sys.argv[1:4]]
+    with tempfile.TemporaryDirectory(prefix="contention-") as directory:
+        result = run_benchmark(os.path.join(directory, "contention.db"), *args)
+
+    print(f"Расходов принято: {result['accepted']}, отклонено из-за смены курса: {result['rejected']}")
+    print(f"Баланс: {result['balance']:.2f}, по журналу: {result['replayed']:.2f}, ожидался: {result['expected']:.2f}")
+    print(f"Транзакций записи: {result['writes']} за {result['duration']:.1f} с, "
+          f"ждали блокировку: {result['contended']}")
+    print(f"Ожидание блокировки: среднее {result['avg_wait'] * 1000:.1f} мс, "
+          f"максимальное {result['max_wait'] * 1000:.1f} мс")
+    if not result['ok']:
+        print("❌ Баланс не совпадает с суммой принятых расходов")
+        sys.exit(1)
+    print("✅ Ни один расход не потерян")
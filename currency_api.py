@@ -1,16 +1,19 @@
 import sys
-import requests
-from dotenv import load_dotenv
-import os
-from main import get_request
+import threading
+import time
+from settings import get_settings
+from scheduler import RequestScheduler, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE
+from shared_rates import SharedRateReader
+from providers import RateClient, ExchangeRateHostProvider, OpenErApiProvider, StaticFileProvider
+from tracing import traced
 
 # Устанавливаем кодировку UTF-8 для вывода в консоль Windows
 if sys.platform == 'win32':
     sys.stdout.reconfigure(encoding='utf-8')
     sys.stderr.reconfigure(encoding='utf-8')
 
-# Загружаем переменные окружения
-load_dotenv()
+# Настройки загружаются один раз за процесс
+settings = get_settings()
 
 # Список поддерживаемых валют exchangerate.host (168 валют)
 SUPPORTED_CURRENCIES = [
@@ -34,7 +37,76 @@ SUPPORTED_CURRENCIES = [
 ]
 
 
-def get_current_currency(default="RUB", currencies=None):
+# Планировщик запросов к API с учетом квот тарифа CURRENCY_API_KEY:
+# CURRENCY_API_RATE_LIMIT - запросов в секунду, CURRENCY_API_MONTHLY_QUOTA - запросов в месяц (0 - без ограничения).
+# Расход месячной квоты хранится в таблице api_quota базы CURRENCY_API_QUOTA_DB
+scheduler = RequestScheduler(
+    rate_per_second=settings.currency_api_rate_limit,
+    monthly_quota=settings.currency_api_monthly_quota,
+    quota_db=settings.currency_api_quota_db
+)
+
+
+def _build_rate_client():
+    """
+    Собрать клиент курсов из провайдеров по настройкам:
+    exchangerate.host - основной, RATE_SECONDARY_URL - второй HTTP-провайдер
+    (по умолчанию не используется), RATE_STATIC_FILE - локальный файл с курсами.
+    """
+    providers = [ExchangeRateHostProvider()]
+    
+    if settings.rate_secondary_url:
+        providers.append(OpenErApiProvider(settings.rate_secondary_url))
+    
+    if settings.rate_static_file:
+        providers.append(StaticFileProvider(settings.rate_static_file))
+    
+    return RateClient(providers)
+
+
+# Клиент курсов для матрицы кросс-курсов (несколько провайдеров с дублирующими запросами)
+rate_client = _build_rate_client()
+
+# Время жизни закэшированного курса (секунды)
+RATE_CACHE_TTL = 600
+
+# Кэш курсов: (from_currency, to_currency) -> (курс, время получения)
+_rate_cache = {}
+
+# Время жизни закэшированного списка валют (секунды): список меняется редко
+CATALOGUE_CACHE_TTL = 24 * 60 * 60
+
+# Кэш списка поддерживаемых валют
+_currency_catalogue = {
+    'currencies': None,
+    'timestamp': 0.0
+}
+
+# Базовая валюта матрицы кросс-курсов
+MATRIX_BASE_CURRENCY = "USD"
+
+# Снимок курсов, общий для нескольких процессов бота (обновляется процессом shared_rates.py)
+shared_rates = SharedRateReader(settings.shared_rates_file) if settings.shared_rates_file else None
+
+# Функции, вызываемые с новой матрицей курсов после каждого обновления
+_rate_listeners = []
+
+# Подписчики (переоценка карманов - запись в БД) вызываются в фоновом потоке,
+# чтобы не задерживать запрос пользователя, на котором обновилась матрица.
+# Если подписчики не успевают, промежуточные матрицы пропускаются - важна последняя
+_listener_condition = threading.Condition()
+_pending_rates = {'rates': None}
+_listener_thread = None
+
+# Матрица кросс-курсов: сколько единиц валюты дают за 1 MATRIX_BASE_CURRENCY
+_rate_matrix = {
+    'rates': {},
+    'timestamp': 0.0
+}
+
+
+@traced("currency_api.get_current_currency")
+def get_current_currency(default="RUB", currencies=None, priority=PRIORITY_INTERACTIVE):
     """
     Получает текущий курс валют из API exchangerate.host.
     
@@ -42,32 +114,36 @@ def get_current_currency(default="RUB", currencies=None):
         default (str): Базовая валюта (по умолчанию RUB)
         currencies (list, optional): Список валют для получения курса.
                                     Если None, используется ["USD", "EUR", "GBP", "JPY"].
+        priority (int, optional): Приоритет запроса для планировщика
     
     Returns:
         dict: Ответ от API exchangerate.host с данными о курсах валют
     """
     # Используем API exchangerate.host
     # Документация: https://exchangerate.host/
-    url = os.getenv("CURRENCY_API_URL", "https://api.exchangerate.host/live")
+    url = settings.currency_api_url
     
     # Если список валют не указан, используем значения по умолчанию
     if currencies is None:
         currencies = ["USD", "EUR", "GBP", "JPY"]
     
-    # Получаем API ключ из переменных окружения (если требуется)
-    access_key = os.getenv("CURRENCY_API_KEY")
+    # API ключ из настроек (если требуется)
+    access_key = settings.currency_api_key
     
     # Формируем параметры запроса
-    params = {
-        "source": default,
-        "currencies": ",".join(currencies)  # ",".join(currencies) означает объединение в строку с разделителем-запятой
-    }
+    params = {"source": default}
+    
+    # Минимальный список валют: без повторов и без самой базовой валюты. Если нужны все
+    # поддерживаемые валюты, параметр не передается - API и так вернет все курсы
+    codes = sorted(set(currencies) - {default})
+    if not set(SUPPORTED_CURRENCIES) - {default} <= set(codes):
+        params["currencies"] = ",".join(codes)  # ",".join(codes) означает объединение в строку с разделителем-запятой
     
     # Добавляем access_key только если он указан
     if access_key:
         params["access_key"] = access_key
     
-    result = get_request(url, params=params)
+    result = scheduler.request(url, params=params, priority=priority)
     
     if not result['success']:
         return {
@@ -79,6 +155,7 @@ def get_current_currency(default="RUB", currencies=None):
     return result['data']
 
 
+@traced("currency_api.get_currency_rate", attrs=lambda from_currency, to_currency, *args, **kwargs: {'pair': f"{from_currency}{to_currency}"})
 def get_currency_rate(from_currency, to_currency):
     """
     Получает курс обмена между двумя валютами.
@@ -94,22 +171,35 @@ def get_currency_rate(from_currency, to_currency):
     return result
 
 
-def get_supported_currencies():
+@traced("currency_api.get_supported_currencies")
+def get_supported_currencies(priority=PRIORITY_INTERACTIVE):
     """
     Получает список поддерживаемых валют от API exchangerate.host.
     
+    Успешный ответ кэшируется на CATALOGUE_CACHE_TTL секунд.
+    
+    Args:
+        priority (int, optional): Приоритет запроса для планировщика
+    
     Returns:
         dict: Ответ от API с данными о поддерживаемых валютах:
             - 'success' (bool): Успешность запроса
             - 'currencies' (dict): Словарь с кодами валют и их названиями
             - 'error' (str): Сообщение об ошибке (если есть)
     """
+    if _currency_catalogue['currencies'] and time.time() - _currency_catalogue['timestamp'] < CATALOGUE_CACHE_TTL:
+        return {
+            'success': True,
+            'currencies': _currency_catalogue['currencies'],
+            'error': None
+        }
+    
     # Используем API exchangerate.host для получения списка валют
     # Документация: https://exchangerate.host/
     url = "https://api.exchangerate.host/list"
     
-    # Получаем API ключ из переменных окружения
-    access_key = os.getenv("CURRENCY_API_KEY")
+    # API ключ из настроек
+    access_key = settings.currency_api_key
     
     # Формируем параметры запроса
     params = {}
@@ -118,7 +208,9 @@ def get_supported_currencies():
     if access_key:
         params["access_key"] = access_key
     
-    result = get_request(url, params=params)
+    # Список валют меняется редко: повторный запрос условный (ETag/Last-Modified),
+    # и при ответе 304 каталог не загружается заново
+    result = scheduler.request(url, params=params, priority=priority, revalidate=True)
     
     if not result['success']:
         return {
@@ -132,9 +224,11 @@ def get_supported_currencies():
     
     # Если API вернул успешный ответ
     if data.get('success', False):
+        _currency_catalogue['currencies'] = data.get('currencies', {})
+        _currency_catalogue['timestamp'] = time.time()
         return {
             'success': True,
-            'currencies': data.get('currencies', {}),
+            'currencies': _currency_catalogue['currencies'],
             'error': None
         }
     else:
@@ -145,7 +239,74 @@ def get_supported_currencies():
         }
 
 
-def convert_currency(from_currency, to_currency, amount):
+@traced("currency_api.get_timeframe")
+def get_timeframe(start_date, end_date, source="USD", currencies=None, priority=PRIORITY_BACKGROUND):
+    """
+    Получает исторические курсы за период из API exchangerate.host (/timeframe).
+    
+    Args:
+        start_date (str): Первый день периода (YYYY-MM-DD)
+        end_date (str): Последний день периода (YYYY-MM-DD), не дальше 365 дней от первого
+        source (str): Базовая валюта
+        currencies (list, optional): Список валют; если None - все валюты
+        priority (int, optional): Приоритет запроса для планировщика (по умолчанию фоновый)
+    
+    Returns:
+        dict: Ответ от API:
+            - 'success' (bool): Успешность запроса
+            - 'quotes' (dict): Курсы по дням {"2024-01-31": {"USDEUR": 0.92, ...}}
+            - 'error' (str): Сообщение об ошибке (если есть)
+            - 'throttled' (bool): Запрос отклонен планировщиком из-за квоты
+    """
+    # Документация: https://exchangerate.host/
+    url = "https://api.exchangerate.host/timeframe"
+    
+    # API ключ из настроек
+    access_key = settings.currency_api_key
+    
+    # Формируем параметры запроса
+    params = {
+        "start_date": start_date,
+        "end_date": end_date,
+        "source": source
+    }
+    if currencies:
+        params["currencies"] = ",".join(sorted(set(currencies) - {source}))
+    
+    # Добавляем access_key только если он указан
+    if access_key:
+        params["access_key"] = access_key
+    
+    result = scheduler.request(url, params=params, priority=priority)
+    
+    if not result['success']:
+        return {
+            'success': False,
+            'quotes': None,
+            'error': result['error'],
+            'throttled': result.get('throttled', False)
+        }
+    
+    data = result['data']
+    
+    if data.get('success', False):
+        return {
+            'success': True,
+            'quotes': data.get('quotes', {}),
+            'error': None,
+            'throttled': False
+        }
+    else:
+        return {
+            'success': False,
+            'quotes': None,
+            'error': data.get('error', 'Ошибка при получении исторических курсов'),
+            'throttled': False
+        }
+
+
+@traced("currency_api.convert_currency", attrs=lambda from_currency, to_currency, *args, **kwargs: {'pair': f"{from_currency}{to_currency}"})
+def convert_currency(from_currency, to_currency, amount, priority=PRIORITY_INTERACTIVE):
     """
     Конвертирует сумму из одной валюты в другую.
     
@@ -153,6 +314,7 @@ def convert_currency(from_currency, to_currency, amount):
         from_currency (str): Исходная валюта (например, 'USD')
         to_currency (str): Целевая валюта (например, 'GBP')
         amount (float): Сумма для конвертации
+        priority (int, optional): Приоритет запроса для планировщика
     
     Returns:
         dict: Ответ от API с результатом конвертации:
@@ -166,8 +328,8 @@ def convert_currency(from_currency, to_currency, amount):
     # Документация: https://exchangerate.host/
     url = "http://api.exchangerate.host/convert"
     
-    # Получаем API ключ из переменных окружения
-    access_key = os.getenv("CURRENCY_API_KEY")
+    # API ключ из настроек
+    access_key = settings.currency_api_key
     
     # Формируем параметры запроса
     params = {
@@ -180,9 +342,19 @@ def convert_currency(from_currency, to_currency, amount):
     if access_key:
         params["access_key"] = access_key
     
-    result = get_request(url, params=params)
+    result = scheduler.request(url, params=params, priority=priority)
     
     if not result['success']:
+        # Квота исчерпана - считаем по последней известной матрице курсов, даже устаревшей
+        rate = get_cross_rate(from_currency, to_currency, ttl=float('inf')) if result.get('throttled') else None
+        if rate:
+            return {
+                'success': True,
+                'query': {'from': from_currency, 'to': to_currency, 'amount': amount},
+                'info': {'rate': rate, 'cached': True},
+                'result': amount * rate,
+                'error': None
+            }
         return {
             'success': False,
             'query': {'from': from_currency, 'to': to_currency, 'amount': amount},
@@ -213,6 +385,199 @@ def convert_currency(from_currency, to_currency, amount):
         }
 
 
+@traced("currency_api.get_rate_matrix")
+def get_rate_matrix(ttl=RATE_CACHE_TTL, priority=PRIORITY_INTERACTIVE):
+    """
+    Возвращает локально закэшированную матрицу кросс-курсов.
+    
+    Все курсы относительно MATRIX_BASE_CURRENCY загружаются одним запросом
+    через rate_client (основной провайдер с резервными) и обновляются не чаще одного раза в ttl секунд. Курс между любыми двумя
+    валютами затем считается локально через get_cross_rate().
+    
+    Args:
+        ttl (int, optional): Время жизни матрицы (секунды)
+        priority (int, optional): Приоритет запроса для планировщика
+    
+    Returns:
+        dict: Словарь {код валюты: единиц за 1 MATRIX_BASE_CURRENCY}
+              или None, если матрицу получить не удалось
+    """
+    if _rate_matrix['rates'] and time.time() - _rate_matrix['timestamp'] < ttl:
+        return _rate_matrix['rates']
+    
+    # Свежий общий снимок избавляет каждый процесс от собственного запроса к API
+    snapshot = shared_rates.get_base_rates(MATRIX_BASE_CURRENCY) if shared_rates else None
+    if snapshot and time.time() - snapshot[2] < ttl:
+        rates, _, timestamp = snapshot
+        if timestamp != _rate_matrix['timestamp']:
+            _set_rate_matrix(rates, timestamp)
+        return _rate_matrix['rates']
+    
+    result = rate_client.fetch_rates(MATRIX_BASE_CURRENCY, SUPPORTED_CURRENCIES, priority=priority)
+    if not result['success']:
+        # Лучше отдать устаревшую матрицу, чем никакой
+        return _rate_matrix['rates'] or None
+    
+    _set_rate_matrix(result['rates'], time.time())
+    return _rate_matrix['rates']
+
+
+def _set_rate_matrix(rates, timestamp):
+    """Сохраняет новую матрицу курсов и уведомляет подписчиков"""
+    global _listener_thread
+    
+    _rate_matrix['rates'] = rates
+    _rate_matrix['timestamp'] = timestamp
+    
+    if not _rate_listeners:
+        return
+    
+    with _listener_condition:
+        _pending_rates['rates'] = rates
+        if _listener_thread is None:
+            _listener_thread = threading.Thread(target=_notify_listeners, name="rate-listeners", daemon=True)
+            _listener_thread.start()
+        _listener_condition.notify()
+
+
+def _notify_listeners():
+    """Фоновый поток: передает подписчикам последнюю полученную матрицу курсов"""
+    while True:
+        with _listener_condition:
+            while _pending_rates['rates'] is None:
+                _listener_condition.wait()
+            rates = _pending_rates['rates']
+            _pending_rates['rates'] = None
+        
+        for listener in _rate_listeners:
+            try:
+                listener(rates)
+            except Exception as e:
+                print(f"Ошибка обработчика обновления курсов: {e}")
+
+
+def get_rate_matrix_timestamp():
+    """Возвращает время получения текущей матрицы курсов (unix time, 0 - матрицы нет)"""
+    return _rate_matrix['timestamp']
+
+
+def add_rate_listener(listener):
+    """
+    Подписаться на обновления матрицы кросс-курсов.
+    
+    Подписчик вызывается в фоновом потоке, а не в потоке, обновившем матрицу.
+    
+    Args:
+        listener (callable): Функция, которая получает словарь курсов
+                             {код валюты: единиц за 1 MATRIX_BASE_CURRENCY}
+    """
+    _rate_listeners.append(listener)
+
+
+@traced("currency_api.get_cross_rate", attrs=lambda from_currency, to_currency, *args, **kwargs: {'pair': f"{from_currency}{to_currency}"})
+def get_cross_rate(from_currency, to_currency, ttl=RATE_CACHE_TTL):
+    """
+    Возвращает курс 1 from_currency -> to_currency по матрице кросс-курсов.
+    
+    Returns:
+        float: Курс обмена или None, если одной из валют нет в матрице
+    """
+    if from_currency == to_currency:
+        return 1.0
+    
+    rates = get_rate_matrix(ttl)
+    if not rates or not rates.get(from_currency) or not rates.get(to_currency):
+        return None
+    
+    return rates[to_currency] / rates[from_currency]
+
+
+@traced("currency_api.get_cached_rate", attrs=lambda from_currency, to_currency, *args, **kwargs: {'pair': f"{from_currency}{to_currency}"})
+def get_cached_rate(from_currency, to_currency, ttl=RATE_CACHE_TTL):
+    """
+    Возвращает курс 1 from_currency -> to_currency, используя локальный кэш.
+    
+    Сначала курс считается по матрице кросс-курсов, и только если пары в ней нет,
+    выполняется отдельный запрос /convert (его результат тоже кэшируется на ttl секунд).
+    
+    Args:
+        from_currency (str): Исходная валюта
+        to_currency (str): Целевая валюта
+        ttl (int, optional): Время жизни курса в кэше (секунды)
+    
+    Returns:
+        float: Курс обмена или None, если получить его не удалось
+    """
+    rate = get_cross_rate(from_currency, to_currency, ttl)
+    if rate:
+        return rate
+    
+    key = (from_currency, to_currency)
+    cached = _rate_cache.get(key)
+    if cached and time.time() - cached[1] < ttl:
+        return cached[0]
+    
+    result = convert_currency(from_currency, to_currency, 1)
+    rate = None
+    if result['success']:
+        rate = result.get('result') or (result.get('info') or {}).get('rate')
+    if not rate:
+        # Лучше устаревший курс, чем никакого
+        return cached[0] if cached else None
+    
+    rate = float(rate)
+    _rate_cache[key] = (rate, time.time())
+    return rate
+
+
+def export_cache_state():
+    """
+    Возвращает состояние кэшей курсов для сохранения на диск (см. warm_cache).
+    
+    Returns:
+        dict: Матрица курсов, кэш пар и список валют с временем получения
+    """
+    return {
+        'rate_matrix': dict(_rate_matrix),
+        'rate_cache': [[from_currency, to_currency, rate, timestamp]
+                       for (from_currency, to_currency), (rate, timestamp) in _rate_cache.items()],
+        'currency_catalogue': dict(_currency_catalogue)
+    }
+
+
+def restore_cache_state(state, max_age=RATE_CACHE_TTL, catalogue_max_age=CATALOGUE_CACHE_TTL):
+    """
+    Восстанавливает кэши курсов, сохраненные export_cache_state().
+    
+    Данные старше max_age (курсы) и catalogue_max_age (список валют) секунд отбрасываются,
+    чтобы после долгого простоя не показывать пользователям устаревшие курсы.
+    
+    Returns:
+        int: Количество восстановленных записей
+    """
+    now = time.time()
+    restored = 0
+    
+    matrix = state.get('rate_matrix') or {}
+    if matrix.get('rates') and now - matrix.get('timestamp', 0) < max_age:
+        _rate_matrix['rates'] = {code: float(rate) for code, rate in matrix['rates'].items()}
+        _rate_matrix['timestamp'] = matrix['timestamp']
+        restored += 1
+    
+    for from_currency, to_currency, rate, timestamp in state.get('rate_cache') or []:
+        if now - timestamp < max_age:
+            _rate_cache[(from_currency, to_currency)] = (float(rate), timestamp)
+            restored += 1
+    
+    catalogue = state.get('currency_catalogue') or {}
+    if catalogue.get('currencies') and now - catalogue.get('timestamp', 0) < catalogue_max_age:
+        _currency_catalogue['currencies'] = catalogue['currencies']
+        _currency_catalogue['timestamp'] = catalogue['timestamp']
+        restored += 1
+    
+    return restored
+
+
 if __name__ == "__main__":
     # Пример использования
     print("Получение текущих курсов валют:")
@@ -1,7 +1,15 @@
+import json
+import os
+import secrets
 import sqlite3
 import sys
+import threading
+import time
+import zlib
 from datetime import datetime
-from typing import Optional, List, Dict, Tuple
+from typing import Optional, List, Dict, Tuple, Iterator, Set
+
+from tracing import trace_methods
 
 # Устанавливаем кодировку UTF-8 для вывода в консоль Windows
 if sys.platform == 'win32':
@@ -9,10 +17,53 @@ if sys.platform == 'win32':
     sys.stderr.reconfigure(encoding='utf-8')
 
 
+# Типы событий журнала баланса
+EVENT_DEPOSIT = "deposit"
+EVENT_EXPENSE = "expense"
+EVENT_RATE_CHANGE = "rate_change"
+
+# Через сколько событий журнала делать снимок баланса путешествия
+SNAPSHOT_INTERVAL = 100
+
+# Таблицы, строки которых переносятся в архив вместе с путешествием
+ARCHIVED_TABLES = ("expenses", "balance_events", "balance_snapshots", "trip_pockets", "trip_budgets",
+                   "trip_members")
+
+# Ожидание блокировки записи дольше этого времени считается конкуренцией писателей (секунды)
+CONTENTION_THRESHOLD = 0.001
+
+# Ожидание блокировки записи дольше этого времени выводится в лог (секунды)
+SLOW_WRITE_WAIT = 0.5
+
+
+def _pack_rows(columns: List[str], rows: List[Tuple], compress: bool) -> bytes:
+    """Упаковать строки таблицы в JSON (при compress - сжатый zlib)"""
+    payload = json.dumps({'columns': columns, 'rows': rows}, ensure_ascii=False,
+                         separators=(",", ":")).encode("utf-8")
+    return zlib.compress(payload) if compress else payload
+
+
+def _unpack_rows(payload: bytes, compressed: bool) -> Tuple[List[str], List[List]]:
+    """Обратная операция к _pack_rows: (колонки, строки)"""
+    data = json.loads(zlib.decompress(payload) if compressed else payload)
+    return data['columns'], data['rows']
+
+
+# get_connection вызывается внутри каждого метода и отдельным спаном был бы шумом
+@trace_methods("db", exclude=("get_connection",))
 class Database:
-    def __init__(self, db_name: str = "travel_wallet.db"):
-        """Инициализация базы данных"""
+    def __init__(self, db_name: str = "travel_wallet.db", archive_name: Optional[str] = None):
+        """
+        Инициализация базы данных.
+        
+        archive_name - файл архива старых путешествий (по умолчанию рядом с базой:
+        travel_wallet_archive.db); создается при первой архивации.
+        """
         self.db_name = db_name
+        self.archive_name = archive_name or f"{os.path.splitext(db_name)[0]}_archive.db"
+        self._archive_ready = False
+        self._contention_lock = threading.Lock()
+        self._contention = {'writes': 0, 'contended': 0, 'wait_time': 0.0, 'max_wait': 0.0, 'conflicts': 0}
         self.init_db()
     
     def get_connection(self):
@@ -26,6 +77,13 @@ class Database:
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        # Освобожденные страницы возвращаются постепенно через PRAGMA incremental_vacuum
+        # (для новой базы; существующую переводит однократный VACUUM, см. archive.py)
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        
+        # WAL: читатели не блокируют писателя, когда с базой работают несколько процессов-воркеров
+        cursor.execute("PRAGMA journal_mode=WAL")
+        
         # Таблица путешествий
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS trips (
@@ -41,10 +99,47 @@ class Database:
                 balance_to REAL DEFAULT 0,
                 is_active INTEGER DEFAULT 0,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                follow_market INTEGER DEFAULT 0,
+                rate_version INTEGER DEFAULT 0,
+                invite_code TEXT,
                 UNIQUE(user_id, name)
             )
         """)
         
+        # follow_market = 1: курс путешествия обновляется по рынку (market_rates.py).
+        # rate_version увеличивается при каждой смене курса (оптимистичная проверка расходов),
+        # invite_code - код приглашения участников в общее путешествие
+        self._add_missing_columns(cursor, "trips", {
+            "follow_market": "INTEGER DEFAULT 0",
+            "rate_version": "INTEGER DEFAULT 0",
+            "invite_code": "TEXT"
+        })
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_trips_follow_market
+            ON trips (from_currency, to_currency) WHERE follow_market = 1
+        """)
+        cursor.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_trips_invite_code
+            ON trips (invite_code) WHERE invite_code IS NOT NULL
+        """)
+        
+        # Участники общих путешествий (кроме владельца trips.user_id).
+        # is_active - активное путешествие участника, как trips.is_active у владельца
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS trip_members (
+                trip_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                is_active INTEGER DEFAULT 0,
+                joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (trip_id, user_id),
+                FOREIGN KEY (trip_id) REFERENCES trips(id)
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_trip_members_user
+            ON trip_members (user_id, is_active)
+        """)
+        
         # Таблица расходов
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS expenses (
@@ -55,13 +150,265 @@ class Database:
                 amount_to REAL NOT NULL,
                 description TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                amount_original REAL,
+                currency_original TEXT,
+                FOREIGN KEY (trip_id) REFERENCES trips(id)
+            )
+        """)
+        
+        # Миграция старых баз: добавляем колонки, которых еще нет
+        self._add_missing_columns(cursor, "expenses", {
+            "amount_original": "REAL",
+            "currency_original": "TEXT"
+        })
+        
+        # Журнал изменений баланса (только добавление записей)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS balance_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                trip_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                event_type TEXT NOT NULL,
+                delta_from REAL DEFAULT 0,
+                delta_to REAL DEFAULT 0,
+                exchange_rate REAL,
+                expense_id INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (trip_id) REFERENCES trips(id)
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_balance_events_trip
+            ON balance_events (trip_id, id)
+        """)
+        
+        # Периодические снимки баланса: баланс после события event_id
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS balance_snapshots (
+                trip_id INTEGER NOT NULL,
+                event_id INTEGER NOT NULL,
+                balance_from REAL NOT NULL,
+                balance_to REAL NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (trip_id, event_id),
+                FOREIGN KEY (trip_id) REFERENCES trips(id)
+            )
+        """)
+        
+        # Валютные кошельки путешествия: произвольное число валют помимо пары путешествия.
+        # value_from - стоимость кошелька в домашней валюте по последнему курсу
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS trip_pockets (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                trip_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                currency TEXT NOT NULL,
+                amount REAL DEFAULT 0,
+                value_from REAL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(trip_id, currency),
                 FOREIGN KEY (trip_id) REFERENCES trips(id)
             )
         """)
         
+        # Подписки на курс: уведомить, когда курс пары станет выше/ниже порога
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS rate_alerts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                chat_id INTEGER NOT NULL,
+                from_currency TEXT NOT NULL,
+                to_currency TEXT NOT NULL,
+                direction TEXT NOT NULL,
+                threshold REAL NOT NULL,
+                is_active INTEGER DEFAULT 1,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                triggered_at TIMESTAMP
+            )
+        """)
+        
+        # Бюджеты путешествий (в валюте пребывания) и счетчики трат по ним.
+        # Счетчики обновляются вместе с добавлением расхода, поэтому проверка бюджета
+        # не требует суммирования истории. День - по UTC, как и время расходов
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS trip_budgets (
+                trip_id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                daily_limit REAL,
+                total_limit REAL,
+                spent_day REAL NOT NULL DEFAULT 0,
+                spent_total REAL NOT NULL DEFAULT 0,
+                day TEXT,
+                FOREIGN KEY (trip_id) REFERENCES trips (id)
+            )
+        """)
+        
+        # Исторические курсы: сколько единиц валюты стоил 1 USD в указанный день
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS historical_rates (
+                date TEXT NOT NULL,
+                currency TEXT NOT NULL,
+                rate_usd REAL NOT NULL,
+                PRIMARY KEY (date, currency)
+            )
+        """)
+        
+        # Контрольные точки загрузки исторических курсов: загруженные интервалы дат по валютам
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS rate_backfill_chunks (
+                currency TEXT NOT NULL,
+                start_date TEXT NOT NULL,
+                end_date TEXT NOT NULL,
+                completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (currency, start_date)
+            )
+        """)
+        
+        # Путешествия, созданные до появления журнала, получают начальное событие
+        # с текущим балансом
+        cursor.execute("""
+            INSERT INTO balance_events (trip_id, user_id, event_type, delta_from, delta_to, exchange_rate)
+            SELECT id, user_id, ?, balance_from, balance_to, exchange_rate FROM trips
+            WHERE id NOT IN (SELECT DISTINCT trip_id FROM balance_events)
+        """, (EVENT_DEPOSIT,))
+        
         conn.commit()
         conn.close()
     
+    def _add_missing_columns(self, cursor, table: str, columns: Dict[str, str]):
+        """Добавить в существующую таблицу недостающие колонки"""
+        cursor.execute(f"PRAGMA table_info({table})")
+        existing = {row[1] for row in cursor.fetchall()}
+        
+        for name, column_type in columns.items():
+            if name not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+    
+    def _has_access(self, cursor, trip_id: int, user_id: int) -> bool:
+        """Владелец или участник путешествия"""
+        cursor.execute("""
+            SELECT 1 FROM trips WHERE id = ? AND user_id = ?
+            UNION ALL
+            SELECT 1 FROM trip_members WHERE trip_id = ? AND user_id = ?
+            LIMIT 1
+        """, (trip_id, user_id, trip_id, user_id))
+        return cursor.fetchone() is not None
+    
+    @staticmethod
+    def _member_view(row, user_id: int) -> Dict:
+        """
+        Путешествие глазами пользователя: для участника общего путешествия is_active -
+        его собственный выбор, а не владельца; 'shared' - путешествие чужое.
+        """
+        trip = dict(row)
+        member_active = trip.pop('member_active', None)
+        if trip['user_id'] != user_id:
+            trip['is_active'] = member_active
+            trip['shared'] = True
+        return trip
+    
+    def _begin_write(self, cursor, trip_id: int):
+        """
+        Начать транзакцию записи, сразу заняв блокировку (BEGIN IMMEDIATE).
+        
+        Отложенная транзакция, которая сначала читает, а потом пишет, при параллельной
+        записи в WAL сразу получает "database is locked"; IMMEDIATE ждет своей очереди
+        (до timeout соединения). Время ожидания учитывается в contention_stats().
+        """
+        started = time.monotonic()
+        cursor.execute("BEGIN IMMEDIATE")
+        wait = time.monotonic() - started
+        
+        with self._contention_lock:
+            self._contention['writes'] += 1
+            self._contention['wait_time'] += wait
+            self._contention['max_wait'] = max(self._contention['max_wait'], wait)
+            if wait > CONTENTION_THRESHOLD:
+                self._contention['contended'] += 1
+        if wait > SLOW_WRITE_WAIT:
+            print(f"⏳ Запись в путешествие {trip_id} ждала блокировку {wait * 1000:.0f} мс")
+    
+    def contention_stats(self) -> Dict:
+        """
+        Конкуренция записей в путешествия этого процесса: 'writes' - транзакций,
+        'contended' - ждавших блокировку, 'wait_time' и 'max_wait' - суммарное
+        и максимальное ожидание (секунды), 'conflicts' - отклонено из-за смены курса
+        """
+        with self._contention_lock:
+            return dict(self._contention)
+    
+    def _append_event(self, cursor, trip_id: int, user_id: int, event_type: str,
+                      delta_from: float = 0, delta_to: float = 0,
+                      exchange_rate: float = None, expense_id: int = None):
+        """Добавить событие в журнал баланса (в текущей транзакции)"""
+        cursor.execute("""
+            INSERT INTO balance_events (trip_id, user_id, event_type, delta_from,
+                                        delta_to, exchange_rate, expense_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (trip_id, user_id, event_type, delta_from, delta_to, exchange_rate, expense_id))
+    
+    @staticmethod
+    def _apply_events(balance_from: float, balance_to: float, events) -> Tuple[float, float]:
+        """Применить события журнала к балансу"""
+        for event in events:
+            if event['event_type'] == EVENT_RATE_CHANGE:
+                # Смена курса пересчитывает баланс в валюте пребывания
+                balance_to = balance_from * event['exchange_rate']
+            else:
+                balance_from += event['delta_from']
+                balance_to += event['delta_to']
+        return balance_from, balance_to
+    
+    def _compute_balance(self, cursor, trip_id: int) -> Tuple[float, float, int, int]:
+        """
+        Посчитать баланс как последний снимок + события после него.
+        
+        Возвращает (balance_from, balance_to, id последнего события, число событий после снимка).
+        """
+        cursor.execute("""
+            SELECT event_id, balance_from, balance_to FROM balance_snapshots
+            WHERE trip_id = ?
+            ORDER BY event_id DESC
+            LIMIT 1
+        """, (trip_id,))
+        snapshot = cursor.fetchone()
+        
+        if snapshot:
+            last_event_id, balance_from, balance_to = snapshot
+        else:
+            last_event_id, balance_from, balance_to = 0, 0.0, 0.0
+        
+        cursor.execute("""
+            SELECT id, event_type, delta_from, delta_to, exchange_rate FROM balance_events
+            WHERE trip_id = ? AND id > ?
+            ORDER BY id
+        """, (trip_id, last_event_id))
+        tail = cursor.fetchall()
+        
+        balance_from, balance_to = self._apply_events(balance_from, balance_to, tail)
+        if tail:
+            last_event_id = tail[-1]['id']
+        return balance_from, balance_to, last_event_id, len(tail)
+    
+    def _maybe_snapshot(self, cursor, trip_id: int):
+        """Сделать снимок баланса, если после предыдущего накопилось SNAPSHOT_INTERVAL событий"""
+        balance_from, balance_to, last_event_id, tail_length = self._compute_balance(cursor, trip_id)
+        if tail_length >= SNAPSHOT_INTERVAL:
+            cursor.execute("""
+                INSERT OR REPLACE INTO balance_snapshots (trip_id, event_id, balance_from, balance_to)
+                VALUES (?, ?, ?, ?)
+            """, (trip_id, last_event_id, balance_from, balance_to))
+    
+    def _track_budget(self, cursor, trip_id: int, amount_to: float):
+        """Увеличить счетчики бюджета путешествия (если бюджет задан); новый день обнуляет дневной счетчик"""
+        cursor.execute("""
+            UPDATE trip_budgets
+            SET spent_day = CASE WHEN day = date('now') THEN spent_day ELSE 0 END + ?,
+                spent_total = spent_total + ?,
+                day = date('now')
+            WHERE trip_id = ?
+        """, (amount_to, amount_to, trip_id))
+    
     def create_trip(self, user_id: int, name: str, from_country: str, to_country: str,
                    from_currency: str, to_currency: str, exchange_rate: float,
                    initial_balance: float = 0) -> int:
@@ -69,8 +416,9 @@ class Database:
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        # Деактивируем все другие путешествия пользователя
+        # Деактивируем все другие путешествия пользователя, в том числе общие
         cursor.execute("UPDATE trips SET is_active = 0 WHERE user_id = ?", (user_id,))
+        cursor.execute("UPDATE trip_members SET is_active = 0 WHERE user_id = ?", (user_id,))
         
         # Создаем новое путешествие
         cursor.execute("""
@@ -83,168 +431,1195 @@ class Database:
               initial_balance * exchange_rate))
         
         trip_id = cursor.lastrowid
+        self._append_event(cursor, trip_id, user_id, EVENT_DEPOSIT,
+                           initial_balance, initial_balance * exchange_rate, exchange_rate)
         conn.commit()
         conn.close()
         return trip_id
     
     def get_active_trip(self, user_id: int) -> Optional[Dict]:
-        """Получить активное путешествие пользователя"""
+        """Получить активное путешествие пользователя (свое или общее)"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
         cursor.execute("""
-            SELECT * FROM trips 
+            SELECT *, NULL AS member_active FROM trips 
             WHERE user_id = ? AND is_active = 1
+            UNION ALL
+            SELECT t.*, m.is_active FROM trip_members m
+            JOIN trips t ON t.id = m.trip_id
+            WHERE m.user_id = ? AND m.is_active = 1
             LIMIT 1
-        """, (user_id,))
+        """, (user_id, user_id))
         
         row = cursor.fetchone()
         conn.close()
         
         if row:
-            return dict(row)
+            return self._member_view(row, user_id)
         return None
     
     def get_trip(self, trip_id: int, user_id: int) -> Optional[Dict]:
-        """Получить путешествие по ID"""
+        """Получить путешествие по ID (в том числе общее и из архива - с пометкой 'archived')"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
         cursor.execute("""
-            SELECT * FROM trips 
-            WHERE id = ? AND user_id = ?
-        """, (trip_id, user_id))
+            SELECT t.*, m.is_active AS member_active FROM trips t
+            LEFT JOIN trip_members m ON m.trip_id = t.id AND m.user_id = ?
+            WHERE t.id = ? AND (t.user_id = ? OR m.user_id IS NOT NULL)
+        """, (user_id, trip_id, user_id))
         
         row = cursor.fetchone()
         conn.close()
         
         if row:
-            return dict(row)
-        return None
+            return self._member_view(row, user_id)
+        archived = self._get_archived_trips(user_id, trip_id)
+        return archived[0] if archived else None
     
     def get_all_trips(self, user_id: int) -> List[Dict]:
-        """Получить все путешествия пользователя"""
+        """Получить все путешествия пользователя (архивные - в конце списка, с пометкой 'archived')"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
         cursor.execute("""
-            SELECT * FROM trips 
+            SELECT *, NULL AS member_active FROM trips 
             WHERE user_id = ?
-            ORDER BY is_active DESC, created_at DESC
-        """, (user_id,))
+            UNION ALL
+            SELECT t.*, m.is_active FROM trip_members m
+            JOIN trips t ON t.id = m.trip_id
+            WHERE m.user_id = ?
+        """, (user_id, user_id))
         
-        rows = cursor.fetchall()
+        trips = [self._member_view(row, user_id) for row in cursor.fetchall()]
         conn.close()
+        # Сначала активное, затем по убыванию даты создания
+        trips.sort(key=lambda trip: trip['created_at'], reverse=True)
+        trips.sort(key=lambda trip: trip['is_active'], reverse=True)
         
-        return [dict(row) for row in rows]
+        # Путешествие, архивация которого прервалась, есть в обеих базах - берем из основной
+        trip_ids = {trip['id'] for trip in trips}
+        trips.extend(trip for trip in self._get_archived_trips(user_id) if trip['id'] not in trip_ids)
+        return trips
     
     def switch_active_trip(self, user_id: int, trip_id: int) -> bool:
         """Переключить активное путешествие"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        # Проверяем, что путешествие принадлежит пользователю
-        cursor.execute("SELECT id FROM trips WHERE id = ? AND user_id = ?", 
-                      (trip_id, user_id))
-        if not cursor.fetchone():
+        # Проверяем, что пользователь - владелец или участник путешествия
+        if not self._has_access(cursor, trip_id, user_id):
             conn.close()
-            return False
+            # Путешествие из архива сначала возвращается в основную базу
+            if not self.restore_trip(trip_id, user_id):
+                return False
+            conn = self.get_connection()
+            cursor = conn.cursor()
         
-        # Деактивируем все путешествия пользователя
+        # Деактивируем все путешествия пользователя, в том числе общие
         cursor.execute("UPDATE trips SET is_active = 0 WHERE user_id = ?", (user_id,))
+        cursor.execute("UPDATE trip_members SET is_active = 0 WHERE user_id = ?", (user_id,))
         
-        # Активируем выбранное путешествие
+        # Активируем выбранное путешествие (свое или участие в общем)
         cursor.execute("UPDATE trips SET is_active = 1 WHERE id = ? AND user_id = ?", 
                       (trip_id, user_id))
+        cursor.execute("UPDATE trip_members SET is_active = 1 WHERE trip_id = ? AND user_id = ?",
+                       (trip_id, user_id))
         
         conn.commit()
         conn.close()
         return True
     
     def update_exchange_rate(self, trip_id: int, user_id: int, new_rate: float) -> bool:
-        """Обновить курс обмена для путешествия"""
+        """
+        Обновить курс обмена для путешествия (владельцем или участником).
+        
+        Баланс пересчитывается тем же UPDATE из текущего balance_from, а rate_version
+        увеличивается, поэтому расходы, посчитанные по старому курсу, будут отклонены.
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        # Получаем текущий баланс
-        cursor.execute("SELECT balance_from FROM trips WHERE id = ? AND user_id = ?", 
-                      (trip_id, user_id))
-        row = cursor.fetchone()
-        if not row:
+        try:
+            self._begin_write(cursor, trip_id)
+            if not self._has_access(cursor, trip_id, user_id):
+                conn.rollback()
+                return False
+            
+            # Обновляем курс и пересчитываем баланс
+            cursor.execute("""
+                UPDATE trips 
+                SET exchange_rate = ?, balance_to = balance_from * ?,
+                    rate_version = rate_version + 1
+                WHERE id = ?
+            """, (new_rate, new_rate, trip_id))
+            
+            self._append_event(cursor, trip_id, user_id, EVENT_RATE_CHANGE, exchange_rate=new_rate)
+            self._maybe_snapshot(cursor, trip_id)
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
             conn.close()
-            return False
+        return True
+    
+    def set_follow_market(self, trip_id: int, user_id: int, enabled: bool) -> bool:
+        """Включить или выключить автообновление курса путешествия по рынку"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("UPDATE trips SET follow_market = ? WHERE id = ? AND user_id = ?",
+                       (int(enabled), trip_id, user_id))
+        updated = cursor.rowcount > 0
+        
+        conn.commit()
+        conn.close()
+        return updated
+    
+    def get_market_pairs(self) -> List[Tuple[str, str]]:
+        """Различные пары валют путешествий с автообновлением курса"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT DISTINCT from_currency, to_currency FROM trips WHERE follow_market = 1
+        """)
+        
+        pairs = [(row['from_currency'], row['to_currency']) for row in cursor.fetchall()]
+        conn.close()
+        return pairs
+    
+    def apply_market_rates(self, rates: List[Tuple[str, str, float]], min_change: float = 0) -> int:
+        """
+        Установить рыночный курс всем путешествиям с автообновлением одной транзакцией.
+        
+        Для каждой пары выполняются два запроса над множеством путешествий (через
+        executemany по всем парам): событие смены курса в журнал и UPDATE курса
+        с пересчетом баланса. Путешествия, курс которых отличается от нового меньше
+        чем на долю min_change, не трогаются, чтобы не засорять журнал.
+        
+        Args:
+            rates (list): Список (from_currency, to_currency, курс)
+            min_change (float): Минимальное относительное изменение курса
         
-        balance_from = row[0]
-        balance_to = balance_from * new_rate
+        Returns:
+            int: Сколько путешествий получили новый курс
+        """
+        if not rates:
+            return 0
+        
+        params = [(rate, from_currency, to_currency, rate, rate * min_change)
+                  for from_currency, to_currency, rate in rates]
+        condition = """
+            follow_market = 1 AND from_currency = ? AND to_currency = ?
+            AND ABS(exchange_rate - ?) > ?
+        """
+        
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            # События пишутся первыми: после UPDATE условие по курсу уже не выполняется
+            cursor.executemany(f"""
+                INSERT INTO balance_events (trip_id, user_id, event_type, exchange_rate)
+                SELECT id, user_id, '{EVENT_RATE_CHANGE}', ? FROM trips
+                WHERE {condition}
+            """, params)
+            cursor.executemany(f"""
+                UPDATE trips SET exchange_rate = ?, balance_to = balance_from * ?,
+                                 rate_version = rate_version + 1
+                WHERE {condition}
+            """, [(param[0],) + param for param in params])
+            updated = cursor.rowcount
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        return updated
+    
+    def _debit_trip(self, cursor, trip_id: int, amount_from: float, amount_to: float,
+                    expected_rate_version: Optional[int]) -> bool:
+        """
+        Уменьшить баланс путешествия относительным UPDATE (без чтения старого значения),
+        поэтому одновременные расходы участников не затирают друг друга.
         
-        # Обновляем курс и пересчитываем баланс
+        expected_rate_version - версия курса, по которому посчитаны суммы; если курс
+        с тех пор менялся, баланс не меняется и возвращается False.
+        """
         cursor.execute("""
             UPDATE trips 
-            SET exchange_rate = ?, balance_to = ?
+            SET balance_from = balance_from - ?,
+                balance_to = balance_to - ?
+            WHERE id = ? AND (? IS NULL OR rate_version = ?)
+        """, (amount_from, amount_to, trip_id, expected_rate_version, expected_rate_version))
+        if cursor.rowcount:
+            return True
+        
+        with self._contention_lock:
+            self._contention['conflicts'] += 1
+        return False
+    
+    def add_expense(self, trip_id: int, user_id: int, amount_from: float, 
+                   amount_to: float, description: str = None,
+                   amount_original: float = None, currency_original: str = None,
+                   expected_rate_version: Optional[int] = None) -> Optional[int]:
+        """
+        Добавить расход (владельцем или участником путешествия)
+        
+        amount_original и currency_original - сумма и валюта, в которой расход
+        был фактически оплачен (если она отличается от валют путешествия).
+        Возвращает ID расхода или None, если путешествие недоступно или курс
+        изменился после expected_rate_version.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            self._begin_write(cursor, trip_id)
+            if not self._has_access(cursor, trip_id, user_id) or \
+                    not self._debit_trip(cursor, trip_id, amount_from, amount_to, expected_rate_version):
+                conn.rollback()
+                return None
+            
+            # Добавляем расход в историю
+            cursor.execute("""
+                INSERT INTO expenses (trip_id, user_id, amount_from, amount_to, description,
+                                      amount_original, currency_original)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (trip_id, user_id, amount_from, amount_to, description,
+                  amount_original, currency_original))
+            
+            expense_id = cursor.lastrowid
+            
+            self._append_event(cursor, trip_id, user_id, EVENT_EXPENSE,
+                               -amount_from, -amount_to, expense_id=expense_id)
+            self._track_budget(cursor, trip_id, amount_to)
+            self._maybe_snapshot(cursor, trip_id)
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return expense_id
+    
+    def add_expenses(self, trip_id: int, user_id: int,
+                     expenses: List[Tuple[float, float, float]], currency_original: str = None,
+                     description: str = None, expected_rate_version: Optional[int] = None) -> Optional[int]:
+        """
+        Добавить несколько расходов одной транзакцией.
+        
+        expenses - список (amount_from, amount_to, amount_original), где amount_original -
+        сумма в валюте оплаты currency_original.
+        Баланс путешествия уменьшается одним относительным UPDATE на сумму всех расходов.
+        Возвращает количество добавленных расходов или None, если путешествие
+        недоступно или курс изменился после expected_rate_version.
+        """
+        if not expenses:
+            return 0
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            total_from = sum(expense[0] for expense in expenses)
+            total_to = sum(expense[1] for expense in expenses)
+            
+            self._begin_write(cursor, trip_id)
+            if not self._has_access(cursor, trip_id, user_id) or \
+                    not self._debit_trip(cursor, trip_id, total_from, total_to, expected_rate_version):
+                conn.rollback()
+                return None
+            
+            events = []
+            for amount_from, amount_to, amount_original in expenses:
+                cursor.execute("""
+                    INSERT INTO expenses (trip_id, user_id, amount_from, amount_to, description,
+                                          amount_original, currency_original)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (trip_id, user_id, amount_from, amount_to, description,
+                      amount_original, currency_original))
+                events.append((trip_id, user_id, EVENT_EXPENSE, -amount_from, -amount_to,
+                               cursor.lastrowid))
+            
+            cursor.executemany("""
+                INSERT INTO balance_events (trip_id, user_id, event_type, delta_from,
+                                            delta_to, expense_id)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, events)
+            self._track_budget(cursor, trip_id, total_to)
+            self._maybe_snapshot(cursor, trip_id)
+            
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        return len(expenses)
+    
+    def get_expenses(self, trip_id: int, user_id: int, limit: int = 10) -> List[Dict]:
+        """Получить историю расходов (в общем путешествии - всех участников)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        expenses = []
+        if self._has_access(cursor, trip_id, user_id):
+            cursor.execute("""
+                SELECT * FROM expenses 
+                WHERE trip_id = ?
+                ORDER BY created_at DESC
+                LIMIT ?
+            """, (trip_id, limit))
+            expenses = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        
+        if not expenses:
+            archived = self._get_archived_rows(trip_id, user_id, "expenses")
+            expenses = sorted(archived, key=lambda expense: expense['created_at'], reverse=True)[:limit]
+        return expenses
+    
+    def get_balance(self, trip_id: int, user_id: int) -> Optional[Tuple[float, float]]:
+        """Получить баланс путешествия (последний снимок + события журнала после него)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        if not self._has_access(cursor, trip_id, user_id):
+            conn.close()
+            return None
+        
+        balance_from, balance_to, _, _ = self._compute_balance(cursor, trip_id)
+        conn.close()
+        return (balance_from, balance_to)
+    
+    def _replay_events(self, cursor, trip_id: int) -> Optional[Tuple[float, float, int]]:
+        """Пересчитать баланс по всему журналу: (balance_from, balance_to, id последнего события)"""
+        cursor.execute("""
+            SELECT id, event_type, delta_from, delta_to, exchange_rate FROM balance_events
+            WHERE trip_id = ?
+            ORDER BY id
+        """, (trip_id,))
+        events = cursor.fetchall()
+        
+        if not events:
+            return None
+        balance_from, balance_to = self._apply_events(0.0, 0.0, events)
+        return balance_from, balance_to, events[-1]['id']
+    
+    def replay_balance(self, trip_id: int, user_id: int) -> Optional[Tuple[float, float]]:
+        """Пересчитать баланс путешествия по всему журналу, без учета снимков"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT id FROM trips WHERE id = ? AND user_id = ?", (trip_id, user_id))
+        replayed = self._replay_events(cursor, trip_id) if cursor.fetchone() else None
+        conn.close()
+        
+        if replayed is None:
+            return None
+        return (replayed[0], replayed[1])
+    
+    def repair_balance(self, trip_id: int, user_id: int) -> Optional[Tuple[float, float]]:
+        """
+        Восстановить баланс путешествия из журнала.
+        
+        Баланс пересчитывается по всем событиям, записывается в trips,
+        а старые снимки заменяются одним новым. Возвращает восстановленный баланс.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT id FROM trips WHERE id = ? AND user_id = ?", (trip_id, user_id))
+        replayed = self._replay_events(cursor, trip_id) if cursor.fetchone() else None
+        if replayed is None:
+            conn.close()
+            return None
+        
+        balance_from, balance_to, last_event_id = replayed
+        
+        cursor.execute("""
+            UPDATE trips SET balance_from = ?, balance_to = ?
             WHERE id = ? AND user_id = ?
-        """, (new_rate, balance_to, trip_id, user_id))
+        """, (balance_from, balance_to, trip_id, user_id))
+        cursor.execute("DELETE FROM balance_snapshots WHERE trip_id = ?", (trip_id,))
+        cursor.execute("""
+            INSERT INTO balance_snapshots (trip_id, event_id, balance_from, balance_to)
+            VALUES (?, ?, ?, ?)
+        """, (trip_id, last_event_id, balance_from, balance_to))
         
         conn.commit()
         conn.close()
-        return True
+        return (balance_from, balance_to)
     
-    def add_expense(self, trip_id: int, user_id: int, amount_from: float, 
-                   amount_to: float, description: str = None) -> int:
-        """Добавить расход"""
+    def add_to_pocket(self, trip_id: int, user_id: int, currency: str,
+                      amount: float, rate_to_home: float) -> Optional[Dict]:
+        """
+        Пополнить (amount > 0) или уменьшить (amount < 0) валютный кошелек путешествия.
+        
+        Кошелек создается при первом пополнении. rate_to_home - курс 1 currency
+        в домашней валюте, по нему пересчитывается стоимость кошелька.
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        # Добавляем расход в историю
+        if not self._has_access(cursor, trip_id, user_id):
+            conn.close()
+            return None
+        
         cursor.execute("""
-            INSERT INTO expenses (trip_id, user_id, amount_from, amount_to, description)
+            INSERT INTO trip_pockets (trip_id, user_id, currency, amount, value_from)
             VALUES (?, ?, ?, ?, ?)
-        """, (trip_id, user_id, amount_from, amount_to, description))
+            ON CONFLICT(trip_id, currency) DO UPDATE SET
+                amount = amount + excluded.amount,
+                value_from = (amount + excluded.amount) * ?,
+                updated_at = CURRENT_TIMESTAMP
+        """, (trip_id, user_id, currency, amount, amount * rate_to_home, rate_to_home))
         
-        expense_id = cursor.lastrowid
+        cursor.execute("SELECT * FROM trip_pockets WHERE trip_id = ? AND currency = ?",
+                       (trip_id, currency))
+        row = cursor.fetchone()
         
-        # Обновляем баланс путешествия
+        conn.commit()
+        conn.close()
+        return dict(row)
+    
+    def get_pockets(self, trip_id: int, user_id: int) -> List[Dict]:
+        """Получить валютные кошельки путешествия"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        rows = []
+        if self._has_access(cursor, trip_id, user_id):
+            cursor.execute("""
+                SELECT * FROM trip_pockets 
+                WHERE trip_id = ?
+                ORDER BY currency
+            """, (trip_id,))
+            rows = cursor.fetchall()
+        conn.close()
+        
+        return [dict(row) for row in rows]
+    
+    def get_pocket_columns(self, shard: Optional[Tuple[int, int]] = None
+                           ) -> Tuple[List[int], List[float], List[str], List[str]]:
+        """
+        Получить кошельки всех путешествий (или путешествий, владельцы которых относятся
+        к воркеру shard = (номер, количество), см. sharding.shard_for_user) в виде колонок
+        для пакетного пересчета.
+        
+        Возвращает (id кошельков, суммы, валюты кошельков, домашние валюты путешествий).
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        index, count = shard or (0, 1)
         cursor.execute("""
-            UPDATE trips 
-            SET balance_from = balance_from - ?,
-                balance_to = balance_to - ?
-            WHERE id = ? AND user_id = ?
-        """, (amount_from, amount_to, trip_id, user_id))
+            SELECT p.id, p.amount, p.currency, t.from_currency
+            FROM trip_pockets p
+            JOIN trips t ON t.id = p.trip_id
+            WHERE ? <= 1 OR t.user_id % ? = ?
+        """, (count, count, index))
+        rows = cursor.fetchall()
+        conn.close()
+        
+        if not rows:
+            return [], [], [], []
+        ids, amounts, currencies, home_currencies = zip(*rows)
+        return list(ids), list(amounts), list(currencies), list(home_currencies)
+    
+    def get_expense_columns(self, trip_id: int, user_id: int) -> Tuple[List[int], List[float], List[float]]:
+        """
+        Получить расходы путешествия в виде колонок для векторной аналитики.
+        
+        Возвращает (время расходов в unix-секундах, суммы в валюте пребывания,
+        суммы в домашней валюте), отсортированные по времени.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        rows = []
+        if self._has_access(cursor, trip_id, user_id):
+            cursor.execute("""
+                SELECT CAST(strftime('%s', created_at) AS INTEGER), amount_to, amount_from
+                FROM expenses
+                WHERE trip_id = ?
+                ORDER BY created_at ASC, id ASC
+            """, (trip_id,))
+            rows = cursor.fetchall()
+        conn.close()
+        
+        if not rows:
+            return [], [], []
+        timestamps, amounts_to, amounts_from = zip(*rows)
+        return list(timestamps), list(amounts_to), list(amounts_from)
+    
+    def update_pocket_values(self, values: List[Tuple[float, int]]) -> int:
+        """Записать новые стоимости кошельков: список (value_from, id кошелька) одной транзакцией"""
+        if not values:
+            return 0
+        
+        conn = self.get_connection()
+        try:
+            conn.executemany("""
+                UPDATE trip_pockets SET value_from = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, values)
+            conn.commit()
+        finally:
+            conn.close()
+        return len(values)
+    
+    def add_alert(self, user_id: int, chat_id: int, from_currency: str,
+                  to_currency: str, direction: str, threshold: float) -> Dict:
+        """Добавить подписку на курс"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            INSERT INTO rate_alerts (user_id, chat_id, from_currency, to_currency, direction, threshold)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (user_id, chat_id, from_currency, to_currency, direction, threshold))
+        
+        cursor.execute("SELECT * FROM rate_alerts WHERE id = ?", (cursor.lastrowid,))
+        row = cursor.fetchone()
         
         conn.commit()
         conn.close()
-        return expense_id
+        return dict(row)
     
-    def get_expenses(self, trip_id: int, user_id: int, limit: int = 10) -> List[Dict]:
-        """Получить историю расходов"""
+    def get_alerts(self, user_id: int) -> List[Dict]:
+        """Получить активные подписки пользователя"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
         cursor.execute("""
-            SELECT * FROM expenses 
-            WHERE trip_id = ? AND user_id = ?
-            ORDER BY created_at DESC
-            LIMIT ?
-        """, (trip_id, user_id, limit))
+            SELECT * FROM rate_alerts 
+            WHERE user_id = ? AND is_active = 1
+            ORDER BY id
+        """, (user_id,))
         
         rows = cursor.fetchall()
         conn.close()
         
         return [dict(row) for row in rows]
     
-    def get_balance(self, trip_id: int, user_id: int) -> Optional[Tuple[float, float]]:
-        """Получить баланс путешествия"""
+    def get_active_alerts(self) -> List[Dict]:
+        """Получить все активные подписки (для загрузки в память при запуске)"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        cursor.execute("SELECT * FROM rate_alerts WHERE is_active = 1")
+        
+        rows = cursor.fetchall()
+        conn.close()
+        
+        return [dict(row) for row in rows]
+    
+    def delete_alert(self, alert_id: int, user_id: int) -> bool:
+        """Удалить подписку пользователя"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("DELETE FROM rate_alerts WHERE id = ? AND user_id = ?", (alert_id, user_id))
+        deleted = cursor.rowcount > 0
+        
+        conn.commit()
+        conn.close()
+        return deleted
+    
+    def deactivate_alerts(self, alert_ids: List[int]) -> int:
+        """Отметить подписки как сработавшие (одной транзакцией)"""
+        if not alert_ids:
+            return 0
+        
+        conn = self.get_connection()
+        try:
+            conn.executemany("""
+                UPDATE rate_alerts SET is_active = 0, triggered_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, [(alert_id,) for alert_id in alert_ids])
+            conn.commit()
+        finally:
+            conn.close()
+        return len(alert_ids)
+    
+    def iter_expenses(self, trip_id: int, user_id: int,
+                      batch_size: int = 500) -> Iterator[Dict]:
+        """
+        Потоково перебрать все расходы путешествия (от старых к новым).
+        
+        Строки читаются пачками через fetchmany, поэтому в памяти
+        одновременно находится не больше batch_size записей
+        независимо от размера путешествия. Расходы архивного путешествия
+        распаковываются из архива целиком.
+        """
+        found = False
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            if self._has_access(cursor, trip_id, user_id):
+                cursor.execute("""
+                    SELECT * FROM expenses 
+                    WHERE trip_id = ?
+                    ORDER BY created_at ASC, id ASC
+                """, (trip_id,))
+                
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    found = True
+                    for row in rows:
+                        yield dict(row)
+        finally:
+            conn.close()
+        
+        if not found:
+            archived = self._get_archived_rows(trip_id, user_id, "expenses")
+            yield from sorted(archived, key=lambda expense: (expense['created_at'], expense['id']))
+    
+    def set_budget(self, trip_id: int, user_id: int, daily_limit: Optional[float],
+                   total_limit: Optional[float]) -> bool:
+        """
+        Задать дневной и общий бюджет путешествия (None - без ограничения).
+        
+        При первом задании бюджета счетчики заполняются по уже внесенным расходам;
+        дальше их поддерживают add_expense и add_expenses.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT id FROM trips WHERE id = ? AND user_id = ?", (trip_id, user_id))
+        if not cursor.fetchone():
+            conn.close()
+            return False
+        
         cursor.execute("""
-            SELECT balance_from, balance_to FROM trips 
-            WHERE id = ? AND user_id = ?
-        """, (trip_id, user_id))
+            INSERT INTO trip_budgets (trip_id, user_id, daily_limit, total_limit,
+                                      spent_day, spent_total, day)
+            SELECT ?, ?, ?, ?,
+                   COALESCE(SUM(CASE WHEN date(created_at) = date('now') THEN amount_to ELSE 0 END), 0),
+                   COALESCE(SUM(amount_to), 0),
+                   date('now')
+            FROM expenses WHERE trip_id = ?
+            ON CONFLICT(trip_id) DO UPDATE SET
+                daily_limit = excluded.daily_limit,
+                total_limit = excluded.total_limit
+        """, (trip_id, user_id, daily_limit, total_limit, trip_id))
+        
+        conn.commit()
+        conn.close()
+        return True
+    
+    def get_budget(self, trip_id: int) -> Optional[Dict]:
+        """Бюджет путешествия и потраченное сегодня и всего (None, если бюджет не задан)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT trip_id, daily_limit, total_limit, spent_total,
+                   CASE WHEN day = date('now') THEN spent_day ELSE 0 END AS spent_day
+            FROM trip_budgets WHERE trip_id = ?
+        """, (trip_id,))
         
         row = cursor.fetchone()
         conn.close()
         
-        if row:
-            return (row[0], row[1])
-        return None
-
+        return dict(row) if row else None
+    
+    def delete_budget(self, trip_id: int, user_id: int) -> bool:
+        """Удалить бюджет путешествия"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("DELETE FROM trip_budgets WHERE trip_id = ? AND user_id = ?", (trip_id, user_id))
+        deleted = cursor.rowcount > 0
+        
+        conn.commit()
+        conn.close()
+        return deleted
+    
+    def get_trip_currencies(self) -> List[str]:
+        """Все валюты, которые используются в путешествиях и кошельках"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT from_currency FROM trips
+            UNION SELECT to_currency FROM trips
+            UNION SELECT currency FROM trip_pockets
+        """)
+        
+        currencies = [row[0] for row in cursor.fetchall()]
+        conn.close()
+        
+        return sorted(currencies)
+    
+    def get_completed_rate_chunks(self, currencies: List[str]) -> Set[Tuple[str, str]]:
+        """Загруженные интервалы исторических курсов: множество (валюта, начало интервала)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        placeholders = ",".join("?" * len(currencies))
+        cursor.execute(f"""
+            SELECT currency, start_date FROM rate_backfill_chunks
+            WHERE currency IN ({placeholders})
+        """, list(currencies))
+        
+        chunks = {(row['currency'], row['start_date']) for row in cursor.fetchall()}
+        conn.close()
+        
+        return chunks
+    
+    def save_rate_chunk(self, start_date: str, end_date: str,
+                        rates: List[Tuple[str, str, float]], completed: List[str]) -> int:
+        """
+        Сохранить исторические курсы одного интервала дат одной транзакцией.
+        
+        rates - список (дата, валюта, единиц валюты за 1 USD); completed - валюты,
+        интервал которых загружен полностью и не будет запрашиваться повторно.
+        Курсы и контрольная точка записываются вместе, поэтому после сбоя
+        загрузка продолжается с первого несохраненного интервала.
+        Возвращает количество сохраненных курсов.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.executemany("""
+                INSERT OR REPLACE INTO historical_rates (date, currency, rate_usd)
+                VALUES (?, ?, ?)
+            """, rates)
+            cursor.executemany("""
+                INSERT OR REPLACE INTO rate_backfill_chunks (currency, start_date, end_date)
+                VALUES (?, ?, ?)
+            """, [(currency, start_date, end_date) for currency in completed])
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        return len(rates)
+    
+    def get_rate_history(self, from_currency: str, to_currency: str,
+                         start_date: str, end_date: str) -> List[Tuple[str, float]]:
+        """
+        Курс 1 from_currency -> to_currency по дням из локальной таблицы (без запросов к API).
+        
+        Курсы хранятся относительно USD, кросс-курс считается как to / from.
+        Возвращает список (дата, курс) по возрастанию даты; дни без курса пропускаются.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT f.date, t.rate_usd / f.rate_usd AS rate
+            FROM historical_rates f
+            JOIN historical_rates t ON t.date = f.date AND t.currency = ?
+            WHERE f.currency = ? AND f.date BETWEEN ? AND ?
+            ORDER BY f.date
+        """, (to_currency, from_currency, start_date, end_date))
+        
+        history = [(row['date'], row['rate']) for row in cursor.fetchall()]
+        conn.close()
+        
+        return history
+    
+    def create_invite(self, trip_id: int, user_id: int) -> Optional[str]:
+        """Код приглашения в общее путешествие (создается при первом вызове; только для владельца)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT invite_code FROM trips WHERE id = ? AND user_id = ?", (trip_id, user_id))
+        row = cursor.fetchone()
+        if not row or row['invite_code']:
+            conn.close()
+            return row['invite_code'] if row else None
+        
+        code = secrets.token_urlsafe(6)
+        cursor.execute("UPDATE trips SET invite_code = ? WHERE id = ?", (code, trip_id))
+        
+        conn.commit()
+        conn.close()
+        return code
+    
+    def join_trip(self, invite_code: str, user_id: int) -> Optional[Dict]:
+        """
+        Присоединиться к общему путешествию по коду приглашения.
+        
+        Путешествие становится активным для пользователя. Возвращает путешествие
+        или None, если код неверный.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT id, user_id FROM trips WHERE invite_code = ?", (invite_code,))
+        trip = cursor.fetchone()
+        if not trip:
+            conn.close()
+            return None
+        
+        cursor.execute("UPDATE trips SET is_active = 0 WHERE user_id = ?", (user_id,))
+        cursor.execute("UPDATE trip_members SET is_active = 0 WHERE user_id = ?", (user_id,))
+        if trip['user_id'] == user_id:
+            cursor.execute("UPDATE trips SET is_active = 1 WHERE id = ?", (trip['id'],))
+        else:
+            cursor.execute("""
+                INSERT INTO trip_members (trip_id, user_id, is_active) VALUES (?, ?, 1)
+                ON CONFLICT(trip_id, user_id) DO UPDATE SET is_active = 1
+            """, (trip['id'], user_id))
+        
+        conn.commit()
+        conn.close()
+        return self.get_trip(trip['id'], user_id)
+    
+    def leave_trip(self, trip_id: int, user_id: int) -> bool:
+        """Выйти из общего путешествия (владелец выйти не может)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("DELETE FROM trip_members WHERE trip_id = ? AND user_id = ?", (trip_id, user_id))
+        left = cursor.rowcount > 0
+        
+        conn.commit()
+        conn.close()
+        return left
+    
+    def get_trip_members(self, trip_id: int) -> List[int]:
+        """ID участников общего путешествия (без владельца) в порядке присоединения"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT user_id FROM trip_members WHERE trip_id = ? ORDER BY joined_at",
+                       (trip_id,))
+        
+        members = [row['user_id'] for row in cursor.fetchall()]
+        conn.close()
+        return members
+    
+    def _archive_connection(self, create: bool = False) -> Optional[sqlite3.Connection]:
+        """Соединение с архивом старых путешествий; None, если архива еще нет и create не задан"""
+        if not create and not os.path.exists(self.archive_name):
+            return None
+        
+        conn = sqlite3.connect(self.archive_name)
+        conn.row_factory = sqlite3.Row
+        if not self._archive_ready:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Поля путешествия хранятся целиком в data (JSON), ключевые - отдельными колонками
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS archived_trips (
+                    id INTEGER PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    created_at TIMESTAMP,
+                    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    data TEXT NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_archived_trips_user
+                ON archived_trips (user_id)
+            """)
+            # Участники общих путешествий: по ним архивное путешествие находят не только владельцы
+            members_exist = conn.execute("""
+                SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'archived_members'
+            """).fetchone()
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS archived_members (
+                    trip_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    PRIMARY KEY (trip_id, user_id)
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_archived_members_user
+                ON archived_members (user_id)
+            """)
+            # Строки связанных таблиц: одна упакованная запись на таблицу путешествия
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS archived_rows (
+                    trip_id INTEGER NOT NULL,
+                    table_name TEXT NOT NULL,
+                    row_count INTEGER NOT NULL,
+                    compressed INTEGER NOT NULL,
+                    payload BLOB NOT NULL,
+                    PRIMARY KEY (trip_id, table_name)
+                )
+            """)
+            if not members_exist:
+                self._fill_archived_members(conn)
+            conn.commit()
+            self._archive_ready = True
+        return conn
+    
+    @staticmethod
+    def _fill_archived_members(archive: sqlite3.Connection):
+        """Заполнить archived_members по упакованным строкам trip_members (архивы старых версий)"""
+        for row in archive.execute("""
+            SELECT trip_id, compressed, payload FROM archived_rows
+            WHERE table_name = 'trip_members' AND row_count > 0
+        """).fetchall():
+            columns, rows = _unpack_rows(row['payload'], row['compressed'])
+            user_index = columns.index('user_id')
+            archive.executemany("""
+                INSERT OR IGNORE INTO archived_members (trip_id, user_id) VALUES (?, ?)
+            """, [(row['trip_id'], values[user_index]) for values in rows])
+    
+    def _get_archived_trips(self, user_id: int, trip_id: Optional[int] = None) -> List[Dict]:
+        """
+        Путешествия пользователя (свои и общие, в которых он участник) из архива,
+        все или одно, с пометкой 'archived'
+        """
+        archive = self._archive_connection()
+        if archive is None:
+            return []
+        
+        try:
+            rows = archive.execute("""
+                SELECT data, created_at FROM archived_trips
+                WHERE user_id = ? AND (? IS NULL OR id = ?)
+                UNION ALL
+                SELECT t.data, t.created_at FROM archived_members m
+                JOIN archived_trips t ON t.id = m.trip_id
+                WHERE m.user_id = ? AND (? IS NULL OR m.trip_id = ?)
+                ORDER BY created_at DESC
+            """, (user_id, trip_id, trip_id, user_id, trip_id, trip_id)).fetchall()
+        finally:
+            archive.close()
+        
+        trips = []
+        for row in rows:
+            trip = dict(json.loads(row['data']), archived=True)
+            if trip['user_id'] != user_id:
+                trip['shared'] = True
+            trips.append(trip)
+        return trips
+    
+    def _get_archived_rows(self, trip_id: int, user_id: int, table: str) -> List[Dict]:
+        """Строки таблицы table архивного путешествия (пустой список, если путешествия нет в архиве)"""
+        archive = self._archive_connection()
+        if archive is None:
+            return []
+        
+        try:
+            row = archive.execute("""
+                SELECT r.compressed, r.payload FROM archived_rows r
+                JOIN archived_trips t ON t.id = r.trip_id
+                WHERE r.trip_id = ? AND r.table_name = ?
+                  AND (t.user_id = ? OR EXISTS (
+                      SELECT 1 FROM archived_members m WHERE m.trip_id = t.id AND m.user_id = ?
+                  ))
+            """, (trip_id, table, user_id, user_id)).fetchone()
+        finally:
+            archive.close()
+        
+        if not row:
+            return []
+        columns, rows = _unpack_rows(row['payload'], row['compressed'])
+        return [dict(zip(columns, values)) for values in rows]
+    
+    def get_idle_trip_ids(self, idle_days: int, limit: int = 100) -> List[int]:
+        """
+        Неактивные путешествия (у владельца и всех участников) без изменений баланса
+        (расходов, пополнений, курса) за idle_days дней
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        horizon = f"-{int(idle_days)} days"
+        cursor.execute("""
+            SELECT t.id FROM trips t
+            WHERE t.is_active = 0 AND t.created_at < datetime('now', ?)
+              AND NOT EXISTS (
+                  SELECT 1 FROM balance_events e
+                  WHERE e.trip_id = t.id AND e.created_at >= datetime('now', ?)
+              )
+              AND NOT EXISTS (
+                  SELECT 1 FROM trip_members m WHERE m.trip_id = t.id AND m.is_active = 1
+              )
+            ORDER BY t.id
+            LIMIT ?
+        """, (horizon, horizon, limit))
+        
+        trip_ids = [row['id'] for row in cursor.fetchall()]
+        conn.close()
+        return trip_ids
+    
+    def archive_trip(self, trip_id: int, compress: bool = True) -> Optional[int]:
+        """
+        Перенести неактивное путешествие вместе с его расходами, журналом баланса,
+        кошельками и бюджетом в архив.
+        
+        Путешествие блокируется на запись только на время переноса его собственных строк.
+        Архив фиксируется раньше основной базы: если процесс прервется между ними,
+        путешествие останется в обеих базах (чтение идет из основной), а следующая
+        архивация перезапишет архивную копию.
+        
+        Args:
+            trip_id (int): ID путешествия
+            compress (bool): Сжимать строки zlib
+        
+        Returns:
+            int: Сколько расходов перенесено; None, если путешествие не найдено или активно
+        """
+        conn = self.get_connection()
+        archive = self._archive_connection(create=True)
+        try:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("SELECT * FROM trips WHERE id = ? AND is_active = 0", (trip_id,))
+            trip = cursor.fetchone()
+            if not trip:
+                conn.rollback()
+                return None
+            
+            packed = []
+            expense_count = 0
+            member_ids = []
+            for table in ARCHIVED_TABLES:
+                cursor.execute(f"SELECT * FROM {table} WHERE trip_id = ?", (trip_id,))
+                columns = [column[0] for column in cursor.description]
+                rows = [tuple(row) for row in cursor.fetchall()]
+                if table == "expenses":
+                    expense_count = len(rows)
+                elif table == "trip_members":
+                    member_ids = [row[columns.index('user_id')] for row in rows]
+                packed.append((trip_id, table, len(rows), int(compress), _pack_rows(columns, rows, compress)))
+            
+            archive.execute("""
+                INSERT OR REPLACE INTO archived_trips (id, user_id, name, created_at, data)
+                VALUES (?, ?, ?, ?, ?)
+            """, (trip_id, trip['user_id'], trip['name'], trip['created_at'],
+                  json.dumps(dict(trip), ensure_ascii=False)))
+            archive.executemany("""
+                INSERT OR REPLACE INTO archived_rows (trip_id, table_name, row_count, compressed, payload)
+                VALUES (?, ?, ?, ?, ?)
+            """, packed)
+            archive.execute("DELETE FROM archived_members WHERE trip_id = ?", (trip_id,))
+            archive.executemany("INSERT INTO archived_members (trip_id, user_id) VALUES (?, ?)",
+                                [(trip_id, member_id) for member_id in member_ids])
+            archive.commit()
+            
+            for table in ARCHIVED_TABLES:
+                cursor.execute(f"DELETE FROM {table} WHERE trip_id = ?", (trip_id,))
+            cursor.execute("DELETE FROM trips WHERE id = ?", (trip_id,))
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            archive.close()
+            conn.close()
+        
+        return expense_count
+    
+    def restore_trip(self, trip_id: int, user_id: int) -> bool:
+        """
+        Вернуть путешествие из архива в основную базу (неактивным).
+        
+        Вернуть может владелец или участник общего путешествия. Если имя путешествия
+        за это время занято новым путешествием владельца, к нему добавляется ID.
+        """
+        archive = self._archive_connection()
+        if archive is None:
+            return False
+        
+        try:
+            trips = self._get_archived_trips(user_id, trip_id)
+            if not trips:
+                return False
+            trip = trips[0]
+            del trip['archived']
+            trip.pop('shared', None)
+            trip['is_active'] = 0
+            packed = archive.execute("""
+                SELECT table_name, compressed, payload FROM archived_rows WHERE trip_id = ?
+            """, (trip_id,)).fetchall()
+            
+            conn = self.get_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT 1 FROM trips WHERE user_id = ? AND name = ? AND id != ?",
+                               (trip['user_id'], trip['name'], trip_id))
+                if cursor.fetchone():
+                    trip['name'] = f"{trip['name']} ({trip_id})"
+                
+                cursor.execute(f"""
+                    INSERT OR REPLACE INTO trips ({", ".join(trip)})
+                    VALUES ({", ".join("?" * len(trip))})
+                """, list(trip.values()))
+                for row in packed:
+                    columns, rows = _unpack_rows(row['payload'], row['compressed'])
+                    if rows:
+                        cursor.executemany(f"""
+                            INSERT OR REPLACE INTO {row['table_name']} ({", ".join(columns)})
+                            VALUES ({", ".join("?" * len(columns))})
+                        """, rows)
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+            
+            archive.execute("DELETE FROM archived_rows WHERE trip_id = ?", (trip_id,))
+            archive.execute("DELETE FROM archived_members WHERE trip_id = ?", (trip_id,))
+            archive.execute("DELETE FROM archived_trips WHERE id = ?", (trip_id,))
+            archive.commit()
+        finally:
+            archive.close()
+        
+        return True
+    
+    def vacuum_status(self) -> Dict[str, int]:
+        """Режим auto_vacuum (0 - выключен, 2 - incremental), число страниц базы и свободных страниц"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        status = {}
+        for pragma in ("auto_vacuum", "page_count", "freelist_count"):
+            cursor.execute(f"PRAGMA {pragma}")
+            status[pragma] = cursor.fetchone()[0]
+        
+        conn.close()
+        return status
+    
+    def incremental_vacuum_step(self, pages: int) -> int:
+        """
+        Вернуть файловой системе до pages свободных страниц одной короткой транзакцией.
+        
+        Returns:
+            int: Сколько свободных страниц осталось
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        # execute() делает один шаг прагмы и освобождает одну страницу,
+        # executescript() выполняет ее до конца
+        cursor.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+        cursor.execute("PRAGMA freelist_count")
+        remaining = cursor.fetchone()[0]
+        
+        conn.close()
+        return remaining
+    
+    def full_vacuum(self):
+        """
+        Полный VACUUM с переводом базы в режим auto_vacuum=INCREMENTAL.
+        
+        Блокирует базу на все время перестройки файла, поэтому запускается
+        вручную один раз для баз, созданных до появления архивации.
+        """
+        conn = self.get_connection()
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        conn.close()
@@ -0,0 +1,151 @@
+import re
+from decimal import Decimal, InvalidOperation
+from typing import Iterable, List, Optional, Tuple
+
+# Знаки умножения, которые понимает парсер: 3*120, 3x120, 3×120
+MULTIPLY_SIGNS = "*xх×"
+
+# Символы валют, которые можно писать рядом с суммой: €20, 20$
+CURRENCY_SYMBOLS = {
+    "€": "EUR", "$": "USD", "£": "GBP", "¥": "JPY", "₽": "RUB",
+    "₺": "TRY", "฿": "THB", "₸": "KZT", "₴": "UAH", "₹": "INR",
+    "₩": "KRW", "₾": "GEL", "₫": "VND",
+}
+
+# Словесные обозначения валют
+CURRENCY_ALIASES = {
+    "руб": "RUB", "евро": "EUR", "долл": "USD", "лир": "TRY", "бат": "THB",
+}
+
+# Код валюты (3 латинские буквы) или словесное обозначение отдельным словом
+_CURRENCY_WORD_RE = re.compile(r'(?<![^\W\d_])([^\W\d_]+)\.?(?![^\W\d_])')
+
+# Число: целая часть и необязательная дробная через точку или запятую
+_NUMBER_RE = re.compile(r'\d+(?:[.,]\d+)?')
+
+# Убираем пробелы вокруг операторов, чтобы "3 * 120" и "3 X 120" считались одним выражением
+_OPERATOR_SPACES_RE = re.compile(r'\s*([+' + MULTIPLY_SIGNS + r'])\s*', re.IGNORECASE)
+
+# Разделители между суммами: пробелы, переводы строк, точка с запятой
+_SEPARATOR_RE = re.compile(r'[\s;]+')
+
+
+def _parse_number(text: str) -> Decimal:
+    """Преобразовать строку с числом в Decimal (запятая допускается как десятичный разделитель)"""
+    if not _NUMBER_RE.fullmatch(text):
+        raise ValueError(f"Не число: {text}")
+    return Decimal(text.replace(',', '.'))
+
+
+def evaluate_expression(expression: str) -> Decimal:
+    """
+    Вычислить простое выражение из чисел, сложения и умножения.
+
+    Поддерживается только грамматика "сумма произведений" (например, 2*50+30),
+    без скобок и без eval(), поэтому разбор безопасен для пользовательского ввода.
+
+    Raises:
+        ValueError: если выражение некорректно
+    """
+    total = Decimal(0)
+    for term in expression.split('+'):
+        if not term:
+            raise ValueError(f"Некорректное выражение: {expression}")
+
+        factors = re.split('[' + MULTIPLY_SIGNS + ']', term.lower())
+        product = Decimal(1)
+        for factor in factors:
+            product *= _parse_number(factor)
+        total += product
+    return total
+
+
+def parse_amounts(text: str) -> Optional[List[float]]:
+    """
+    Разобрать сообщение с одной или несколькими суммами.
+
+    Суммы разделяются пробелами, переводами строк или ";".
+    Каждая сумма может быть простым выражением: "120 45 3*120" -> [120, 45, 360].
+
+    Returns:
+        list: Список положительных сумм или None, если сообщение не похоже на суммы
+    """
+    text = _OPERATOR_SPACES_RE.sub(r'\1', text.strip())
+    if not text:
+        return None
+
+    amounts = []
+    for chunk in _SEPARATOR_RE.split(text):
+        if not chunk:
+            continue
+        try:
+            value = evaluate_expression(chunk)
+        except (ValueError, InvalidOperation):
+            return None
+        if value <= 0:
+            return None
+        amounts.append(float(value))
+
+    return amounts or None
+
+
+def extract_currency(text: str, currencies: Iterable[str]) -> Tuple[Optional[str], str]:
+    """
+    Найти в сообщении обозначение валюты и убрать его из текста.
+
+    Понимает символы (€20, 20$), коды ("20 eur", "EUR 20") и словесные
+    обозначения из CURRENCY_ALIASES. Знаки умножения (3x120) валютой не считаются.
+
+    Args:
+        text (str): Текст сообщения
+        currencies (iterable): Допустимые коды валют
+
+    Returns:
+        tuple: (код валюты или None, текст без обозначения валюты).
+               Если в сообщении указаны разные валюты, код валюты равен "".
+    """
+    currencies = set(currencies)
+    found = set()
+
+    for symbol, code in CURRENCY_SYMBOLS.items():
+        if symbol in text:
+            found.add(code)
+            text = text.replace(symbol, " ")
+
+    def replace_word(match):
+        word = match.group(1)
+        code = word.upper()
+        if code not in currencies:
+            code = CURRENCY_ALIASES.get(word.lower())
+        if not code:
+            # Не валюта (например, знак умножения "x") - оставляем как есть
+            return match.group(0)
+        found.add(code)
+        return " "
+
+    text = _CURRENCY_WORD_RE.sub(replace_word, text)
+
+    if len(found) > 1:
+        return "", text
+    return (found.pop() if found else None), text
+
+
+def parse_expense_message(text: str,
+                          currencies: Iterable[str] = ()) -> Optional[Tuple[List[float], Optional[str]]]:
+    """
+    Разобрать сообщение с суммами и необязательной валютой: "20 EUR", "€5 7,5", "3*120".
+
+    Одна валюта относится ко всем суммам сообщения.
+
+    Returns:
+        tuple: (список сумм, код валюты или None, если валюта не указана)
+               или None, если сообщение не похоже на расход
+    """
+    currency, text = extract_currency(text, currencies)
+    if currency == "":
+        return None
+
+    amounts = parse_amounts(text)
+    if not amounts:
+        return None
+    return amounts, currency
@@ -0,0 +1,74 @@
+import re
+import subprocess
+import sys
+from typing import List, Tuple
+
+# Модули, время импорта которых измеряется по умолчанию
+DEFAULT_MODULES = ["settings", "database", "main", "currency_api", "bot"]
+
+# Строка вывода -X importtime: "import time:  self [us] | cumulative | imported package"
+_IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def measure_import(module: str, runs: int = 3) -> Tuple[float, List[Tuple[str, int]]]:
+    """
+    Измерить время холодного импорта модуля в отдельном процессе через `python -X importtime`.
+
+    Returns:
+        tuple: (лучшее из runs накопленное время импорта модуля в миллисекундах,
+                прямые зависимости модуля с их накопленным временем в микросекундах)
+    """
+    best_total = None
+    best_children: List[Tuple[str, int]] = []
+
+    for _ in range(runs):
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            raise RuntimeError(f"Не удалось импортировать {module}:\n{completed.stderr}")
+
+        # Зависимости печатаются перед модулем, который их импортировал, с большим отступом
+        block: List[Tuple[str, int, int]] = []
+        for line in completed.stderr.splitlines():
+            match = _IMPORTTIME_RE.match(line)
+            if not match:
+                continue
+            cumulative, indent, name = int(match.group(2)), len(match.group(3)), match.group(4)
+            if indent > 1:
+                block.append((name, cumulative, indent))
+                continue
+            if name == module:
+                if best_total is None or cumulative < best_total:
+                    best_total = cumulative
+                    children = {child: time_us for child, time_us, child_indent in block if child_indent == 3}
+                    best_children = sorted(children.items(), key=lambda item: item[1], reverse=True)
+                break
+            block = []
+
+    if best_total is None:
+        # Встроенные и уже загруженные интерпретатором модули (sys, builtins) в вывод не попадают
+        raise RuntimeError(f"Модуль {module} не найден в выводе -X importtime: "
+                           f"он встроен в интерпретатор или загружается при его запуске")
+
+    return best_total / 1000, best_children
+
+
+if __name__ == "__main__":
+    # Использование: python import_benchmark.py [модуль ...]
+    modules = sys.argv[1:] or DEFAULT_MODULES
+
+    failed = False
+    for module in modules:
+        try:
+            total_ms, children = measure_import(module)
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            failed = True
+            continue
+        print(f"{module}: {total_ms:.1f} мс")
+        for name, cumulative in children[:5]:
+            print(f"    {name:<30} {cumulative / 1000:8.1f} мс")
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,122 @@
+import re
+from collections import OrderedDict
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from expense_parser import CURRENCY_ALIASES, CURRENCY_SYMBOLS, evaluate_expression
+
+# Сколько секунд Telegram может отдавать ответ на такой же запрос из своего кэша
+INLINE_CACHE_TIME = 300
+
+# Сколько отрендеренных ответов хранить в памяти
+INLINE_CACHE_SIZE = 5000
+
+# Валюты, в которые конвертируется сумма, если целевая валюта не указана ("100 usd")
+DEFAULT_TARGETS = ("USD", "EUR", "RUB", "GBP", "TRY", "THB")
+
+# Слова между валютами, которые пропускаются: "100 usd to thb", "100 usd в thb"
+CONNECTORS = {"to", "in", "into", "в", "на", "->", "→", "=", "-"}
+
+_SYMBOL_RE = re.compile("[" + re.escape("".join(CURRENCY_SYMBOLS)) + "]")
+
+# Код валюты, написанный слитно с числом: "100usd", "usd100"
+_GLUED_CODE_RE = re.compile(r'(?<=\d)(?=[^\W\d_]{3,})|(?<=[^\W\d_]{3})(?=\d)')
+
+
+def parse_conversion_query(query: str, currencies: Iterable[str]) -> Optional[Tuple[Decimal, str, Optional[str]]]:
+    """
+    Разобрать inline-запрос конвертации: "100 usd thb", "$20 в руб", "3*120 eur".
+
+    Returns:
+        tuple: (сумма, исходная валюта, целевая валюта или None) или None, если запрос не понят
+    """
+    currencies = set(currencies)
+    text = _SYMBOL_RE.sub(lambda match: f" {CURRENCY_SYMBOLS[match.group(0)]} ", query.lower())
+    text = _GLUED_CODE_RE.sub(" ", text)
+
+    amount = None
+    codes = []
+    for token in text.split():
+        if token in CONNECTORS:
+            continue
+        code = token.upper() if token.upper() in currencies else CURRENCY_ALIASES.get(token.rstrip("."))
+        if code:
+            codes.append(code)
+            continue
+        if amount is not None:
+            return None
+        try:
+            amount = evaluate_expression(token)
+        except (ValueError, InvalidOperation):
+            return None
+
+    if not 1 <= len(codes) <= 2:
+        return None
+    return (amount if amount is not None else Decimal(1)), codes[0], (codes[1] if len(codes) == 2 else None)
+
+
+def normalize_query(parsed: Tuple[Decimal, str, Optional[str]]) -> Tuple[str, str, str]:
+    """Ключ кэша: одинаковые по смыслу запросы ("100 usd thb", "100.0 USD в THB") совпадают"""
+    amount, from_currency, to_currency = parsed
+    return format(amount.normalize(), "f"), from_currency, to_currency or ""
+
+
+class RenderedResultCache:
+    """LRU-кэш готовых ответов на inline-запросы"""
+
+    def __init__(self, max_size: int = INLINE_CACHE_SIZE):
+        self.max_size = max_size
+        self._items: "OrderedDict[Tuple, List]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Tuple) -> Optional[List]:
+        results = self._items.get(key)
+        if results is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return results
+
+    def put(self, key: Tuple, results: List):
+        self._items[key] = results
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {'size': len(self._items), 'hits': self.hits, 'misses': self.misses}
+
+
+def render_conversions(amount: Decimal, from_currency: str, targets: Iterable[str],
+                       rates: Dict[str, float]) -> List:
+    """
+    Результаты InlineQueryResultArticle для конвертации amount from_currency в каждую из targets.
+
+    Args:
+        rates (dict): Матрица курсов {код валюты: единиц за 1 базовую валюту}
+    """
+    from telegram import InlineQueryResultArticle, InputTextMessageContent
+
+    results = []
+    base_rate = rates.get(from_currency)
+    if not base_rate:
+        return results
+
+    for to_currency in targets:
+        if to_currency == from_currency or not rates.get(to_currency):
+            continue
+        rate = rates[to_currency] / base_rate
+        converted = float(amount) * rate
+        text = f"{amount:f} {from_currency} = {converted:.2f} {to_currency}"
+        results.append(InlineQueryResultArticle(
+            id=f"{from_currency}{to_currency}{amount:f}"[:64],
+            title=text,
+            description=f"1 {from_currency} = {rate:.4f} {to_currency}",
+            input_message_content=InputTextMessageContent(text)
+        ))
+    return results
@@ -1,19 +1,96 @@
 import sys
-import requests
-from dotenv import load_dotenv
-import os
-from colorama import Fore, Style
+import threading
+
+from tracing import traced
 
 # Устанавливаем кодировку UTF-8 для вывода в консоль Windows
 if sys.platform == 'win32':
     sys.stdout.reconfigure(encoding='utf-8')
     sys.stderr.reconfigure(encoding='utf-8')
 
-# Загружаем переменные окружения
-load_dotenv()
+# requests и colorama импортируются внутри функций: импорт requests занимает ~100 мс,
+# а модули, которым HTTP не нужен (например, database или settings), не должны за это платить
+
+# Размер пула постоянных соединений общей сессии (хостов и соединений на хост)
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 10
+
+_session = None
+_session_lock = threading.Lock()
+
+# Валидаторы (ETag, Last-Modified) и тела ответов для условных запросов: (url, параметры) -> dict
+_validators = {}
+
+# Счетчики трафика: запросов, байт по сети (сжатых) и после распаковки, новых соединений
+# (TCP+TLS рукопожатий) и ответов 304 Not Modified
+_stats_lock = threading.Lock()
+_http_stats = {'requests': 0, 'bytes_wire': 0, 'bytes_decoded': 0, 'handshakes': 0, 'not_modified': 0}
+
+
+def get_session():
+    """
+    Общая HTTP-сессия с постоянными (keep-alive) соединениями.
+    
+    Создается при первом запросе; повторные запросы к тому же хосту используют
+    уже открытое соединение без нового TCP+TLS рукопожатия. Заголовок Accept-Encoding
+    берется из urllib3: gzip и deflate всегда, br и zstd - если установлены brotli и zstandard.
+    """
+    global _session
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.request import ACCEPT_ENCODING
+    
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+            _session = session
+    return _session
+
+
+def _count_connections(session):
+    """Сколько соединений открыли пулы сессии за все время"""
+    total = 0
+    adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+    for adapter in adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                total += pool.num_connections
+    return total
+
+
+def _record_response(response, handshakes):
+    """Учесть ответ в счетчиках трафика; вернуть количество байт, полученных по сети"""
+    wire_bytes = response.raw.tell() if response.raw is not None else len(response.content)
+    with _stats_lock:
+        _http_stats['requests'] += 1
+        _http_stats['bytes_wire'] += wire_bytes
+        _http_stats['bytes_decoded'] += len(response.content)
+        _http_stats['handshakes'] += handshakes
+        if response.status_code == 304:
+            _http_stats['not_modified'] += 1
+    return wire_bytes
 
 
-def get_request(url, headers=None, params=None, timeout=30):
+def http_stats():
+    """
+    Статистика HTTP-клиента.
+    
+    Returns:
+        dict: 'requests', 'bytes_wire' (байт по сети), 'bytes_decoded' (байт после распаковки),
+            'handshakes' (новых соединений), 'not_modified' (ответов 304)
+    """
+    with _stats_lock:
+        return dict(_http_stats)
+
+
+@traced("http.get", attrs=lambda url, *args, **kwargs: {'url': url})
+def get_request(url, headers=None, params=None, timeout=30, revalidate=False):
     """
     Выполняет GET запрос к указанному URL.
     
@@ -22,6 +99,9 @@ def get_request(url, headers=None, params=None, timeout=30):
         headers (dict, optional): Заголовки запроса
         params (dict, optional): Параметры запроса (query string)
         timeout (int, optional): Таймаут запроса в секундах (по умолчанию 30)
+        revalidate (bool, optional): Условный запрос для редко меняющихся данных:
+            повторный запрос отправляет If-None-Match/If-Modified-Since, и при ответе
+            304 возвращаются сохраненные данные без повторной загрузки
     
     Returns:
         dict: Словарь с результатом запроса:
@@ -29,22 +109,62 @@ def get_request(url, headers=None, params=None, timeout=30):
             - 'data' (dict/list): Данные ответа (если успешно)
             - 'status_code' (int): HTTP статус код
             - 'error' (str): Сообщение об ошибке (если есть)
+            - 'bytes' (int): Получено байт по сети (если успешно)
+            - 'handshakes' (int): Открыто новых соединений (если успешно)
     """
+    import requests
+    from colorama import Fore, Style
+    
     try:
         print(f"{Fore.CYAN}Выполняю GET запрос: {url}{Style.RESET_ALL}")
         
-        response = requests.get(url, headers=headers, params=params, timeout=timeout)
+        session = get_session()
+        request_headers = dict(headers or {})
+        cache_key = (url, tuple(sorted((str(k), str(v)) for k, v in (params or {}).items())))
+        cached = _validators.get(cache_key) if revalidate else None
+        if cached:
+            if cached['etag']:
+                request_headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                request_headers['If-Modified-Since'] = cached['last_modified']
+        
+        connections_before = _count_connections(session)
+        response = session.get(url, headers=request_headers, params=params, timeout=timeout)
+        handshakes = max(0, _count_connections(session) - connections_before)
+        wire_bytes = _record_response(response, handshakes)
+        
+        if response.status_code == 304 and cached:
+            print(f"{Fore.GREEN}✓ GET запрос: данные не изменились (304), {wire_bytes} байт{Style.RESET_ALL}")
+            return {
+                'success': True,
+                'data': cached['data'],
+                'status_code': response.status_code,
+                'error': None,
+                'bytes': wire_bytes,
+                'handshakes': handshakes
+            }
+        
         response.raise_for_status()  # Вызовет исключение для статусов 4xx и 5xx
         
         data = response.json() if response.headers.get('content-type', '').startswith('application/json') else response.text
         
-        print(f"{Fore.GREEN}✓ GET запрос успешен. Статус: {response.status_code}{Style.RESET_ALL}")
+        if revalidate and (response.headers.get('ETag') or response.headers.get('Last-Modified')):
+            _validators[cache_key] = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'data': data
+            }
+        
+        print(f"{Fore.GREEN}✓ GET запрос успешен. Статус: {response.status_code}, "
+              f"{wire_bytes} байт, новых соединений: {handshakes}{Style.RESET_ALL}")
         
         return {
             'success': True,
             'data': data,
             'status_code': response.status_code,
-            'error': None
+            'error': None,
+            'bytes': wire_bytes,
+            'handshakes': handshakes
         }
     
     except requests.exceptions.Timeout:
@@ -88,6 +208,7 @@ def get_request(url, headers=None, params=None, timeout=30):
         }
 
 
+@traced("http.post", attrs=lambda url, *args, **kwargs: {'url': url})
 def post_request(url, data=None, json=None, headers=None, timeout=30):
     """
     Выполняет POST запрос к указанному URL.
@@ -106,6 +227,9 @@ def post_request(url, data=None, json=None, headers=None, timeout=30):
             - 'status_code' (int): HTTP статус код
             - 'error' (str): Сообщение об ошибке (если есть)
     """
+    import requests
+    from colorama import Fore, Style
+    
     try:
         print(f"{Fore.CYAN}Выполняю POST запрос: {url}{Style.RESET_ALL}")
         
@@ -115,7 +239,10 @@ def post_request(url, data=None, json=None, headers=None, timeout=30):
         elif json and headers:
             headers['Content-Type'] = 'application/json'
         
-        response = requests.post(url, data=data, json=json, headers=headers, timeout=timeout)
+        session = get_session()
+        connections_before = _count_connections(session)
+        response = session.post(url, data=data, json=json, headers=headers, timeout=timeout)
+        _record_response(response, max(0, _count_connections(session) - connections_before))
         response.raise_for_status()  # Вызовет исключение для статусов 4xx и 5xx
         
         data = response.json() if response.headers.get('content-type', '').startswith('application/json') else response.text
@@ -171,6 +298,8 @@ def post_request(url, data=None, json=None, headers=None, timeout=30):
 
 
 if __name__ == "__main__":
+    from colorama import Fore, Style
+    
     # Пример использования функций
     print(f"{Fore.YELLOW}Функции для GET и POST запросов готовы к использованию!{Style.RESET_ALL}")
     
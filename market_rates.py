@@ -0,0 +1,27 @@
+from typing import Dict
+
+from database import Database
+
+# Курс путешествия не обновляется, если рыночный отличается от него меньше чем на эту долю
+MIN_RATE_CHANGE = 0.001
+
+
+def follow_market_rates(db: Database, rates: Dict[str, float], min_change: float = MIN_RATE_CHANGE) -> int:
+    """
+    Обновить курс всех путешествий с автообновлением по матрице курсов.
+
+    Курс каждой пары валют считается один раз и применяется ко всем путешествиям
+    с этой парой одним запросом (Database.apply_market_rates).
+
+    Args:
+        db (Database): База данных
+        rates (dict): Матрица курсов {код валюты: единиц за 1 базовую валюту}
+        min_change (float): Минимальное относительное изменение курса
+
+    Returns:
+        int: Количество путешествий, получивших новый курс
+    """
+    pair_rates = [(from_currency, to_currency, rates[to_currency] / rates[from_currency])
+                  for from_currency, to_currency in db.get_market_pairs()
+                  if rates.get(from_currency) and rates.get(to_currency)]
+    return db.apply_market_rates(pair_rates, min_change)
@@ -0,0 +1,200 @@
+import asyncio
+import heapq
+import itertools
+import time
+from datetime import timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from scheduler import PRIORITY_INTERACTIVE, TokenBucket
+from tracing import span
+
+# Лимиты Telegram: около 30 сообщений в секунду на бота, 1 в секунду в личный чат
+# (короткие всплески допустимы) и 20 в минуту в группу
+GLOBAL_RATE = 30
+PRIVATE_CHAT_RATE = 1
+PRIVATE_CHAT_BURST = 3
+GROUP_CHAT_RATE = 20 / 60
+
+# Ведра чатов, не использовавшиеся дольше этого времени, удаляются (секунды)
+CHAT_BUCKET_IDLE = 60
+CHAT_BUCKETS_MAX = 10000
+
+# Сколько раз повторять запрос после ответа 429 (RetryAfter)
+MAX_RETRIES = 3
+
+
+def _seconds(value) -> float:
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+class _Request:
+    """
+    Исходящий запрос. У редактирования, ожидающего отправки, args и kwargs
+    заменяются более новым редактированием того же сообщения.
+    """
+
+    def __init__(self, args: Tuple, kwargs: Dict):
+        self.args = args
+        self.kwargs = kwargs
+        self.result: Optional[asyncio.Future] = None
+
+
+class OutboundRateLimiter(BaseRateLimiter[Dict]):
+    """
+    Ограничитель исходящих запросов к Telegram (подключается через Application.builder().rate_limiter).
+
+    - общее ведро токенов на бота и отдельные ведра на каждый чат;
+    - очередь с приоритетами: ответы пользователям (PRIORITY_INTERACTIVE) получают
+      общие токены раньше фоновых уведомлений (PRIORITY_BACKGROUND);
+    - редактирования одного сообщения, ожидающие отправки, объединяются:
+      отправляется только последнее, все вызывающие получают его результат;
+    - после ответа 429 отправка приостанавливается на retry_after и запрос повторяется.
+
+    Приоритет передается в методы бота: rate_limit_args={'priority': PRIORITY_BACKGROUND}.
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, max_retries: int = MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_rate)
+        self.max_retries = max_retries
+        self._chat_buckets: Dict[Any, TokenBucket] = {}
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._paused_until = 0.0
+        self._pending_edits: Dict[Tuple, _Request] = {}
+        self._stats = {'requests': 0, 'coalesced': 0, 'retried': 0, 'wait_time': 0.0}
+
+    async def initialize(self) -> None:
+        self._ensure_dispatcher()
+
+    async def shutdown(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= CHAT_BUCKETS_MAX:
+                horizon = time.monotonic() - CHAT_BUCKET_IDLE
+                self._chat_buckets = {key: value for key, value in self._chat_buckets.items()
+                                      if value.updated_at > horizon}
+            # Отрицательные id и @username - группы и каналы
+            if isinstance(chat_id, int) and chat_id > 0:
+                bucket = TokenBucket(PRIVATE_CHAT_RATE, PRIVATE_CHAT_BURST)
+            else:
+                bucket = TokenBucket(GROUP_CHAT_RATE, 1)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _dispatch(self):
+        """Раздавать общие токены ожидающим запросам в порядке приоритета"""
+        while True:
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+
+            wait = self.global_bucket.try_acquire()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+
+            # Запросы, чьи вызывающие уже отменены, токен не получают
+            while self._waiters:
+                _, _, future = heapq.heappop(self._waiters)
+                if not future.done():
+                    future.set_result(None)
+                    break
+
+    async def _acquire(self, chat_id, priority: int):
+        started = time.monotonic()
+        if chat_id is not None:
+            # Резервирование сохраняет порядок сообщений в одном чате
+            wait = self._chat_bucket(chat_id).reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+        self._ensure_dispatcher()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        self._wakeup.set()
+        await future
+        self._stats['wait_time'] += time.monotonic() - started
+
+    async def _call(self, callback, request: _Request, priority: int):
+        """Выполнить запрос (токены уже получены), повторяя его после ответа 429"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await callback(*request.args, **request.kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = _seconds(e.retry_after)
+                self._stats['retried'] += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                print(f"Telegram ограничил отправку на {delay:g} с")
+                await self._acquire(None, priority)
+
+    async def _send_edit(self, key: Tuple, callback, request: _Request, chat_id, priority: int):
+        pending = self._pending_edits.get(key)
+        if pending is not None:
+            # Предыдущее редактирование еще не отправлено - отправим только новое содержимое
+            pending.args, pending.kwargs = request.args, request.kwargs
+            self._stats['coalesced'] += 1
+            return await asyncio.shield(pending.result)
+
+        request.result = asyncio.get_running_loop().create_future()
+        self._pending_edits[key] = request
+        try:
+            await self._acquire(chat_id, priority)
+        except BaseException:
+            request.result.cancel()
+            raise
+        finally:
+            # Редактирования, пришедшие после получения токена, отправляются отдельно
+            del self._pending_edits[key]
+
+        try:
+            result = await self._call(callback, request, priority)
+        except Exception as e:
+            request.result.set_exception(e)
+            # Помечаем исключение полученным, чтобы asyncio не предупреждал, если объединенных вызовов нет
+            request.result.exception()
+            raise
+        request.result.set_result(result)
+        return result
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        self._stats['requests'] += 1
+        priority = (rate_limit_args or {}).get('priority', PRIORITY_INTERACTIVE)
+        chat_id = data.get('chat_id')
+
+        request = _Request(args, kwargs)
+
+        # Спан включает ожидание очереди ограничителя и сам запрос к Telegram
+        with span(f"telegram.{endpoint}", chat_id=chat_id):
+            if endpoint.startswith("editMessage"):
+                target = data.get('inline_message_id') or (chat_id, data.get('message_id'))
+                return await self._send_edit((endpoint, target), callback, request, chat_id, priority)
+
+            await self._acquire(chat_id, priority)
+            return await self._call(callback, request, priority)
+
+    def stats(self) -> Dict:
+        """Счетчики: запросов, объединенных редактирований, повторов после 429 и суммарное ожидание"""
+        return dict(self._stats, waiting=len(self._waiters))
@@ -0,0 +1,115 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import List, Optional, Tuple
+
+# Интервал между сэмплами по умолчанию (секунды)
+DEFAULT_INTERVAL = 0.005
+
+# Сэмплы, в которых поток просто ждет (цикл событий в select, пул потоков в очереди),
+# в отчет о горячих точках не попадают
+IDLE_MODULES = ("selectors.py", "threading.py", "queue.py")
+
+# Файл обработчиков, по которым строится раздел отчета "Обработчики"
+HANDLERS_FILE = "bot.py"
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Сэмплирующий профилировщик всего процесса.
+
+    Фоновый поток раз в interval секунд снимает стеки всех остальных потоков
+    (sys._current_frames) и считает одинаковые стеки. Код бота не инструментируется,
+    поэтому накладные расходы не зависят от количества вызовов и профилирование
+    можно включать на работающем боте.
+    """
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._stop.clear()
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.monotonic() - self.started_at
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                labels.append(names.get(ident, str(ident)))
+                labels.reverse()
+                self.stacks[tuple(labels)] += 1
+            self.samples += 1
+
+    def _busy_stacks(self) -> List[Tuple[Tuple[str, ...], int]]:
+        return [(stack, count) for stack, count in self.stacks.items()
+                if not stack[-1].split("(")[-1].startswith(IDLE_MODULES)]
+
+    def collapsed(self) -> str:
+        """Стеки в формате collapsed stacks (flamegraph.pl, speedscope): "поток;f1;f2 N" """
+        return "\n".join(f"{';'.join(stack)} {count}"
+                         for stack, count in sorted(self.stacks.items(), key=lambda item: -item[1]))
+
+    def report(self, limit: int = 15) -> str:
+        """
+        Текстовый отчет о горячих точках.
+
+        Проценты считаются от сэмплов, в которых поток не простаивал:
+        собственное время - функция на вершине стека, общее - функция где-либо в стеке.
+        """
+        busy = self._busy_stacks()
+        busy_total = sum(count for _, count in busy)
+        own_time, total_time, handlers = Counter(), Counter(), Counter()
+
+        for stack, count in busy:
+            own_time[stack[-1]] += count
+            for label in set(stack[1:]):
+                total_time[label] += count
+            handler = next((label for label in stack if f"({HANDLERS_FILE}:" in label), None)
+            if handler:
+                handlers[handler] += count
+
+        lines = [
+            f"Сэмплов: {self.samples} за {self.duration:.1f} с (интервал {self.interval * 1000:g} мс)",
+            f"Стеков с работой: {busy_total}"
+        ]
+        for title, counter in (("Обработчики", handlers),
+                               ("Собственное время", own_time),
+                               ("С учетом вложенных вызовов", total_time)):
+            lines.append("")
+            lines.append(f"{title}:")
+            for label, count in counter.most_common(limit):
+                lines.append(f"{count / busy_total * 100:5.1f}%  {label}")
+            if not counter:
+                lines.append("  нет данных")
+        return "\n".join(lines)
@@ -0,0 +1,232 @@
+import json
+import threading
+from abc import ABC, abstractmethod
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from main import get_request
+from scheduler import PRIORITY_INTERACTIVE
+
+# Сколько последних замеров задержки хранить для каждого провайдера
+LATENCY_WINDOW = 200
+
+# Пока замеров мало, вторичный запрос отправляется через это время (секунды)
+DEFAULT_HEDGE_DELAY = 1.0
+MIN_LATENCY_SAMPLES = 5
+
+
+class ProviderStats:
+    """Статистика задержек и ошибок одного провайдера"""
+
+    def __init__(self):
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def record(self, latency: float, success: bool):
+        with self._lock:
+            self._latencies.append(latency)
+            self.requests += 1
+            if not success:
+                self.errors += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Перцентиль задержки (q от 0 до 100) по последним замерам"""
+        with self._lock:
+            samples = sorted(self._latencies)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * q / 100))
+        return samples[index]
+
+    def hedge_delay(self) -> float:
+        """Через сколько ждать ответа провайдера, прежде чем спрашивать следующий (p95)"""
+        if len(self._latencies) < MIN_LATENCY_SAMPLES:
+            return DEFAULT_HEDGE_DELAY
+        return self.percentile(95)
+
+    def as_dict(self) -> Dict:
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95)
+        }
+
+
+class RateProvider(ABC):
+    """
+    Источник курсов валют.
+
+    Реализации возвращают словарь {код валюты: единиц за 1 base} или None при ошибке.
+    """
+
+    name = "provider"
+
+    def __init__(self):
+        self.stats = ProviderStats()
+
+    @abstractmethod
+    def fetch_rates(self, base: str, currencies: List[str],
+                    priority: int = PRIORITY_INTERACTIVE) -> Optional[Dict[str, float]]:
+        """Курсы currencies относительно base (None, если провайдер не ответил)"""
+
+
+def _rates_from_quotes(source: str, quotes: Dict) -> Dict[str, float]:
+    """Котировки вида {"USDEUR": 0.92} -> {"USD": 1.0, "EUR": 0.92}"""
+    rates = {source: 1.0}
+    for pair, value in quotes.items():
+        if pair.startswith(source) and value:
+            rates[pair[len(source):]] = float(value)
+    return rates
+
+
+def _rebase(rates: Dict[str, float], base: str) -> Optional[Dict[str, float]]:
+    """Пересчитать курсы относительно другой базовой валюты"""
+    if not rates.get(base):
+        return None
+    return {code: value / rates[base] for code, value in rates.items() if value}
+
+
+class ExchangeRateHostProvider(RateProvider):
+    """exchangerate.host (/live) через планировщик квот"""
+
+    name = "exchangerate.host"
+
+    def fetch_rates(self, base, currencies, priority=PRIORITY_INTERACTIVE):
+        # Импорт внутри функции: currency_api сам создает провайдеров
+        import currency_api
+        data = currency_api.get_current_currency(default=base, currencies=currencies, priority=priority)
+        if not data.get('success') or not data.get('quotes'):
+            return None
+        return _rates_from_quotes(data.get('source', base), data['quotes'])
+
+
+class OpenErApiProvider(RateProvider):
+    """
+    HTTP-провайдер в формате open.er-api.com: GET {url}/{base} ->
+    {"result": "success", "base_code": "USD", "rates": {...}}.
+
+    URL настраивается, поэтому вместо внешнего сервиса можно подставить локальную заглушку.
+    """
+
+    name = "open.er-api.com"
+
+    def __init__(self, url: str = "https://open.er-api.com/v6/latest", timeout: float = 10):
+        super().__init__()
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def fetch_rates(self, base, currencies, priority=PRIORITY_INTERACTIVE):
+        result = get_request(f"{self.url}/{base}", timeout=self.timeout)
+        if not result['success'] or not isinstance(result['data'], dict):
+            return None
+        data = result['data']
+        if data.get('result') != "success" or not data.get('rates'):
+            return None
+        return _rebase({code: float(value) for code, value in data['rates'].items()}, base)
+
+
+class StaticFileProvider(RateProvider):
+    """
+    Курсы из локального JSON-файла: формат exchangerate.host ("source" + "quotes")
+    или {"base": "USD", "rates": {...}}. Подходит как последний резерв и для тестов.
+    """
+
+    name = "file"
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+
+    def fetch_rates(self, base, currencies, priority=PRIORITY_INTERACTIVE):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ошибка чтения файла курсов {self.path}: {e}")
+            return None
+
+        if data.get('quotes'):
+            rates = _rates_from_quotes(data.get('source', "USD"), data['quotes'])
+        else:
+            rates = {data.get('base', "USD"): 1.0}
+            rates.update({code: float(value) for code, value in data.get('rates', {}).items()})
+        return _rebase(rates, base)
+
+
+class RateClient:
+    """
+    Клиент курсов с несколькими провайдерами и дублирующими (hedged) запросами.
+
+    Сначала спрашивается основной провайдер. Если он не ответил за свое p95
+    время ответа (или ответил ошибкой), параллельно отправляется запрос следующему
+    провайдеру; используется первый корректный ответ.
+    """
+
+    def __init__(self, providers: List[RateProvider], max_workers: int = 4):
+        if not providers:
+            raise ValueError("Нужен хотя бы один провайдер курсов")
+        self.providers = providers
+        self.max_workers = max_workers
+        self._executor = None
+
+    def _call(self, provider: RateProvider, base: str, currencies: List[str], priority: int):
+        started = time.monotonic()
+        rates = None
+        try:
+            rates = provider.fetch_rates(base, currencies, priority)
+        finally:
+            provider.stats.record(time.monotonic() - started, bool(rates))
+        return rates
+
+    def fetch_rates(self, base: str, currencies: List[str],
+                    priority: int = PRIORITY_INTERACTIVE) -> Dict:
+        """
+        Получить курсы относительно base.
+
+        Returns:
+            dict: 'success' (bool), 'rates' (dict), 'provider' (str), 'error' (str)
+        """
+        # Пул потоков и concurrent.futures нужны только при первом запросе
+        from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="rates")
+
+        remaining = list(self.providers)
+        pending = {}
+
+        def launch_next():
+            provider = remaining.pop(0)
+            future = self._executor.submit(self._call, provider, base, currencies, priority)
+            pending[future] = provider
+            return provider
+
+        last_launched = launch_next()
+        while pending:
+            # Пока есть запасные провайдеры, ждем текущий не дольше его p95
+            timeout = last_launched.stats.hedge_delay() if remaining else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    rates = future.result()
+                except Exception as e:
+                    print(f"Ошибка провайдера курсов {provider.name}: {e}")
+                    rates = None
+                if rates:
+                    return {'success': True, 'rates': rates, 'provider': provider.name, 'error': None}
+
+            # Таймаут или ошибка - подключаем следующего провайдера
+            if remaining and (not done or not pending):
+                last_launched = launch_next()
+
+        return {'success': False, 'rates': None, 'provider': None,
+                'error': "Ни один провайдер курсов не ответил"}
+
+    def stats(self) -> Dict[str, Dict]:
+        """Статистика задержек по провайдерам"""
+        return {provider.name: provider.stats.as_dict() for provider in self.providers}
@@ -0,0 +1,254 @@
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from main import get_request, http_stats
+
+# Приоритеты запросов: действия пользователя важнее фоновых обновлений
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+# Доля месячной квоты, которая резервируется для интерактивных запросов
+BACKGROUND_RESERVE = 0.2
+
+# Сколько интерактивный запрос может ждать свободного токена (секунды)
+INTERACTIVE_MAX_WAIT = 1.0
+
+
+class TokenBucket:
+    """Ведро токенов: не больше rate запросов в секунду с допустимым всплеском capacity"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self) -> float:
+        """Взять токен; вернуть 0, если получилось, иначе время ожидания следующего токена"""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def reserve(self) -> float:
+        """
+        Взять токен в долг и вернуть, сколько ждать его появления.
+
+        Каждый следующий вызов ждет дольше предыдущего, поэтому порядок вызовов сохраняется.
+        """
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class MonthlyQuota:
+    """
+    Расход месячной квоты API в таблице SQLite api_quota.
+
+    Счетчик общий для всех процессов бота (воркеров sharding.py, shared_rates.py)
+    и сохраняется между перезапусками. Проверка и увеличение выполняются
+    одной транзакцией BEGIN IMMEDIATE, поэтому процессы не превышают квоту вместе.
+    """
+
+    def __init__(self, path: str, limit: int):
+        self.path = path
+        self.limit = limit
+        self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # Вызывается под блокировкой планировщика, поэтому одно соединение на все потоки
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                                         check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS api_quota (
+                    month TEXT PRIMARY KEY,
+                    used INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+        return self._conn
+
+    def used(self, month: str) -> int:
+        """Сколько запросов израсходовано за месяц"""
+        row = self._connection().execute("SELECT used FROM api_quota WHERE month = ?", (month,)).fetchone()
+        return row[0] if row else 0
+
+    def try_use(self, month: str, priority: int) -> Tuple[Optional[str], int]:
+        """
+        Израсходовать один запрос квоты.
+
+        Returns:
+            tuple: (причина отказа или None, израсходовано за месяц)
+        """
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT used FROM api_quota WHERE month = ?", (month,)).fetchone()
+            used = row[0] if row else 0
+            if used >= self.limit:
+                conn.execute("ROLLBACK")
+                return "Исчерпана месячная квота API", used
+            if priority == PRIORITY_BACKGROUND and self.limit - used <= self.limit * BACKGROUND_RESERVE:
+                conn.execute("ROLLBACK")
+                return "Квота API зарезервирована для запросов пользователей", used
+            conn.execute("""
+                INSERT INTO api_quota (month, used) VALUES (?, 1)
+                ON CONFLICT(month) DO UPDATE SET used = used + 1
+            """, (month,))
+            conn.execute("COMMIT")
+            return None, used + 1
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+
+class _PendingRequest:
+    """Запрос в процессе выполнения, результат которого ждут совпадающие запросы"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[Dict] = None
+
+
+class RequestScheduler:
+    """
+    Единая точка выхода к API курсов с учетом квот тарифа.
+
+    - ограничивает частоту запросов ведром токенов (квота в секунду);
+    - считает расход месячной квоты и оставляет резерв для действий пользователей;
+    - фоновые запросы не ждут токенов и отклоняются первыми;
+    - одинаковые запросы, выполняющиеся одновременно, объединяются в один.
+
+    Отклоненный запрос возвращает результат в формате main.get_request
+    с 'success': False и 'throttled': True, чтобы вызывающий код мог
+    перейти на закэшированные курсы.
+
+    Ожидание токена блокирует поток (time.sleep), поэтому из обработчиков
+    бота планировщик вызывается через asyncio.to_thread.
+    """
+
+    def __init__(self, rate_per_second: float = 5, monthly_quota: int = 0, quota_db: Optional[str] = None):
+        self.bucket = TokenBucket(rate_per_second)
+        self.monthly_quota = monthly_quota
+        # Без файла базы квота считается только в памяти процесса
+        self._quota = MonthlyQuota(quota_db, monthly_quota) if quota_db and monthly_quota else None
+        self._month = self._current_month()
+        self._used_this_month = self._load_used()
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple, _PendingRequest] = {}
+        self._stats = {'requests': 0, 'coalesced': 0, 'throttled': 0}
+
+    @staticmethod
+    def _current_month() -> str:
+        return datetime.now().strftime("%Y-%m")
+
+    def _load_used(self) -> int:
+        if self._quota is None:
+            return 0
+        try:
+            return self._quota.used(self._month)
+        except sqlite3.Error as e:
+            print(f"Ошибка чтения квоты API: {e}")
+            return 0
+
+    def remaining_quota(self) -> Optional[int]:
+        """Остаток месячной квоты (None, если квота не ограничена)"""
+        if not self.monthly_quota:
+            return None
+        return max(0, self.monthly_quota - self._used_this_month)
+
+    def stats(self) -> Dict:
+        """Статистика планировщика"""
+        with self._lock:
+            return dict(self._stats,
+                        used_this_month=self._used_this_month,
+                        remaining_quota=self.remaining_quota(),
+                        http=http_stats())
+
+    def _throttled(self, reason: str) -> Dict:
+        self._stats['throttled'] += 1
+        return {
+            'success': False,
+            'data': None,
+            'status_code': None,
+            'error': reason,
+            'throttled': True
+        }
+
+    def _admit(self, priority: int) -> Optional[Dict]:
+        """Проверить квоты и занять токен; вернуть отказ или None, если запрос можно выполнять"""
+        deadline = time.monotonic() + INTERACTIVE_MAX_WAIT
+        while True:
+            with self._lock:
+                month = self._current_month()
+                if month != self._month:
+                    self._month, self._used_this_month = month, self._load_used()
+
+                remaining = self.remaining_quota()
+                if remaining is not None:
+                    if remaining == 0:
+                        return self._throttled("Исчерпана месячная квота API")
+                    if priority == PRIORITY_BACKGROUND and remaining <= self.monthly_quota * BACKGROUND_RESERVE:
+                        return self._throttled("Квота API зарезервирована для запросов пользователей")
+
+                wait = self.bucket.try_acquire()
+                if wait == 0:
+                    if self._quota is not None:
+                        # Остаток выше мог устареть: квоту расходуют и другие процессы
+                        try:
+                            rejection, self._used_this_month = self._quota.try_use(month, priority)
+                        except sqlite3.Error as e:
+                            print(f"Ошибка учета квоты API: {e}")
+                            rejection = None
+                            self._used_this_month += 1
+                        if rejection:
+                            return self._throttled(rejection)
+                    else:
+                        self._used_this_month += 1
+                    self._stats['requests'] += 1
+                    return None
+
+                if priority == PRIORITY_BACKGROUND or time.monotonic() + wait > deadline:
+                    return self._throttled("Превышен лимит запросов API в секунду")
+
+            time.sleep(wait)
+
+    def request(self, url: str, params: Dict = None, priority: int = PRIORITY_INTERACTIVE,
+                revalidate: bool = False) -> Dict:
+        """Выполнить GET-запрос через планировщик (revalidate - см. main.get_request)"""
+        params = params or {}
+        key = (url, tuple(sorted((k, str(v)) for k, v in params.items())))
+
+        with self._lock:
+            pending = self._pending.get(key)
+            is_owner = pending is None
+            if is_owner:
+                pending = _PendingRequest()
+                self._pending[key] = pending
+            else:
+                self._stats['coalesced'] += 1
+
+        # Такой же запрос уже выполняется - ждем его результат
+        if not is_owner:
+            pending.done.wait()
+            return pending.result
+
+        try:
+            rejection = self._admit(priority)
+            pending.result = rejection or get_request(url, params=params, revalidate=revalidate)
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.done.set()
+        return pending.result
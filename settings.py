@@ -0,0 +1,118 @@
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional, Tuple
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Настройки бота из переменных окружения и файла .env"""
+
+    # Telegram Bot Token
+    telegram_bot_token: Optional[str]
+
+    # API exchangerate.host: ключ (необязателен) и URL эндпоинта /live
+    currency_api_key: Optional[str]
+    currency_api_url: str
+
+    # Квоты тарифа API: запросов в секунду и в месяц (0 - без ограничения) и база SQLite,
+    # в которой считается расход месячной квоты (общий для процессов и перезапусков)
+    currency_api_rate_limit: float
+    currency_api_monthly_quota: int
+    currency_api_quota_db: str
+
+    # Резервные источники курсов: второй HTTP-провайдер и JSON-файл (None - не используются)
+    rate_secondary_url: Optional[str]
+    rate_static_file: Optional[str]
+
+    # Снимок кэшей для быстрого перезапуска: путь к файлу и период сохранения (секунды)
+    warm_cache_file: str
+    warm_cache_interval: float
+
+    # Общий для всех процессов снимок курсов (mmap): путь к файлу (None - не используется)
+    # и период его обновления процессом shared_rates.py (секунды)
+    shared_rates_file: Optional[str]
+    shared_rates_interval: float
+
+    # Режим воркеров (sharding.py): количество процессов-обработчиков, публичный URL вебхука,
+    # адрес, на котором его слушает супервизор, и секрет, которым Telegram подписывает запросы
+    worker_count: int
+    webhook_url: Optional[str]
+    webhook_listen: str
+    webhook_port: int
+    webhook_secret: Optional[str]
+
+    # Профилировщик (/profile): включен ли, id администраторов Telegram и интервал сэмплов (секунды)
+    profiler_enabled: bool
+    admin_user_ids: Tuple[int, ...]
+    profiler_interval: float
+
+    # Исторические курсы: за сколько последних дней догружать их при запуске бота (0 - не догружать)
+    rate_backfill_days: int
+
+    # Архив старых путешествий (archive.py): через сколько дней без изменений неактивное
+    # путешествие переносится в архив (0 - не архивировать) и сжимать ли архивные строки
+    archive_after_days: int
+    archive_compress: bool
+
+    # Резервные копии базы (backup.py): каталог, период (секунды, 0 - не делать) и сколько копий хранить
+    backup_dir: str
+    backup_interval: float
+    backup_keep: int
+
+    # Как часто обновлять курс путешествий с автообновлением по рынку (секунды, 0 - не обновлять)
+    market_rate_interval: float
+
+    # Трассировка (tracing.py): файл JSON Lines с трассами (None - выключена), его размер до ротации (байты),
+    # сколько старых файлов хранить и минимальная длительность записываемой трассы (миллисекунды)
+    trace_file: Optional[str]
+    trace_max_bytes: int
+    trace_backups: int
+    trace_slow_ms: float
+
+
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    """
+    Загрузить настройки один раз за процесс.
+
+    Файл .env читается только при первом вызове; повторные вызовы
+    возвращают тот же объект без обращения к окружению.
+    """
+    # python-dotenv нужен только здесь, поэтому импортируем его лениво
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    return Settings(
+        telegram_bot_token=os.getenv("TELEGRAM_BOT_TOKEN"),
+        currency_api_key=os.getenv("CURRENCY_API_KEY") or None,
+        currency_api_url=os.getenv("CURRENCY_API_URL", "https://api.exchangerate.host/live"),
+        currency_api_rate_limit=float(os.getenv("CURRENCY_API_RATE_LIMIT", "5")),
+        currency_api_monthly_quota=int(os.getenv("CURRENCY_API_MONTHLY_QUOTA", "0")),
+        currency_api_quota_db=os.getenv("CURRENCY_API_QUOTA_DB", "travel_wallet.db"),
+        rate_secondary_url=os.getenv("RATE_SECONDARY_URL") or None,
+        rate_static_file=os.getenv("RATE_STATIC_FILE") or None,
+        warm_cache_file=os.getenv("WARM_CACHE_FILE", "bot_cache.json.gz"),
+        warm_cache_interval=float(os.getenv("WARM_CACHE_INTERVAL", "300")),
+        shared_rates_file=os.getenv("SHARED_RATES_FILE") or None,
+        shared_rates_interval=float(os.getenv("SHARED_RATES_INTERVAL", "60")),
+        worker_count=int(os.getenv("WORKER_COUNT", str(os.cpu_count() or 1))),
+        webhook_url=os.getenv("WEBHOOK_URL") or None,
+        webhook_listen=os.getenv("WEBHOOK_LISTEN", "0.0.0.0"),
+        webhook_port=int(os.getenv("WEBHOOK_PORT", "8443")),
+        webhook_secret=os.getenv("WEBHOOK_SECRET") or None,
+        profiler_enabled=os.getenv("PROFILER_ENABLED", "").lower() in ("1", "true", "yes"),
+        admin_user_ids=tuple(int(part) for part in os.getenv("ADMIN_USER_IDS", "").replace(" ", "").split(",") if part),
+        profiler_interval=float(os.getenv("PROFILER_INTERVAL", "0.005")),
+        rate_backfill_days=int(os.getenv("RATE_BACKFILL_DAYS", "90")),
+        archive_after_days=int(os.getenv("ARCHIVE_AFTER_DAYS", "180")),
+        archive_compress=os.getenv("ARCHIVE_COMPRESS", "true").lower() in ("1", "true", "yes"),
+        backup_dir=os.getenv("BACKUP_DIR", "backups"),
+        backup_interval=float(os.getenv("BACKUP_INTERVAL", "86400")),
+        backup_keep=int(os.getenv("BACKUP_KEEP", "7")),
+        market_rate_interval=float(os.getenv("MARKET_RATE_INTERVAL", "3600")),
+        trace_file=os.getenv("TRACE_FILE") or None,
+        trace_max_bytes=int(os.getenv("TRACE_MAX_BYTES", str(10 * 1024 * 1024))),
+        trace_backups=int(os.getenv("TRACE_BACKUPS", "5")),
+        trace_slow_ms=float(os.getenv("TRACE_SLOW_MS", "0")),
+    )
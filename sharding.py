@@ -0,0 +1,253 @@
+import asyncio
+import json
+import queue
+import sys
+import threading
+from typing import Dict, List, Optional
+
+# Сколько обновлений может ждать в очереди одного воркера; при переполнении
+# супервизор отвечает Telegram ошибкой 503, и тот повторит доставку позже
+WORKER_QUEUE_SIZE = 1000
+QUEUE_PUT_TIMEOUT = 5
+
+# Сколько ждать завершения воркера при остановке (секунды)
+WORKER_STOP_TIMEOUT = 10
+
+
+def shard_for_user(user_id: int, count: int) -> int:
+    """
+    Номер воркера для пользователя.
+
+    Все обновления одного пользователя попадают к одному воркеру, поэтому его
+    диалоги, неподтвержденные расходы и подписки живут в одном процессе.
+    """
+    return user_id % count if count > 1 else 0
+
+
+def update_user_id(update: Dict) -> int:
+    """
+    Пользователь, от которого пришло обновление Telegram (словарь из JSON вебхука).
+
+    Для обновлений без пользователя (например, посты каналов) берется id чата,
+    если нет и его - 0.
+    """
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        user = value.get('from') or value.get('user')
+        if isinstance(user, dict) and 'id' in user:
+            return user['id']
+        chat = value.get('chat')
+        if isinstance(chat, dict) and 'id' in chat:
+            return chat['id']
+    return 0
+
+
+async def _serve_worker(index: int, count: int, token: str, updates):
+    """Цикл воркера: обновления из очереди обрабатываются строго по одному в порядке поступления"""
+    # Воркер импортирует бота сам: процессы запускаются через spawn и ничего не наследуют
+    import bot
+    from telegram import Update
+
+    application = bot.build_application(token, shard=(index, count))
+    loop = asyncio.get_running_loop()
+
+    async with application:
+        await application.start()
+        await application.post_init(application)
+        print(f"🤖 Воркер {index + 1}/{count} запущен")
+        try:
+            while True:
+                data = await loop.run_in_executor(None, updates.get)
+                if data is None:
+                    break
+                await application.process_update(Update.de_json(data, application.bot))
+        finally:
+            await application.stop()
+            await application.post_shutdown(application)
+
+
+def run_worker(index: int, count: int, token: str, updates):
+    """Точка входа процесса-воркера"""
+    try:
+        asyncio.run(_serve_worker(index, count, token, updates))
+    except KeyboardInterrupt:
+        pass
+
+
+class Supervisor:
+    """
+    Супервизор: раздает обновления N процессам-воркерам по хэшу user_id.
+
+    У каждого воркера своя очередь (multiprocessing.Queue), которую он читает
+    последовательно, поэтому обновления одного пользователя обрабатываются в том
+    порядке, в котором их получил супервизор.
+    """
+
+    def __init__(self, token: str, count: int, queue_size: int = WORKER_QUEUE_SIZE):
+        # multiprocessing нужен только в режиме воркеров
+        import multiprocessing
+
+        if count < 1:
+            raise ValueError("Количество воркеров должно быть положительным")
+        self.token = token
+        self.count = count
+        self._context = multiprocessing.get_context("spawn")
+        self.queues = [self._context.Queue(maxsize=queue_size) for _ in range(count)]
+        self.workers: List[Optional[object]] = [None] * count
+        self.dispatched = [0] * count
+        # Своя блокировка у каждого воркера: переполненная очередь одного воркера
+        # не задерживает обновления для остальных
+        self._locks = [threading.Lock() for _ in range(count)]
+
+    def _spawn(self, index: int):
+        process = self._context.Process(
+            target=run_worker,
+            args=(index, self.count, self.token, self.queues[index]),
+            name=f"bot-worker-{index}",
+            daemon=True
+        )
+        process.start()
+        self.workers[index] = process
+
+    def start(self):
+        for index in range(self.count):
+            self._spawn(index)
+
+    def dispatch(self, update: Dict) -> int:
+        """
+        Передать обновление воркеру его пользователя.
+
+        Returns:
+            int: Номер воркера
+
+        Raises:
+            queue.Full: Очередь воркера переполнена
+        """
+        index = shard_for_user(update_user_id(update), self.count)
+        # Блокировка сохраняет порядок обновлений воркера, когда запросы вебхука приходят параллельно
+        with self._locks[index]:
+            if not self.workers[index].is_alive():
+                print(f"⚠️ Воркер {index} завершился (код {self.workers[index].exitcode}), перезапускаю")
+                self._spawn(index)
+            self.queues[index].put(update, timeout=QUEUE_PUT_TIMEOUT)
+            self.dispatched[index] += 1
+        return index
+
+    def stop(self):
+        """Остановить воркеров: каждый дообрабатывает свою очередь и сохраняет снимок кэша"""
+        for index, process in enumerate(self.workers):
+            if process is not None and process.is_alive():
+                self.queues[index].put(None)
+        for process in self.workers:
+            if process is None:
+                continue
+            process.join(WORKER_STOP_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+
+    def stats(self) -> Dict[int, int]:
+        """Количество обновлений, переданных каждому воркеру"""
+        return dict(enumerate(self.dispatched))
+
+
+def _webhook_handler_class():
+    """Класс обработчика HTTP-запросов вебхука (http.server импортируется только супервизором)"""
+    from http.server import BaseHTTPRequestHandler
+
+    class _WebhookHandler(BaseHTTPRequestHandler):
+        """Прием обновлений от Telegram: POST с JSON обновления"""
+
+        def do_POST(self):
+            secret = self.server.secret
+            if secret and self.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret:
+                self.send_response(403)
+                self.end_headers()
+                return
+
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                update = json.loads(self.rfile.read(length))
+            except ValueError:
+                self.send_response(400)
+                self.end_headers()
+                return
+
+            try:
+                self.server.supervisor.dispatch(update)
+            except queue.Full:
+                self.send_response(503)
+                self.end_headers()
+                return
+
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            # Не печатаем строку на каждый запрос Telegram
+            pass
+
+    return _WebhookHandler
+
+
+async def _set_webhook(token: str, url: str, secret: Optional[str]):
+    from telegram import Bot, Update
+
+    async with Bot(token) as bot:
+        await bot.set_webhook(url=url, secret_token=secret, allowed_updates=Update.ALL_TYPES)
+
+
+def run_supervisor(token: str, count: int, webhook_url: str, listen: str, port: int,
+                   secret: Optional[str] = None):
+    """
+    Запустить воркеров и HTTP-сервер вебхука; работает до Ctrl+C.
+
+    Args:
+        token (str): Токен бота
+        count (int): Количество процессов-воркеров
+        webhook_url (str): Публичный URL, который регистрируется в Telegram
+        listen (str): Адрес, на котором слушает сервер
+        port (int): Порт сервера
+        secret (str, optional): Секрет для заголовка X-Telegram-Bot-Api-Secret-Token
+    """
+    from http.server import ThreadingHTTPServer
+
+    supervisor = Supervisor(token, count)
+    supervisor.start()
+
+    server = ThreadingHTTPServer((listen, port), _webhook_handler_class())
+    server.supervisor = supervisor
+    server.secret = secret
+
+    asyncio.run(_set_webhook(token, webhook_url, secret))
+    print(f"🤖 Супервизор слушает {listen}:{port}, воркеров: {count}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        supervisor.stop()
+        print(f"Обновлений по воркерам: {supervisor.stats()}")
+
+
+if __name__ == "__main__":
+    # Использование: python sharding.py [количество воркеров]
+    from settings import get_settings
+
+    settings = get_settings()
+    if not settings.telegram_bot_token:
+        print("❌ Ошибка: TELEGRAM_BOT_TOKEN не найден в .env файле")
+        sys.exit(1)
+    if not settings.webhook_url:
+        print("❌ Укажите WEBHOOK_URL в .env: режим воркеров получает обновления через вебхук")
+        sys.exit(1)
+
+    run_supervisor(
+        settings.telegram_bot_token,
+        int(sys.argv[1]) if len(sys.argv) > 1 else settings.worker_count,
+        settings.webhook_url,
+        settings.webhook_listen,
+        settings.webhook_port,
+        settings.webhook_secret
+    )
@@ -0,0 +1,197 @@
+import mmap
+import os
+import struct
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+# Формат файла снимка курсов (все числа little-endian):
+#   заголовок (32 байта): магическое число, версия формата, счетчик версий данных,
+#                         время снимка (unix time), количество валют N
+#   коды валют: N записей по 4 байта (3 ASCII-символа + 0)
+#   матрица float64 N x N: [i][j] - сколько единиц валюты j за 1 единицу валюты i
+#
+# Счетчик версий работает как seqlock: писатель делает его нечетным на время записи
+# и четным после нее, поэтому читатель без блокировок узнает о частично записанных данных.
+MAGIC = b"TXRT"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sIQdI")
+HEADER_SIZE = 32
+VERSION_OFFSET = 8
+CODE_SIZE = 4
+
+
+def _layout(count: int) -> Tuple[int, int]:
+    """(смещение матрицы, общий размер файла) для count валют"""
+    matrix_offset = HEADER_SIZE + count * CODE_SIZE
+    return matrix_offset, matrix_offset + count * count * 8
+
+
+class SharedRateWriter:
+    """Единственный писатель снимка курсов (процесс-обновляющий)"""
+
+    def __init__(self, path: str, currencies: List[str]):
+        self.path = path
+        self.currencies = list(currencies)
+        self.index = {code: i for i, code in enumerate(self.currencies)}
+        self.matrix_offset, size = _layout(len(self.currencies))
+
+        with open(path, "a+b") as f:
+            f.truncate(size)
+        self._file = open(path, "r+b")
+        self._mm = mmap.mmap(self._file.fileno(), size)
+
+        version = 0
+        magic, fmt, old_version, _, count = HEADER.unpack_from(self._mm, 0)
+        if magic == MAGIC and fmt == FORMAT_VERSION and count == len(self.currencies):
+            # Продолжаем нумерацию версий, чтобы читатели заметили новые данные
+            version = old_version + (old_version & 1)
+
+        HEADER.pack_into(self._mm, 0, MAGIC, FORMAT_VERSION, version, 0.0, len(self.currencies))
+        for i, code in enumerate(self.currencies):
+            struct.pack_into("4s", self._mm, HEADER_SIZE + i * CODE_SIZE, code.encode("ascii"))
+
+    def publish(self, rates: Dict[str, float], timestamp: float = None) -> int:
+        """
+        Записать новый снимок по курсам {валюта: единиц за 1 базовую валюту}.
+
+        Returns:
+            int: Новая версия данных
+        """
+        import numpy as np
+
+        vector = np.array([rates.get(code) or np.nan for code in self.currencies], dtype=np.float64)
+        count = len(self.currencies)
+        matrix = np.frombuffer(self._mm, dtype=np.float64, count=count * count,
+                               offset=self.matrix_offset).reshape(count, count)
+
+        version = struct.unpack_from("<Q", self._mm, VERSION_OFFSET)[0]
+        struct.pack_into("<Q", self._mm, VERSION_OFFSET, version + 1)
+        # Кросс-курс i -> j = rates[j] / rates[i], считается сразу в разделяемую память
+        np.divide(vector[None, :], vector[:, None], out=matrix)
+        struct.pack_into("<d", self._mm, VERSION_OFFSET + 8, timestamp or time.time())
+        struct.pack_into("<Q", self._mm, VERSION_OFFSET, version + 2)
+        del matrix
+
+        return version + 2
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+
+class SharedRateReader:
+    """Читатель снимка курсов: отображает файл в память и читает курсы без копирования"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._mm = None
+        self.index: Dict[str, int] = {}
+        self.matrix_offset = 0
+
+    def _open(self) -> bool:
+        if self._mm is not None:
+            return True
+        try:
+            with open(self.path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+
+        magic, fmt, _, _, count = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or fmt != FORMAT_VERSION or len(mm) != _layout(count)[1]:
+            mm.close()
+            return False
+
+        self.index = {
+            struct.unpack_from("4s", mm, HEADER_SIZE + i * CODE_SIZE)[0].rstrip(b"\0").decode("ascii"): i
+            for i in range(count)
+        }
+        self.matrix_offset = _layout(count)[0]
+        self._count = count
+        self._mm = mm
+        return True
+
+    def _consistent_read(self, read):
+        """Выполнить read() так, чтобы данные не менялись во время чтения (seqlock)"""
+        while True:
+            before = struct.unpack_from("<Q", self._mm, VERSION_OFFSET)[0]
+            if before & 1:
+                time.sleep(0)
+                continue
+            result = read()
+            timestamp = struct.unpack_from("<d", self._mm, VERSION_OFFSET + 8)[0]
+            if struct.unpack_from("<Q", self._mm, VERSION_OFFSET)[0] == before:
+                return result, before, timestamp
+
+    def get_rate(self, from_currency: str, to_currency: str) -> Optional[Tuple[float, float]]:
+        """
+        Курс 1 from_currency -> to_currency из снимка.
+
+        Returns:
+            tuple: (курс, время снимка) или None, если снимка или валюты нет
+        """
+        if not self._open():
+            return None
+        i, j = self.index.get(from_currency), self.index.get(to_currency)
+        if i is None or j is None:
+            return None
+
+        offset = self.matrix_offset + (i * self._count + j) * 8
+        rate, version, timestamp = self._consistent_read(lambda: struct.unpack_from("<d", self._mm, offset)[0])
+        if not version or rate != rate:  # нет данных или NaN
+            return None
+        return rate, timestamp
+
+    def get_base_rates(self, base: str) -> Optional[Tuple[Dict[str, float], int, float]]:
+        """
+        Все курсы относительно base (строка матрицы).
+
+        Returns:
+            tuple: (курсы {валюта: единиц за 1 base}, версия, время снимка) или None
+        """
+        if not self._open() or base not in self.index:
+            return None
+
+        offset = self.matrix_offset + self.index[base] * self._count * 8
+        row, version, timestamp = self._consistent_read(
+            lambda: struct.unpack_from(f"<{self._count}d", self._mm, offset)
+        )
+        if not version:
+            return None
+
+        codes = sorted(self.index, key=self.index.get)
+        return {code: rate for code, rate in zip(codes, row) if rate == rate}, version, timestamp
+
+
+def run_refresher(path: str, interval: float):
+    """
+    Процесс-обновляющий: раз в interval секунд получает курсы (один запрос к API
+    на все процессы) и публикует их в разделяемый снимок.
+    """
+    import currency_api
+    from scheduler import PRIORITY_BACKGROUND
+
+    writer = SharedRateWriter(path, currency_api.SUPPORTED_CURRENCIES)
+    try:
+        while True:
+            rates = currency_api.get_rate_matrix(ttl=0, priority=PRIORITY_BACKGROUND)
+            if rates:
+                version = writer.publish(rates, currency_api.get_rate_matrix_timestamp())
+                print(f"Снимок курсов обновлен: версия {version}, валют {len(rates)}")
+            time.sleep(interval)
+    finally:
+        writer.close()
+
+
+if __name__ == "__main__":
+    # Использование: python shared_rates.py [путь к файлу] [период обновления, секунды]
+    from settings import get_settings
+
+    settings = get_settings()
+    target = sys.argv[1] if len(sys.argv) > 1 else settings.shared_rates_file
+    if not target:
+        print("❌ Укажите путь к файлу снимка или SHARED_RATES_FILE в .env")
+        sys.exit(1)
+    run_refresher(os.path.abspath(target),
+                  float(sys.argv[2]) if len(sys.argv) > 2 else settings.shared_rates_interval)
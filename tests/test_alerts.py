@@ -0,0 +1,124 @@
+import asyncio
+import importlib
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from alerts import ALERT_ABOVE, ALERT_BELOW, AlertIndex
+
+# Матрица курсов за 1 USD: 1 THB = 2.5 RUB
+RATES = {"USD": 1.0, "THB": 36.0, "RUB": 90.0}
+
+
+def _alert(alert_id, direction, threshold, from_currency="THB", to_currency="RUB"):
+    return {'id': alert_id, 'from_currency': from_currency, 'to_currency': to_currency,
+            'direction': direction, 'threshold': threshold}
+
+
+@pytest.mark.parametrize("direction, threshold, triggered", [
+    (ALERT_ABOVE, 2.4, True),
+    (ALERT_ABOVE, 2.5, True),
+    (ALERT_ABOVE, 2.6, False),
+    (ALERT_BELOW, 2.6, True),
+    (ALERT_BELOW, 2.5, True),
+    (ALERT_BELOW, 2.4, False),
+])
+def test_alert_index_evaluate(direction, threshold, triggered):
+    index = AlertIndex()
+    index.add(_alert(1, direction, threshold))
+
+    result = index.evaluate(RATES)
+
+    assert [alert['id'] for alert, _ in result] == ([1] if triggered else [])
+    assert len(index) == (0 if triggered else 1)
+
+
+def test_alert_index_fires_once():
+    index = AlertIndex()
+    index.add(_alert(1, ALERT_BELOW, 2.6))
+
+    assert len(index.evaluate(RATES)) == 1
+    assert index.evaluate(RATES) == []
+
+
+def test_alert_index_remove():
+    index = AlertIndex()
+    index.add(_alert(1, ALERT_BELOW, 2.6))
+    index.remove(1)
+
+    assert index.evaluate(RATES) == []
+
+
+@pytest.fixture(scope="module")
+def bot_module(tmp_path_factory):
+    # bot при импорте создает базу в текущем каталоге
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("bot"))
+    try:
+        return importlib.import_module("bot")
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture
+def bot(bot_module, tmp_path, monkeypatch):
+    import currency_api
+    from database import Database
+
+    monkeypatch.setattr(bot_module, "db", Database(str(tmp_path / "alerts.db")))
+    monkeypatch.setattr(bot_module, "alert_index", AlertIndex())
+    monkeypatch.setitem(currency_api._rate_matrix, 'rates', RATES)
+    monkeypatch.setitem(currency_api._rate_matrix, 'timestamp', time.time())
+    return bot_module
+
+
+def _run_alert_command(bot, *args):
+    replies = []
+
+    async def reply_text(text, **kwargs):
+        replies.append(text)
+
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=1), effective_chat=SimpleNamespace(id=1),
+                             message=SimpleNamespace(reply_text=reply_text))
+    asyncio.run(bot.alert_command(update, SimpleNamespace(args=list(args))))
+    return replies
+
+
+@pytest.mark.parametrize("args, direction, threshold", [
+    (("THB", "RUB", ">", "2.6"), ALERT_ABOVE, 2.6),
+    (("THB", "RUB", "<", "2.4"), ALERT_BELOW, 2.4),
+    (("thb", "rub", "<", "2,4"), ALERT_BELOW, 2.4),
+    # Без направления подписка ждет пересечения порога с текущей стороны (курс 2.5)
+    (("THB", "RUB", "3"), ALERT_ABOVE, 3.0),
+    (("THB", "RUB", "2"), ALERT_BELOW, 2.0),
+])
+def test_alert_command_creates_alert(bot, args, direction, threshold):
+    replies = _run_alert_command(bot, *args)
+
+    alerts = bot.db.get_alerts(1)
+    assert len(alerts) == 1
+    assert (alerts[0]['from_currency'], alerts[0]['to_currency']) == ("THB", "RUB")
+    assert alerts[0]['direction'] == direction
+    assert alerts[0]['threshold'] == threshold
+    assert len(bot.alert_index) == 1
+    assert replies[0].startswith(f"🔔 Подписка #{alerts[0]['id']}")
+
+
+@pytest.mark.parametrize("args", [
+    (),
+    ("THB", "RUB"),
+    ("THB", "RUB", "=", "2.5"),
+    ("THB", "RUB", ">", "2.5", "extra"),
+    ("XXX", "RUB", "2.5"),
+    ("THB", "RUB", "abc"),
+    ("THB", "RUB", "<", "0"),
+    ("THB", "RUB", "-1"),
+])
+def test_alert_command_rejects(bot, args):
+    replies = _run_alert_command(bot, *args)
+
+    assert bot.db.get_alerts(1) == []
+    assert len(bot.alert_index) == 0
+    assert replies[0].startswith("❌")
@@ -0,0 +1,70 @@
+from decimal import Decimal
+
+import pytest
+
+from expense_parser import evaluate_expression, parse_amounts
+
+
+@pytest.mark.parametrize("expression, expected", [
+    ("120", Decimal("120")),
+    ("7,5", Decimal("7.5")),
+    ("7.5", Decimal("7.5")),
+    ("2*50+30", Decimal("130")),
+    ("3x120", Decimal("360")),
+    ("3X120", Decimal("360")),
+    ("3х120", Decimal("360")),
+    ("3Х120", Decimal("360")),
+    ("3×120", Decimal("360")),
+    ("0.1+0.2", Decimal("0.3")),
+    ("2*3*4", Decimal("24")),
+])
+def test_evaluate_expression(expression, expected):
+    assert evaluate_expression(expression) == expected
+
+
+@pytest.mark.parametrize("expression", [
+    "",
+    "+5",
+    "5+",
+    "2++3",
+    "2**3",
+    "abc",
+    "5-3",
+    "(2+3)*4",
+    "1.2.3",
+    "__import__('os')",
+])
+def test_evaluate_expression_rejects(expression):
+    with pytest.raises(ValueError):
+        evaluate_expression(expression)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("120", [120.0]),
+    ("120 45 3*120", [120.0, 45.0, 360.0]),
+    ("3 * 120", [360.0]),
+    ("3 x 120", [360.0]),
+    ("3 X 120", [360.0]),
+    ("3 Х 120", [360.0]),
+    ("3 × 120", [360.0]),
+    ("2 * 50 + 30", [130.0]),
+    ("7,5; 10", [7.5, 10.0]),
+    ("100\n200", [100.0, 200.0]),
+    ("  42  ", [42.0]),
+])
+def test_parse_amounts(text, expected):
+    assert parse_amounts(text) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "   ",
+    "привет",
+    "0",
+    "120 abc",
+    "5 - 3",
+    "3 x",
+    "0*100",
+])
+def test_parse_amounts_rejects(text):
+    assert parse_amounts(text) is None
@@ -0,0 +1,232 @@
+import contextvars
+import functools
+import inspect
+import itertools
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+# Сколько спанов хранить в одной трассе; остальные только подсчитываются
+MAX_SPANS = 500
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+_current_span = contextvars.ContextVar("span", default=None)
+
+# Логгер с ротацией файла (None - трассировка выключена) и порог записи трасс (секунды)
+_logger = None
+_slow_threshold = 0.0
+
+
+class Span:
+    """Отрезок времени внутри трассы: вызов функции, запрос или обработка Update"""
+
+    __slots__ = ("span_id", "parent_id", "name", "attrs", "start", "end", "error")
+
+    def __init__(self, span_id: int, parent_id: Optional[int], name: str, attrs: Dict):
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.end = None
+        self.error = None
+
+    def set(self, key: str, value):
+        """Добавить атрибут спана"""
+        self.attrs[key] = value
+
+
+class _Trace:
+    def __init__(self, name: str, attrs: Dict):
+        self.trace_id = os.urandom(8).hex()
+        self.started_at = time.time()
+        self._ids = itertools.count(1)
+        self.root = Span(0, None, name, attrs)
+        self.spans = []
+        self.dropped = 0
+
+    def new_span(self, parent: Optional[Span], name: str, attrs: Dict) -> Span:
+        return Span(next(self._ids), parent.span_id if parent else 0, name, attrs)
+
+    def add(self, span: Span):
+        if len(self.spans) < MAX_SPANS:
+            self.spans.append(span)
+        else:
+            self.dropped += 1
+
+    def to_dict(self) -> Dict:
+        origin = self.root.start
+
+        def export(span: Span) -> Dict:
+            data = {'id': span.span_id, 'parent': span.parent_id, 'name': span.name,
+                    'start_ms': round((span.start - origin) * 1000, 3),
+                    'duration_ms': round((span.end - span.start) * 1000, 3)}
+            if span.attrs:
+                data['attrs'] = span.attrs
+            if span.error:
+                data['error'] = span.error
+            return data
+
+        root = export(self.root)
+        return {
+            'trace_id': self.trace_id,
+            'time': self.started_at,
+            'name': self.root.name,
+            'duration_ms': root['duration_ms'],
+            'attrs': self.root.attrs,
+            'error': self.root.error,
+            'spans': [export(span) for span in sorted(self.spans, key=lambda span: span.start)],
+            'dropped': self.dropped
+        }
+
+
+def configure(path: str, max_bytes: int = 10 * 1024 * 1024, backups: int = 5, slow_ms: float = 0):
+    """
+    Включить запись трасс в файл JSON Lines (одна строка - одна трасса) с ротацией.
+
+    Args:
+        path (str): Путь к файлу
+        max_bytes (int): Размер файла, после которого он переименовывается в path.1
+        backups (int): Сколько старых файлов хранить
+        slow_ms (float): Записывать только трассы не короче этого времени (миллисекунды)
+    """
+    global _logger, _slow_threshold
+    # logging нужен только при включенной трассировке
+    import logging
+    from logging.handlers import RotatingFileHandler
+
+    handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger = logging.getLogger(f"travel_wallet.traces.{path}")
+    logger.handlers[:] = [handler]
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    _slow_threshold = slow_ms / 1000
+    _logger = logger
+
+
+def is_enabled() -> bool:
+    return _logger is not None
+
+
+def current_trace_id() -> Optional[str]:
+    """ID текущей трассы (None вне трассы)"""
+    current = _current_trace.get()
+    return current.trace_id if current else None
+
+
+@contextmanager
+def trace(name: str, **attrs):
+    """
+    Начать трассу: все спаны внутри (в том числе в asyncio.to_thread) попадут в нее.
+
+    Внутри другой трассы работает как обычный спан.
+    """
+    if _logger is None or _current_trace.get() is not None:
+        with span(name, **attrs) as current:
+            yield current
+        return
+
+    current = _Trace(name, attrs)
+    trace_token = _current_trace.set(current)
+    span_token = _current_span.set(current.root)
+    try:
+        yield current.root
+    except BaseException as e:
+        current.root.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.root.end = time.perf_counter()
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        if current.root.end - current.root.start >= _slow_threshold:
+            _export(current)
+
+
+def _export(current: _Trace):
+    try:
+        _logger.info(json.dumps(current.to_dict(), ensure_ascii=False, default=str))
+    except Exception as e:
+        print(f"Ошибка записи трассы: {e}")
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Спан внутри текущей трассы; вне трассы ничего не записывает"""
+    current = _current_trace.get()
+    if current is None:
+        yield None
+        return
+
+    item = current.new_span(_current_span.get(), name, attrs)
+    token = _current_span.set(item)
+    try:
+        yield item
+    except BaseException as e:
+        item.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        item.end = time.perf_counter()
+        _current_span.reset(token)
+        current.add(item)
+
+
+def _result_attrs(item: Span, result):
+    """Результаты в формате {'success', 'error', ...}, принятом в проекте, попадают в атрибуты спана"""
+    if isinstance(result, dict):
+        for key in ('success', 'status_code', 'throttled'):
+            if result.get(key) is not None:
+                item.set(key, result[key])
+
+
+def traced(name: Optional[str] = None, attrs: Optional[Callable[..., Dict]] = None):
+    """
+    Декоратор: вызов функции - спан name (по умолчанию - имя функции).
+
+    attrs - функция от аргументов вызова, возвращающая атрибуты спана.
+    Вне трассы декоратор только вызывает функцию.
+    """
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                current = _current_trace.get()
+                if current is None:
+                    return (yield from func(*args, **kwargs))
+                # Генератор перебирается вызывающим кодом вперемешку с другими вызовами,
+                # поэтому его спан не становится родителем: он только измеряет время
+                # от первого шага до закрытия
+                item = current.new_span(_current_span.get(), span_name,
+                                        attrs(*args, **kwargs) if attrs else {})
+                try:
+                    return (yield from func(*args, **kwargs))
+                finally:
+                    item.end = time.perf_counter()
+                    current.add(item)
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_trace.get() is None:
+                return func(*args, **kwargs)
+            with span(span_name, **(attrs(*args, **kwargs) if attrs else {})) as item:
+                result = func(*args, **kwargs)
+                _result_attrs(item, result)
+                return result
+        return wrapper
+    return decorator
+
+
+def trace_methods(prefix: str, exclude: Tuple[str, ...] = ()):
+    """Декоратор класса: каждый публичный метод, кроме exclude, - спан "<prefix>.<метод>\""""
+    def decorator(cls):
+        for attribute, value in list(vars(cls).items()):
+            if not attribute.startswith("_") and attribute not in exclude and inspect.isfunction(value):
+                setattr(cls, attribute, traced(f"{prefix}.{attribute}")(value))
+        return cls
+    return decorator
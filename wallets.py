@@ -0,0 +1,43 @@
+from typing import Dict, Optional, Tuple
+
+from database import Database
+
+
+def revalue_pockets(db: Database, rates: Dict[str, float], shard: Optional[Tuple[int, int]] = None) -> int:
+    """
+    Пересчитать стоимость всех валютных кошельков всех путешествий по новой матрице курсов.
+
+    Кошельки загружаются колонками и пересчитываются одной векторной операцией NumPy,
+    без отдельного запроса курса для каждого кошелька.
+
+    Args:
+        db (Database): База данных
+        rates (dict): Матрица курсов {код валюты: единиц за 1 базовую валюту}
+        shard (tuple, optional): (номер, количество) воркера: пересчитываются только
+            путешествия его пользователей, чтобы воркеры не переписывали одни и те же кошельки
+
+    Returns:
+        int: Количество пересчитанных кошельков
+    """
+    # NumPy нужен только при пересчете, поэтому не замедляет запуск бота
+    import numpy as np
+    
+    ids, amounts, currencies, home_currencies = db.get_pocket_columns(shard)
+    if not ids:
+        return 0
+
+    # Вектор курсов; валюты, которых нет в матрице, получают NaN
+    codes, inverse = np.unique(np.array(currencies + home_currencies), return_inverse=True)
+    rate_vector = np.array([rates.get(code) or np.nan for code in codes], dtype=np.float64)
+
+    pocket_rates = rate_vector[inverse[:len(ids)]]
+    home_rates = rate_vector[inverse[len(ids):]]
+
+    # 1 единица валюты кошелька = home_rate / pocket_rate единиц домашней валюты
+    values = np.asarray(amounts, dtype=np.float64) * home_rates / pocket_rates
+
+    # Кошельки без курса оставляем с прежней стоимостью
+    known = np.isfinite(values)
+    return db.update_pocket_values(
+        list(zip(values[known].tolist(), np.asarray(ids)[known].tolist()))
+    )
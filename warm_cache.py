@@ -0,0 +1,75 @@
+import gzip
+import json
+import os
+import time
+from typing import Dict
+
+import currency_api
+from callbacks import PendingActionStore
+
+# Версия формата файла; файл другой версии при запуске игнорируется
+SNAPSHOT_VERSION = 1
+
+# Файл старше этого возраста (секунды) при запуске не используется целиком
+SNAPSHOT_MAX_AGE = 24 * 60 * 60
+
+
+def save_snapshot(path: str, pending_actions: PendingActionStore) -> int:
+    """
+    Сохранить кэши курсов, список валют и неподтвержденные действия пользователей в файл.
+
+    Файл - JSON, сжатый gzip. Запись атомарная: сначала во временный файл,
+    затем замена, поэтому при сбое во время записи старый снимок не портится.
+
+    Returns:
+        int: Размер файла в байтах
+    """
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'saved_at': time.time(),
+        'currency_api': currency_api.export_cache_state(),
+        'pending_actions': pending_actions.export()
+    }
+
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump(snapshot, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+def load_snapshot(path: str, pending_actions: PendingActionStore,
+                  max_age: float = SNAPSHOT_MAX_AGE) -> Dict[str, int]:
+    """
+    Загрузить снимок, сохраненный save_snapshot(), с проверкой версии и возраста.
+
+    Курсы и список валют дополнительно проверяются на возраст по своим TTL
+    (см. currency_api.restore_cache_state), просроченные действия отбрасываются.
+
+    Returns:
+        dict: Количество восстановленных записей по разделам (пустой, если файл не подошел)
+    """
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"Не удалось прочитать снимок кэша {path}: {e}")
+        return {}
+
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        return {}
+
+    age = time.time() - snapshot.get('saved_at', 0)
+    if age < 0 or age > max_age:
+        return {}
+
+    # Время жизни действий отсчитывается от момента сохранения
+    pending = [(token, ttl_left - age, payload)
+               for token, ttl_left, payload in snapshot.get('pending_actions', [])]
+
+    return {
+        'currency_api': currency_api.restore_cache_state(snapshot.get('currency_api') or {}),
+        'pending_actions': pending_actions.restore(pending)
+    }